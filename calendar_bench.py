@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the Personal Calendar & Task Manager
+Generates synthetic calendar_data.json files and times loading, saving,
+month queries and the GUI refresh paths, reporting JSON for comparison
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+from calendar_store import CalendarStore
+
+WORDS = ("meeting dentist call review lunch gym standup report doctor school "
+         "pickup dinner planning sync budget interview haircut vet payment").split()
+
+
+def generate_data_file(path, appointments, tasks, seed=0, years=10, titles=0):
+    # Written day by day so even the largest files never sit in memory at once.
+    # With `titles`, appointment texts are drawn from that many distinct ones
+    rng = random.Random(seed)
+    first = date(2016, 1, 1)
+    days = years * 365
+    per_day = [0] * days
+    for _ in range(appointments):
+        per_day[rng.randrange(days)] += 1
+
+    def text():
+        return f"{rng.choice(WORDS)} {rng.choice(WORDS)} #{rng.randrange(100000)}"
+
+    pool = [text() for _ in range(titles)]
+
+    def appointment_text():
+        return rng.choice(pool) if pool else text()
+
+    with open(path, 'w') as f:
+        f.write('{"appointments": {')
+        sep = ''
+        for offset, count in enumerate(per_day):
+            if count:
+                day = (first + timedelta(days=offset)).isoformat()
+                f.write(f'{sep}{json.dumps(day)}: {json.dumps([appointment_text() for _ in range(count)])}')
+                sep = ', '
+        f.write('}, "todo_today": ')
+        json.dump([text() for _ in range(min(tasks, 50))], f)
+        f.write(', "todo_later": ')
+        json.dump([text() for _ in range(tasks)], f)
+        f.write('}')
+    return os.path.getsize(path)
+
+
+def summarize(samples):
+    samples = sorted(samples)
+
+    def pct(p):
+        return samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))] * 1000
+
+    return {
+        'n': len(samples),
+        'mean_ms': sum(samples) / len(samples) * 1000,
+        'p50_ms': pct(50),
+        'p90_ms': pct(90),
+        'p99_ms': pct(99),
+        'max_ms': samples[-1] * 1000
+    }
+
+
+def measure(fn, repeat, setup=None):
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def traced_memory(fn):
+    # Returns (peak, still allocated afterwards, result)
+    tracemalloc.start()
+    try:
+        result = fn()
+        current, peak = tracemalloc.get_traced_memory()
+        return peak, current, result
+    finally:
+        tracemalloc.stop()
+
+
+def open_store(path, backend, archive_after=0):
+    store = CalendarStore(path, backend=backend, autosave=False, archive_after=archive_after)
+    store.load()
+    return store
+
+
+def bench_store(path, backend, repeat, archive_after=0):
+    results = {}
+    memory = {}
+
+    # The first SQLite open imports the JSON file; keep that out of the timings
+    # (and with --archive-after, the first JSON snapshot archives past years)
+    open_store(path, backend, archive_after).close()
+
+    results['load'] = measure(lambda: open_store(path, backend, archive_after).close(), repeat)
+    memory['load'], memory['retained'], store = traced_memory(
+        lambda: open_store(path, backend, archive_after))
+
+    today = date(2020, 6, 15)
+    counter = iter(range(10 ** 9))
+
+    def edit_and_flush():
+        store.add_appointment(today, f"bench {next(counter)}")
+        store.flush()
+
+    results['edit_and_flush'] = measure(edit_and_flush, repeat)
+    if backend == 'json':
+        results['full_snapshot'] = measure(lambda: store.storage.flush(compact=True), repeat)
+
+    months = [(year, month) for year in range(2016, 2026) for month in range(1, 13)]
+    rng = random.Random(1)
+    results['month_counts'] = measure(lambda: store.month_counts(*rng.choice(months)), repeat * 20)
+    results['appointments_on'] = measure(
+        lambda: store.appointments_on(date(2016, 1, 1) + timedelta(days=rng.randrange(3650))), repeat * 20)
+
+    def month_range():
+        year, month = rng.choice(months)
+        first = date(year, month, 1)
+        store.appointments_between(first, first + timedelta(days=30))
+
+    results['appointments_between'] = measure(month_range, repeat * 20)
+
+    store.close()
+    return results, memory
+
+
+@contextlib.contextmanager
+def display(mode):
+    # Yields None when a display is available, or a reason string to skip
+    if mode == 'no':
+        yield "disabled with --gui no"
+        return
+    if os.environ.get('DISPLAY') or sys.platform in ('win32', 'darwin'):
+        yield None
+        return
+    xvfb = shutil.which('Xvfb')
+    if xvfb is None:
+        if mode == 'yes':
+            raise SystemExit("No display and Xvfb not found")
+        yield "skipped: no DISPLAY and Xvfb not installed"
+        return
+    proc = subprocess.Popen([xvfb, ':97', '-screen', '0', '1280x1024x24'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.environ['DISPLAY'] = ':97'
+    time.sleep(1)
+    try:
+        yield None
+    finally:
+        proc.terminate()
+        proc.wait()
+        del os.environ['DISPLAY']
+
+
+def bench_gui(path, backend, repeat, archive_after=0):
+    import tkinter as tk
+    from calendarap import CalendarApp
+
+    root = tk.Tk()
+    root.withdraw()
+    results = {}
+
+    # Startup: until the empty window is up, and until data and search are loaded
+    skeleton, ready = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        app = CalendarApp(root, backend=backend, data_file=path, archive_after=archive_after)
+        root.update_idletasks()
+        skeleton.append(time.perf_counter() - start)
+        while not app.loader_done:
+            root.update()
+            time.sleep(0.001)
+        ready.append(time.perf_counter() - start)
+        app.shutdown()
+        for child in root.winfo_children():
+            child.destroy()
+    results['startup_skeleton'] = summarize(skeleton)
+    results['startup_ready'] = summarize(ready)
+
+    app = CalendarApp(root, backend=backend, data_file=path, background_load=False,
+                      archive_after=archive_after)
+    app.current_date = date(2020, 6, 1)
+    app.update_calendar()
+    root.update_idletasks()
+
+    def run(fn):
+        def step():
+            fn()
+            root.update_idletasks()
+        return step
+
+    results['update_calendar'] = measure(run(app.update_calendar), repeat)
+    results['next_month'] = measure(run(app.next_month), repeat)
+    days = [date(2020, 6, 1) + timedelta(days=i) for i in range(28)]
+    rng = random.Random(2)
+    app.current_date = date(2020, 6, 1)
+    app.update_calendar()
+    results['select_date'] = measure(run(lambda: app.select_date(rng.choice(days))), repeat)
+    results['update_task_lists'] = measure(run(app.update_task_lists), repeat)
+
+    app.shutdown()
+    root.destroy()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the calendar data and GUI paths")
+    parser.add_argument('--sizes', default='1000,100000,1000000',
+                        help="comma-separated appointment counts (default: %(default)s)")
+    parser.add_argument('--tasks', type=int, default=10000,
+                        help="entries in the 'later' task list (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=5, help="samples per measurement")
+    parser.add_argument('--backend', choices=['json', 'sqlite'], default='json')
+    parser.add_argument('--gui', choices=['auto', 'yes', 'no'], default='auto',
+                        help="time GUI paths (auto: only if a display or Xvfb is available)")
+    parser.add_argument('--titles', type=int, default=0,
+                        help="draw appointment texts from this many distinct ones "
+                             "(default: nearly every text is different)")
+    parser.add_argument('--archive-after', metavar='DAYS', type=int, default=0,
+                        help="archive past years as the app does with this setting "
+                             "(default: 0, never, so runs stay comparable)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'backend': args.backend,
+            'repeat': args.repeat,
+            'seed': args.seed,
+            'tasks': args.tasks,
+            'titles': args.titles,
+            'archive_after': args.archive_after
+        },
+        'results': []
+    }
+
+    workdir = tempfile.mkdtemp(prefix='calendar-bench-')
+    try:
+        # The app and stores print progress; keep stdout for the report
+        with contextlib.redirect_stdout(sys.stderr), display(args.gui) as skip_gui:
+            for size in (int(s) for s in args.sizes.split(',')):
+                path = os.path.join(workdir, f'calendar_{size}.json')
+                print(f"Generating {size} appointments...")
+                entry = {'appointments': size,
+                         'file_bytes': generate_data_file(path, size, args.tasks, args.seed,
+                                                          titles=args.titles)}
+                print(f"Benchmarking store with {size} appointments...")
+                entry['store'], entry['peak_memory_bytes'] = bench_store(
+                    path, args.backend, args.repeat, args.archive_after)
+                if skip_gui:
+                    entry['gui'] = skip_gui
+                else:
+                    print(f"Benchmarking GUI with {size} appointments...")
+                    entry['gui'] = bench_gui(path, args.backend, args.repeat, args.archive_after)
+                report['results'].append(entry)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Command-line interface for the Personal Calendar & Task Manager
+Works on the same data file as the desktop app without needing a display
+"""
+
+import argparse
+import contextlib
+import json
+import sys
+from datetime import date, datetime, timedelta
+
+from calendar_io import FORMATS, detect_format, merge, read_records, write_records
+from calendar_model import Appointment
+from calendar_store import DEFAULT_DATA_FILE, CalendarStore, parse_date, parse_time_range
+
+
+def open_store(args):
+    store = CalendarStore(args.data_file, backend=args.backend, autosave=False,
+                          archive_after=args.archive_after)
+    # Keep load messages out of output that may be piped elsewhere
+    with contextlib.redirect_stdout(sys.stderr):
+        store.load()
+    return store
+
+
+def iter_range(store, start, end):
+    # Bounded ranges use the date query; open-ended ones stream every day
+    if start is None and end is None:
+        return store.iter_appointments()
+    start = parse_date(start) if start else date.min
+    end = parse_date(end) if end else date.max
+    if (end - start).days <= 3660:
+        return sorted(store.appointments_between(start, end).items())
+    first, last = start.isoformat(), end.isoformat()
+    return ((date_str, appts) for date_str, appts in store.iter_appointments()
+            if first <= date_str <= last)
+
+
+def read_entries(stream):
+    for line_num, line in enumerate(stream, start=1):
+        line = line.rstrip('\n')
+        if not line.strip():
+            continue
+        date_str, sep, text = line.partition('\t')
+        if not sep or not text:
+            raise ValueError(f"line {line_num}: expected 'YYYY-MM-DD<TAB>text'")
+        yield parse_date(date_str.strip()), text
+
+
+def cmd_list(store, args):
+    if args.start and args.end:
+        # Repeating appointments can only be expanded over a bounded range
+        days = dict(iter_range(store, args.start, args.end))
+        for date_str, items in store.occurrences_between(args.start, args.end).items():
+            days.setdefault(date_str, []).extend(f"↻ {text}" for rule_id, text in items)
+        days = sorted(days.items())
+    else:
+        days = iter_range(store, args.start, args.end)
+    for date_str, appts in days:
+        for appt in appts:
+            print(f"{date_str}\t{appt}")
+
+
+def cmd_tasks(store, args):
+    for list_name in ('today', 'later'):
+        for task, done in zip(store.task_list(list_name), store.task_done(list_name)):
+            print(f"{list_name}\t{'✓ ' if done else ''}{task}")
+
+
+def task_json(store, list_name):
+    # As in calendar_data.json: a string, or {"text", "done"} once done
+    return [{'text': task, 'done': True} if done else task
+            for task, done in zip(store.task_list(list_name), store.task_done(list_name))]
+
+
+def cmd_add(store, args):
+    time, duration = parse_time_range(args.time or '')
+    if time is not None:
+        for day, other in store.conflicts(args.date, time, duration):
+            print(f"Warning: overlaps {day.isoformat()} {other.time_range()} {other.text}", file=sys.stderr)
+    store.add_appointment(args.date, args.text, time, duration)
+
+
+def cmd_free(store, args):
+    day_start, length = parse_time_range(args.hours)
+    if day_start is None or length is None:
+        raise ValueError("--hours needs a start and an end, e.g. 09:00-17:00")
+    start = parse_date(args.start) if args.start else datetime.now()
+    end = parse_date(args.end) if args.end else parse_date(start) + timedelta(days=30)
+    slot = store.find_free_slot(start, end, args.minutes, day_start, day_start + length)
+    if slot is None:
+        print("No free slot found", file=sys.stderr)
+        return
+    day, time = slot
+    print(f"{day.isoformat()}\t{Appointment('', time, args.minutes).time_range()}")
+
+
+def cmd_bulk_add(store, args):
+    count = 0
+    with contextlib.ExitStack() as stack:
+        stream = sys.stdin if args.file == '-' else stack.enter_context(open(args.file))
+        with store.batch():
+            for day, text in read_entries(stream):
+                store.add_appointment(day, text)
+                count += 1
+    print(f"Added {count} appointments", file=sys.stderr)
+
+
+def cmd_remove(store, args):
+    if args.start is None and args.end is None and args.match is None and not args.all:
+        raise ValueError("refusing to remove everything; give --from/--to, --match or --all")
+    # Collect first so removals do not disturb the iteration
+    doomed = [(date_str, index, appt)
+              for date_str, appts in iter_range(store, args.start, args.end)
+              for index, appt in enumerate(appts)
+              if args.match is None or args.match in appt]
+    with store.batch():
+        for date_str, index, appt in reversed(doomed):
+            store.remove_appointment(date_str, index, appt)
+    print(f"Removed {len(doomed)} appointments", file=sys.stderr)
+
+
+def cmd_add_task(store, args):
+    store.add_task(args.list, args.text)
+
+
+def cmd_export(store, args):
+    fmt = args.format or detect_format(args.file)
+    if fmt != 'json':
+        with contextlib.ExitStack() as stack:
+            out = sys.stdout if args.file == '-' else stack.enter_context(
+                open(args.file, 'w', newline='', encoding='utf-8'))
+            count = write_records(store, out, fmt)
+        print(f"Exported {count} entries", file=sys.stderr)
+        return
+
+    data = {
+        'appointments': {date_str: [appt.to_json() for appt in appts]
+                         for date_str, appts in store.iter_appointments(entries=True)},
+        'todo_today': task_json(store, 'today'),
+        'todo_later': task_json(store, 'later'),
+        'recurring': store.recurring_rules()
+    }
+    with contextlib.ExitStack() as stack:
+        out = sys.stdout if args.file == '-' else stack.enter_context(open(args.file, 'w'))
+        json.dump(data, out, indent=2)
+
+
+def cmd_import(store, args):
+    fmt = args.format or detect_format(args.file)
+    if fmt != 'json':
+        # Streamed record by record and merged in a single batch
+        with contextlib.ExitStack() as stack:
+            stream = sys.stdin if args.file == '-' else stack.enter_context(
+                open(args.file, newline='', encoding='utf-8-sig'))
+            added, skipped = merge(store, read_records(stream, fmt))
+        print(f"Imported {added} new entries, skipped {skipped} already present", file=sys.stderr)
+        return
+
+    with contextlib.ExitStack() as stack:
+        stream = sys.stdin if args.file == '-' else stack.enter_context(open(args.file))
+        data = json.load(stream)
+
+    added = 0
+    with store.batch():
+        for date_str, appts in sorted(data.get('appointments', {}).items()):
+            existing = set(store.appointments_on(date_str))
+            for appt in map(Appointment.from_json, appts):
+                if appt.text not in existing:
+                    store.add_appointment(date_str, appt.text, appt.time, appt.duration)
+                    existing.add(appt.text)
+                    added += 1
+        for list_name in ('today', 'later'):
+            existing = set(store.task_list(list_name))
+            for task in data.get('todo_' + list_name, []):
+                text, done = (task, False) if isinstance(task, str) else (task['text'], task.get('done', False))
+                if text not in existing:
+                    store.add_task(list_name, text, done)
+                    existing.add(text)
+                    added += 1
+        known = {rule['id'] for rule in store.recurring_rules()}
+        for rule in data.get('recurring', []):
+            if rule['id'] not in known:
+                store.apply({'op': 'add_rule', 'rule': rule})
+                added += 1
+    print(f"Imported {added} new entries", file=sys.stderr)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Personal Calendar & Task Manager (command line)")
+    parser.add_argument('--backend', choices=['json', 'sqlite'], default='json',
+                        help="storage backend, as for the desktop app")
+    parser.add_argument('--data-file', default=DEFAULT_DATA_FILE,
+                        help="data file (default: %(default)s)")
+    parser.add_argument('--archive-after', metavar='DAYS', type=int, default=365,
+                        help="archive years that ended more than DAYS ago, as the desktop app "
+                             "does (0: never)")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('list', help="list appointments, optionally within a date range "
+                                    "(repeating ones only when both ends are given)")
+    p.add_argument('--from', dest='start', help="first date (YYYY-MM-DD)")
+    p.add_argument('--to', dest='end', help="last date (YYYY-MM-DD)")
+    p.set_defaults(func=cmd_list)
+
+    p = sub.add_parser('tasks', help="list both task lists")
+    p.set_defaults(func=cmd_tasks)
+
+    p = sub.add_parser('add', help="add one appointment")
+    p.add_argument('date', help="date (YYYY-MM-DD)")
+    p.add_argument('text')
+    p.add_argument('--time', help="start time, or start and end (e.g. 09:30-10:15); "
+                                  "overlaps are reported on stderr")
+    p.set_defaults(func=cmd_add)
+
+    p = sub.add_parser('free', help="find the first free slot of a number of minutes")
+    p.add_argument('minutes', type=int)
+    p.add_argument('--from', dest='start', help="first date (default: now)")
+    p.add_argument('--to', dest='end', help="last date (default: 30 days on)")
+    p.add_argument('--hours', default='09:00-17:00',
+                   help="part of each day to search (default: %(default)s)")
+    p.set_defaults(func=cmd_free)
+
+    p = sub.add_parser('bulk-add', help="add appointments from 'YYYY-MM-DD<TAB>text' lines")
+    p.add_argument('file', nargs='?', default='-', help="input file (default: stdin)")
+    p.set_defaults(func=cmd_bulk_add)
+
+    p = sub.add_parser('remove', help="remove appointments by date range and/or text")
+    p.add_argument('--from', dest='start', help="first date (YYYY-MM-DD)")
+    p.add_argument('--to', dest='end', help="last date (YYYY-MM-DD)")
+    p.add_argument('--match', help="only remove appointments containing this text")
+    p.add_argument('--all', action='store_true', help="allow removing every appointment")
+    p.set_defaults(func=cmd_remove)
+
+    p = sub.add_parser('add-task', help="add a task")
+    p.add_argument('list', choices=['today', 'later'])
+    p.add_argument('text')
+    p.set_defaults(func=cmd_add_task)
+
+    p = sub.add_parser('export', help="write all data in calendar_data.json format, "
+                                      "or appointments as iCalendar or CSV")
+    p.add_argument('file', nargs='?', default='-', help="output file (default: stdout)")
+    p.add_argument('--format', choices=FORMATS,
+                   help="file format (default: from the file extension, else json)")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser('import', help="merge a calendar_data.json, iCalendar or CSV file, "
+                                      "skipping duplicates")
+    p.add_argument('file', nargs='?', default='-', help="input file (default: stdin)")
+    p.add_argument('--format', choices=FORMATS,
+                   help="file format (default: from the file extension, else json)")
+    p.set_defaults(func=cmd_import)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    store = open_store(args)
+    ok = False
+    try:
+        args.func(store, args)
+        ok = True
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        # A command that fails partway saves none of its edits, so the
+        # same input can simply be run again once it is fixed
+        store.close(save=ok)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
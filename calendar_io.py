@@ -0,0 +1,438 @@
+"""
+iCalendar and CSV import/export for the Personal Calendar & Task Manager
+Files are read and written one record at a time, so even very large
+exports are handled in constant memory
+"""
+
+import csv
+import hashlib
+import itertools
+import os
+import re
+import uuid
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone
+
+from calendar_model import MINUTES_PER_DAY, parse_time
+from calendar_recurrence import FREQUENCIES, make_rule
+from calendar_store import parse_date, parse_time_range
+
+FORMATS = ('json', 'ics', 'csv')
+
+PRODID = "-//Personal Calendar & Task Manager//EN"
+UID_DOMAIN = "personal-calendar"
+
+
+def detect_format(path, default='json'):
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ('.ics', '.ical', '.ifb'):
+        return 'ics'
+    if ext == '.csv':
+        return 'csv'
+    return default
+
+
+def merge(store, records):
+    """Add ('appt', date, text, time, duration) and ('rule', rule)
+    records to `store`, skipping ones it already has. time and duration
+    are in minutes and may be None. Saved once, at the end."""
+    added = skipped = 0
+    known = {rule['id'] for rule in store.recurring_rules()}
+    # Exports are usually in date order, so keep the texts of the last few
+    # days at hand instead of querying the store for every record
+    days = OrderedDict()
+    with store.batch():
+        for record in records:
+            if record[0] == 'rule':
+                rule = record[1]
+                if rule['id'] in known:
+                    skipped += 1
+                    continue
+                store.apply({'op': 'add_rule', 'rule': rule})
+                known.add(rule['id'])
+            else:
+                day, text, time, duration = record[1:]
+                existing = days.get(day)
+                if existing is None:
+                    existing = days[day] = {(appt.text, appt.time, appt.duration)
+                                            for appt, rule_id, index in store.day_entries(day)
+                                            if rule_id is None}
+                    if len(days) > 256:
+                        days.popitem(last=False)
+                if (text, time, duration) in existing:
+                    skipped += 1
+                    continue
+                store.add_appointment(day, text, time, duration)
+                existing.add((text, time, duration))
+            added += 1
+    return added, skipped
+
+
+# iCalendar (RFC 5545)
+
+def _escape(text):
+    return (text.replace('\\', '\\\\').replace(';', '\\;')
+                .replace(',', '\\,').replace('\n', '\\n'))
+
+
+def _unescape(value):
+    out = []
+    chars = iter(value)
+    for ch in chars:
+        if ch == '\\':
+            ch = next(chars, '')
+            out.append(' ' if ch in 'nN' else ch)
+        else:
+            out.append(ch)
+    # Appointments are single lines, so embedded newlines become spaces
+    return ''.join(out).replace('\r', '').replace('\n', ' ')
+
+
+def _fold(line):
+    # Lines longer than 75 octets are continued on lines starting with a space
+    if len(line.encode('utf-8')) <= 75:
+        return line + '\r\n'
+    parts = []
+    current, size, limit = [], 0, 75
+    for ch in line:
+        width = len(ch.encode('utf-8'))
+        if size + width > limit:
+            parts.append(''.join(current))
+            current, size, limit = [], 0, 74
+        current.append(ch)
+        size += width
+    parts.append(''.join(current))
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def _unfold(stream):
+    # Yield (line number, logical line), joining continuation lines as they come
+    pending, pending_num = None, 0
+    for line_num, line in enumerate(stream, start=1):
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and pending is not None:
+            pending += line[1:]
+            continue
+        if pending:
+            yield pending_num, pending
+        pending, pending_num = line, line_num
+    if pending:
+        yield pending_num, pending
+
+
+def _split_property(line):
+    # NAME;PARAM=VALUE;...:VALUE, where quoted parameter values may hold ':'
+    quoted = False
+    for i, ch in enumerate(line):
+        if ch == '"':
+            quoted = not quoted
+        elif ch == ':' and not quoted:
+            head, value = line[:i], line[i + 1:]
+            break
+    else:
+        return None, {}, ''
+    name, *params = head.split(';')
+    params = dict(p.partition('=')[::2] for p in params)
+    return name.upper(), {k.upper(): v.strip('"') for k, v in params.items()}, value
+
+
+def _ics_moment(value, params):
+    # A date, or a naive datetime in local time
+    value = value.strip()
+    if params.get('VALUE', '').upper() == 'DATE' or 'T' not in value:
+        return datetime.strptime(value[:8], "%Y%m%d").date()
+    moment = datetime.strptime(value[:15], "%Y%m%dT%H%M%S")
+    if value.endswith('Z'):
+        # UTC times land on the local date and time they fall on here
+        moment = moment.replace(tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+    # Floating or TZID-qualified times are kept as written
+    return moment
+
+
+def _ics_date(value, params):
+    moment = _ics_moment(value, params)
+    return moment.date() if isinstance(moment, datetime) else moment
+
+
+DURATION_RE = re.compile(r'^P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$')
+
+
+def _ics_duration(value):
+    # RFC 5545 DURATION, e.g. PT1H30M, in minutes
+    match = DURATION_RE.match(value.strip().upper().lstrip('+'))
+    if match is None:
+        raise ValueError(f"Invalid duration: {value}")
+    weeks, days, hours, minutes, seconds = (int(part or 0) for part in match.groups())
+    return ((weeks * 7 + days) * 24 + hours) * 60 + minutes + seconds // 60
+
+
+def _ics_times(event):
+    # (date, time, duration) for an event; time and duration in minutes,
+    # None for all-day events. Events a day or longer keep only their start
+    start = event['DTSTART']
+    if not isinstance(start, datetime):
+        return start, None, None
+    time = start.hour * 60 + start.minute
+    duration = None
+    if isinstance(event.get('DTEND'), datetime):
+        duration = int((event['DTEND'] - start).total_seconds() // 60)
+    elif 'DURATION' in event:
+        duration = event['DURATION']
+    if duration is not None and not 0 < duration < MINUTES_PER_DAY:
+        duration = None
+    return start.date(), time, duration
+
+
+def _ics_rule(event, start, text):
+    # Only plain FREQ/INTERVAL/COUNT/UNTIL rules map onto the app's rules
+    parts = dict(p.partition('=')[::2] for p in event['RRULE'].upper().split(';') if p)
+    freq = parts.pop('FREQ', '').lower()
+    parts.pop('WKST', None)
+    if freq not in FREQUENCIES or set(parts) - {'INTERVAL', 'COUNT', 'UNTIL'}:
+        return None
+    interval = int(parts.get('INTERVAL', 1))
+    count = int(parts['COUNT']) if 'COUNT' in parts else None
+    until = _ics_date(parts['UNTIL'], {}) if 'UNTIL' in parts else None
+
+    uid = event.get('UID', '')
+    if uid.endswith('@' + UID_DOMAIN):
+        rule_id = uid[:-len(UID_DOMAIN) - 1]
+    else:
+        # The same foreign event always gets the same id, so re-imports merge
+        rule_id = uuid.uuid5(uuid.NAMESPACE_URL, uid or f"{start}:{text}").hex
+    rule = make_rule(rule_id, start, text, freq, interval, until, count)
+    rule['exceptions'] = sorted(event['EXDATE'])
+    return rule
+
+
+def read_ics(stream):
+    """Yield ('appt', date, text, time, duration) and ('rule', rule)
+    records from an iCalendar stream. VEVENTs with a repeat rule the app
+    can't express are imported as their first occurrence."""
+    stack = []
+    event = None
+    for line_num, line in _unfold(stream):
+        name, params, value = _split_property(line)
+        if name == 'BEGIN':
+            stack.append(value.upper())
+            if stack[-1] == 'VEVENT':
+                event = {'EXDATE': set()}
+            continue
+        if name == 'END':
+            if stack:
+                stack.pop()
+            if value.upper() != 'VEVENT' or event is None:
+                continue
+            current, event = event, None
+            if 'DTSTART' not in current or current.get('STATUS') == 'CANCELLED':
+                continue
+            text = current.get('SUMMARY', '')
+            if not text.strip():
+                text = "(no title)"
+            start, time, duration = _ics_times(current)
+            try:
+                rule = _ics_rule(current, start, text) if 'RRULE' in current else None
+            except ValueError as e:
+                raise ValueError(f"line {line_num}: bad RRULE ({e})") from None
+            if rule is not None:
+                # Repeating appointments have no time of day
+                yield ('rule', rule)
+            else:
+                yield ('appt', start, text, time, duration)
+            continue
+        if event is None or not stack or stack[-1] != 'VEVENT':
+            continue
+
+        try:
+            if name == 'SUMMARY':
+                event['SUMMARY'] = _unescape(value)
+            elif name in ('DTSTART', 'DTEND'):
+                event[name] = _ics_moment(value, params)
+            elif name == 'DURATION':
+                event['DURATION'] = _ics_duration(value)
+            elif name == 'EXDATE':
+                event['EXDATE'].update(_ics_date(v, params).isoformat() for v in value.split(','))
+            elif name in ('RRULE', 'UID', 'STATUS'):
+                event[name] = value.strip()
+        except ValueError:
+            raise ValueError(f"line {line_num}: bad {name} value {value!r}") from None
+
+
+def _uid(date_str, text, n):
+    digest = hashlib.sha1(f"{date_str}\n{text}\n{n}".encode('utf-8')).hexdigest()[:16]
+    return f"{digest}@{UID_DOMAIN}"
+
+
+def write_ics(store, out):
+    """Write every appointment and repeating appointment as a VEVENT;
+    returns the number of events written."""
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    out.write("BEGIN:VCALENDAR\r\nVERSION:2.0\r\n")
+    out.write(f"PRODID:{PRODID}\r\nCALSCALE:GREGORIAN\r\n")
+    count = 0
+    for date_str, appts in store.iter_appointments(entries=True):
+        day = parse_date(date_str)
+        start = day.strftime("%Y%m%d")
+        end = (day + timedelta(days=1)).strftime("%Y%m%d")
+        for n, appt in enumerate(appts):
+            out.write("BEGIN:VEVENT\r\n")
+            out.write(_fold(f"UID:{_uid(date_str, appt.text, n)}"))
+            out.write(f"DTSTAMP:{stamp}\r\n")
+            if appt.time is None:
+                out.write(f"DTSTART;VALUE=DATE:{start}\r\nDTEND;VALUE=DATE:{end}\r\n")
+            else:
+                # Floating local times, as the app keeps them
+                begin = datetime.combine(day, datetime.min.time()) + timedelta(minutes=appt.time)
+                out.write(f"DTSTART:{begin.strftime('%Y%m%dT%H%M%S')}\r\n")
+                if appt.duration:
+                    finish = begin + timedelta(minutes=appt.duration)
+                    out.write(f"DTEND:{finish.strftime('%Y%m%dT%H%M%S')}\r\n")
+            out.write(_fold(f"SUMMARY:{_escape(appt.text)}"))
+            out.write("END:VEVENT\r\n")
+            count += 1
+
+    for rule in store.recurring_rules():
+        start = parse_date(rule['start'])
+        rrule = f"FREQ={rule['freq'].upper()}"
+        if rule['interval'] != 1:
+            rrule += f";INTERVAL={rule['interval']}"
+        if rule.get('count'):
+            rrule += f";COUNT={rule['count']}"
+        if rule.get('until'):
+            rrule += f";UNTIL={parse_date(rule['until']).strftime('%Y%m%d')}"
+        out.write("BEGIN:VEVENT\r\n")
+        out.write(_fold(f"UID:{rule['id']}@{UID_DOMAIN}"))
+        out.write(f"DTSTAMP:{stamp}\r\n")
+        out.write(f"DTSTART;VALUE=DATE:{start.strftime('%Y%m%d')}\r\n")
+        out.write(f"DTEND;VALUE=DATE:{(start + timedelta(days=1)).strftime('%Y%m%d')}\r\n")
+        out.write(f"RRULE:{rrule}\r\n")
+        for exception in rule.get('exceptions') or ():
+            out.write(f"EXDATE;VALUE=DATE:{parse_date(exception).strftime('%Y%m%d')}\r\n")
+        out.write(_fold(f"SUMMARY:{_escape(rule['text'])}"))
+        out.write("END:VEVENT\r\n")
+        count += 1
+    out.write("END:VCALENDAR\r\n")
+    return count
+
+
+# CSV
+
+DATE_COLUMNS = ('date', 'start date', 'start', 'dtstart')
+TEXT_COLUMNS = ('text', 'subject', 'summary', 'title', 'description')
+# "09:30-10:15" as written by Export, or Google Calendar's separate columns
+TIME_COLUMNS = ('time',)
+START_TIME_COLUMNS = ('start time',)
+END_TIME_COLUMNS = ('end time',)
+
+
+def _csv_date(value):
+    value = value.strip()
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        # Spreadsheet and Google Calendar exports use MM/DD/YYYY
+        return datetime.strptime(value, "%m/%d/%Y").date()
+
+
+def _csv_clock(value):
+    # "14:30", or "2:30 PM" as spreadsheets write it, in minutes
+    value = value.strip().upper()
+    if value.endswith(('AM', 'PM')):
+        moment = datetime.strptime(' '.join(value[:-2].split()[:1] + [value[-2:]]),
+                                   "%I:%M %p" if ':' in value else "%I %p")
+        return moment.hour * 60 + moment.minute
+    return parse_time(value)
+
+
+def _csv_times(row, time_col, start_col, end_col):
+    # (time, duration) from whichever time columns the file has
+    if time_col is not None and time_col < len(row):
+        return parse_time_range(row[time_col])
+    if start_col is None or start_col >= len(row) or not row[start_col].strip():
+        return None, None
+    time = _csv_clock(row[start_col])
+    if end_col is None or end_col >= len(row) or not row[end_col].strip():
+        return time, None
+    return time, (_csv_clock(row[end_col]) - time) % MINUTES_PER_DAY or None
+
+
+def _column(header, names):
+    return next((header.index(c) for c in names if c in header), None)
+
+
+def read_csv(stream):
+    """Yield ('appt', date, text, time, duration) records from CSV with a
+    header naming a date column and a text column and optionally times
+    (e.g. date,text,time or Subject,Start Date,Start Time,End Time), or
+    from headerless date,text[,time] rows."""
+    reader = csv.reader(stream)
+    rows = (row for row in reader if any(cell.strip() for cell in row))
+    first = next(rows, None)
+    if first is None:
+        return
+    header = [cell.strip().lower() for cell in first]
+    date_col, text_col = _column(header, DATE_COLUMNS), _column(header, TEXT_COLUMNS)
+    time_col = _column(header, TIME_COLUMNS)
+    start_col, end_col = _column(header, START_TIME_COLUMNS), _column(header, END_TIME_COLUMNS)
+    if date_col is None or text_col is None:
+        # No header, so the first row is already data
+        date_col, text_col, time_col, start_col, end_col = 0, 1, 2, None, None
+        rows = itertools.chain([first], rows)
+
+    for row in rows:
+        if len(row) <= max(date_col, text_col) or not row[text_col].strip():
+            raise ValueError(f"line {reader.line_num}: expected a date and a text column")
+        try:
+            day = _csv_date(row[date_col])
+        except ValueError:
+            raise ValueError(f"line {reader.line_num}: bad date {row[date_col]!r}") from None
+        try:
+            time, duration = _csv_times(row, time_col, start_col, end_col)
+        except ValueError as e:
+            raise ValueError(f"line {reader.line_num}: {e}") from None
+        yield ('appt', day, row[text_col], time, duration)
+
+
+def write_csv(store, out):
+    """Write date,text,time rows for every stored appointment, time being
+    "09:30-10:15", "09:30" or empty; returns the number of rows written."""
+    writer = csv.writer(out, lineterminator='\n')
+    writer.writerow(['date', 'text', 'time'])
+    count = 0
+    for date_str, appts in store.iter_appointments(entries=True):
+        for appt in appts:
+            writer.writerow([date_str, appt.text, appt.time_range()])
+            count += 1
+    return count
+
+
+def read_records(stream, fmt):
+    if fmt == 'ics':
+        return read_ics(stream)
+    if fmt == 'csv':
+        return read_csv(stream)
+    raise ValueError(f"Unknown format: {fmt}")
+
+
+def write_records(store, out, fmt):
+    if fmt == 'ics':
+        return write_ics(store, out)
+    if fmt == 'csv':
+        return write_csv(store, out)
+    raise ValueError(f"Unknown format: {fmt}")
+
+
+def import_file(store, path, fmt=None):
+    fmt = fmt or detect_format(path)
+    with open(path, newline='' if fmt == 'csv' else None, encoding='utf-8-sig') as f:
+        return merge(store, read_records(f, fmt))
+
+
+def export_file(store, path, fmt=None):
+    fmt = fmt or detect_format(path)
+    # Write beside the target first so a failed export leaves any old file intact
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'w', newline='', encoding='utf-8') as f:
+        count = write_records(store, f, fmt)
+    os.replace(tmp_file, path)
+    return count
@@ -0,0 +1,294 @@
+"""
+In-memory model for the Personal Calendar & Task Manager
+Compact records behind the JSON backend: appointments are held per day
+under integer ordinal keys, stored by column, with repeated text shared.
+JSON stays the format on disk
+"""
+
+from datetime import date
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def day_key(date_str):
+    # "YYYY-MM-DD" -> proleptic ordinal, the key days are held under
+    return date.fromisoformat(date_str).toordinal()
+
+
+def day_str(key):
+    return date.fromordinal(key).isoformat()
+
+
+def parse_time(value):
+    # "HH:MM" or "HH" -> minutes after midnight
+    hours, sep, minutes = value.strip().partition(':')
+    if not hours.isdigit() or (sep and not minutes.isdigit()):
+        raise ValueError(f"Invalid time: {value}")
+    hours, minutes = int(hours), int(minutes) if sep else 0
+    if not (hours < 24 and minutes < 60):
+        raise ValueError(f"Invalid time: {value}")
+    return hours * 60 + minutes
+
+
+def time_str(minutes):
+    minutes %= MINUTES_PER_DAY
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def occupied_until(start, duration):
+    # Where an appointment stops taking up time. One without an end still
+    # takes up the minute it starts in, so it can clash with others
+    return start + max(duration or 0, 1)
+
+
+def _position(texts, index, text):
+    # Prefer the recorded position, fall back to the first entry with the same text
+    if 0 <= index < len(texts) and texts[index] == text:
+        return index
+    try:
+        return texts.index(text)
+    except ValueError:
+        return None
+
+
+def _column(values, length):
+    # A metadata column is None until some row has a value
+    return values if values is not None else [None] * length
+
+
+class TextPool:
+    """Shares one string object among equal texts while a file is loaded.
+
+    Calendars repeat themselves ("Gym", "Team meeting"), so this usually
+    saves a string per repeat. Once a sample shows the texts hardly repeat
+    it stops, since hashing every text would then cost load time and
+    memory for nothing.
+    """
+
+    SAMPLE = 20000
+
+    def __init__(self):
+        self.texts = {}
+        self.seen = 0
+        self.active = True
+
+    def share(self, text):
+        return self.texts.setdefault(text, text) if self.active else text
+
+    def share_all(self, texts):
+        # Returns a list of the texts, reusing `texts` itself if it can
+        if not self.active:
+            return texts
+        share = self.texts.setdefault
+        shared = [share(text, text) for text in texts]
+        self.seen += len(texts)
+        if self.seen >= self.SAMPLE and len(self.texts) > 0.9 * self.seen:
+            self.active = False
+            self.texts = {}
+        return shared
+
+
+class Appointment:
+    """One appointment with its metadata, as handed out by Day.entry()
+    and Day.remove()."""
+
+    __slots__ = ('text', 'time', 'duration')
+
+    def __init__(self, text, time=None, duration=None):
+        self.text = text
+        self.time = time
+        self.duration = duration
+
+    def time_range(self):
+        # "09:30-10:15", "09:30", or "" for an appointment without a time
+        if self.time is None:
+            return ""
+        if not self.duration:
+            return time_str(self.time)
+        return f"{time_str(self.time)}-{time_str(self.time + self.duration)}"
+
+    def to_json(self):
+        if self.time is None and self.duration is None:
+            return self.text
+        value = {'text': self.text}
+        if self.time is not None:
+            value['time'] = time_str(self.time)
+        if self.duration is not None:
+            value['duration'] = self.duration
+        return value
+
+    @classmethod
+    def from_json(cls, value):
+        if isinstance(value, str):
+            return cls(value)
+        time = value.get('time')
+        return cls(value['text'], parse_time(time) if time is not None else None,
+                   value.get('duration'))
+
+
+class Task:
+    """One task with its metadata, as handed out by TaskList.entry() and
+    TaskList.remove()."""
+
+    __slots__ = ('text', 'done')
+
+    def __init__(self, text, done=False):
+        self.text = text
+        self.done = done
+
+
+class Day:
+    """The appointments on one day, stored by column.
+
+    texts holds one string per appointment, so an appointment costs a
+    single list slot rather than an object of its own. The metadata
+    columns (times in minutes after midnight, durations in minutes) stay
+    None until an appointment on the day has a value. In JSON a day is a
+    list of strings, with an object {"text", "time", "duration"} for any
+    appointment that has metadata.
+
+    A day is kept in time order: appointments without a time first, in
+    the order they were added, then the rest by start time.
+    """
+
+    __slots__ = ('texts', 'times', 'durations')
+
+    def __init__(self, texts=None):
+        self.texts = texts if texts is not None else []
+        self.times = None
+        self.durations = None
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __eq__(self, other):
+        return (isinstance(other, Day) and self.texts == other.texts and
+                _column(self.times, len(self)) == _column(other.times, len(other)) and
+                _column(self.durations, len(self)) == _column(other.durations, len(other)))
+
+    __hash__ = None
+
+    def entry(self, index):
+        return Appointment(self.texts[index],
+                           self.times[index] if self.times is not None else None,
+                           self.durations[index] if self.durations is not None else None)
+
+    def add(self, text, time=None, duration=None):
+        if time is not None and self.times is None:
+            self.times = [None] * len(self.texts)
+        if duration is not None and self.durations is None:
+            self.durations = [None] * len(self.texts)
+        index = len(self.texts)
+        times = self.times
+        if times is not None:
+            # After any equal times, so ties stay in the order they came
+            while index and times[index - 1] is not None and (time is None or times[index - 1] > time):
+                index -= 1
+            times.insert(index, time)
+        self.texts.insert(index, text)
+        if self.durations is not None:
+            self.durations.insert(index, duration)
+
+    def remove(self, index, text):
+        # Returns the removed Appointment, or None if there is no such one
+        index = _position(self.texts, index, text)
+        if index is None:
+            return None
+        entry = self.entry(index)
+        del self.texts[index]
+        if self.times is not None:
+            del self.times[index]
+        if self.durations is not None:
+            del self.durations[index]
+        return entry
+
+    def to_json(self):
+        if self.times is None and self.durations is None:
+            return list(self.texts)
+        return [self.entry(i).to_json() for i in range(len(self.texts))]
+
+    @classmethod
+    def from_json(cls, values, pool):
+        if all(type(value) is str for value in values):
+            return cls(pool.share_all(values))
+        day = cls()
+        for value in values:
+            appt = Appointment.from_json(value)
+            day.add(pool.share(appt.text), appt.time, appt.duration)
+        return day
+
+
+class TaskList:
+    """One task list, stored by column like Day.
+
+    texts is the list of task texts the rest of the app sees; done stays
+    None until a task is marked done. In JSON a task is a string, or
+    {"text", "done"} once it is done.
+    """
+
+    __slots__ = ('texts', 'done')
+
+    def __init__(self, texts=None):
+        self.texts = texts if texts is not None else []
+        self.done = None
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __eq__(self, other):
+        return (isinstance(other, TaskList) and self.texts == other.texts and
+                _column(self.done, len(self)) == _column(other.done, len(other)))
+
+    __hash__ = None
+
+    def entry(self, index):
+        return Task(self.texts[index], bool(self.done and self.done[index]))
+
+    def append(self, text, done=False):
+        self.insert(len(self.texts), text, done)
+
+    def insert(self, index, text, done=False):
+        if done and self.done is None:
+            self.done = [False] * len(self.texts)
+        self.texts.insert(index, text)
+        if self.done is not None:
+            self.done.insert(index, done)
+
+    def set_done(self, index, text, done):
+        # Returns False if there is no such task or it is already so
+        index = _position(self.texts, index, text)
+        if index is None or self.entry(index).done == done:
+            return False
+        if self.done is None:
+            self.done = [False] * len(self.texts)
+        self.done[index] = done
+        return True
+
+    def remove(self, index, text):
+        # Returns the removed Task, or None if there is no such one
+        index = _position(self.texts, index, text)
+        if index is None:
+            return None
+        entry = self.entry(index)
+        del self.texts[index]
+        if self.done is not None:
+            del self.done[index]
+        return entry
+
+    def to_json(self):
+        if self.done is None:
+            return list(self.texts)
+        return [{'text': text, 'done': True} if done else text
+                for text, done in zip(self.texts, self.done)]
+
+    @classmethod
+    def from_json(cls, values, pool):
+        if all(type(value) is str for value in values):
+            return cls(pool.share_all(values))
+        tasks = cls()
+        for value in values:
+            if isinstance(value, str):
+                tasks.append(pool.share(value))
+            else:
+                tasks.append(pool.share(value['text']), value.get('done', False))
+        return tasks
@@ -0,0 +1,135 @@
+"""
+Handler profiling for the Personal Calendar & Task Manager
+Times UI handlers, dialogs and saves, counts the widgets they create and
+destroy and the bytes they write to the data files, and exports a
+Chrome trace
+"""
+
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+# Counted per thread by the storage code itself, so a span only sees the
+# data files its own thread wrote, not X11 or terminal traffic or the
+# save worker running alongside
+from calendar_storage import bytes_written
+
+
+class Profiler:
+    """Records one span per call of every wrapped function.
+
+    Nothing is wrapped unless a Profiler is created, so with profiling off
+    the handlers run untouched. export() writes a Chrome trace (open it in
+    chrome://tracing or ui.perfetto.dev) whose "summary" key holds
+    per-handler totals, and prints the busiest handlers to stderr.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.start = time.perf_counter()
+        self.spans = []
+        self.widgets_created = 0
+        self.widgets_destroyed = 0
+        self._patched = []
+
+    def wrap(self, category, name, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            created, destroyed = self.widgets_created, self.widgets_destroyed
+            written = bytes_written()
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                end = time.perf_counter()
+                after = bytes_written()
+                self.spans.append((category, name, start, end, threading.current_thread().name,
+                                   self.widgets_created - created,
+                                   self.widgets_destroyed - destroyed,
+                                   after - written))
+        return wrapper
+
+    def instrument(self, obj, names, category):
+        # Shadow bound methods with wrapped ones on this one instance; do it
+        # before any widget captures them as a command
+        for name in names:
+            setattr(obj, name, self.wrap(category, name, getattr(obj, name)))
+
+    def patch(self, owner, names, category):
+        # Wrap module or class attributes, e.g. the dialog functions;
+        # close() puts the originals back
+        for name in names:
+            original = getattr(owner, name)
+            self._patched.append((owner, name, original))
+            setattr(owner, name, self.wrap(category, name, original))
+
+    def count_widgets(self, tk):
+        base = tk.BaseWidget
+        init, destroy = base.__init__, base.destroy
+
+        def counted_init(widget, *args, **kwargs):
+            self.widgets_created += 1
+            init(widget, *args, **kwargs)
+
+        def counted_destroy(widget):
+            self.widgets_destroyed += 1
+            destroy(widget)
+
+        self._patched += [(base, '__init__', init), (base, 'destroy', destroy)]
+        base.__init__ = counted_init
+        base.destroy = counted_destroy
+
+    def close(self):
+        for owner, name, original in reversed(self._patched):
+            setattr(owner, name, original)
+        self._patched = []
+
+    def summary(self):
+        totals = {}
+        for category, name, start, end, thread, created, destroyed, written in self.spans:
+            entry = totals.setdefault(f"{category}.{name}", {
+                'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                'widgets_created': 0, 'widgets_destroyed': 0, 'bytes_written': 0})
+            ms = (end - start) * 1000
+            entry['calls'] += 1
+            entry['total_ms'] += ms
+            entry['max_ms'] = max(entry['max_ms'], ms)
+            entry['widgets_created'] += created
+            entry['widgets_destroyed'] += destroyed
+            entry['bytes_written'] += written
+        for entry in totals.values():
+            entry['mean_ms'] = entry['total_ms'] / entry['calls']
+        return dict(sorted(totals.items(), key=lambda item: -item[1]['total_ms']))
+
+    def trace_events(self):
+        pid = os.getpid()
+        threads = {}
+        events = []
+        for category, name, start, end, thread, created, destroyed, written in self.spans:
+            tid = threads.setdefault(thread, len(threads) + 1)
+            args = {'widgets_created': created, 'widgets_destroyed': destroyed,
+                    'bytes_written': written}
+            events.append({'name': name, 'cat': category, 'ph': 'X', 'pid': pid, 'tid': tid,
+                           'ts': (start - self.start) * 1e6, 'dur': (end - start) * 1e6,
+                           'args': args})
+        for thread, tid in threads.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                           'args': {'name': thread}})
+        return events
+
+    def export(self, top=15):
+        summary = self.summary()
+        with open(self.path, 'w') as f:
+            json.dump({'traceEvents': self.trace_events(), 'displayTimeUnit': 'ms',
+                       'summary': summary}, f)
+
+        print(f"Profile written to {self.path}", file=sys.stderr)
+        print(f"  {'handler':<36}{'calls':>7}{'total ms':>11}{'max ms':>10}"
+              f"{'widgets +/-':>14}{'bytes':>10}", file=sys.stderr)
+        for name, entry in list(summary.items())[:top]:
+            widgets = f"{entry['widgets_created']}/{entry['widgets_destroyed']}"
+            print(f"  {name:<36}{entry['calls']:>7}{entry['total_ms']:>11.1f}{entry['max_ms']:>10.1f}"
+                  f"{widgets:>14}{entry['bytes_written']:>10}", file=sys.stderr)
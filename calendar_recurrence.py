@@ -0,0 +1,134 @@
+"""
+Recurring appointments for the Personal Calendar & Task Manager
+Rules are stored once and expanded lazily, one month at a time
+"""
+
+import calendar
+from collections import OrderedDict
+from datetime import date, timedelta
+
+FREQUENCIES = ('daily', 'weekly', 'monthly', 'yearly')
+
+
+def make_rule(rule_id, start, text, freq, interval=1, until=None, count=None):
+    if freq not in FREQUENCIES:
+        raise ValueError(f"Unknown frequency: {freq}")
+    if interval < 1:
+        raise ValueError("Interval must be at least 1")
+    if count is not None and count < 1:
+        raise ValueError("Count must be at least 1")
+    return {
+        'id': rule_id,
+        'start': start.isoformat(),
+        'text': text,
+        'freq': freq,
+        'interval': interval,
+        'until': until.isoformat() if until else None,
+        'count': count,
+        'exceptions': []
+    }
+
+
+def _month_day(year, month, day):
+    # None when the month is too short, e.g. the 31st of April
+    if day > calendar.monthrange(year, month)[1]:
+        return None
+    return date(year, month, day)
+
+
+def expand(rule, first, last):
+    """Yield the dates of `rule` that fall within first..last, in order."""
+    start = date.fromisoformat(rule['start'])
+    interval = rule['interval']
+    count = rule.get('count')
+    until = rule.get('until')
+    if until:
+        last = min(last, date.fromisoformat(until))
+    if last < start or last < first:
+        return
+    exceptions = rule.get('exceptions') or ()
+
+    if rule['freq'] in ('daily', 'weekly'):
+        step = interval * (7 if rule['freq'] == 'weekly' else 1)
+        # Jump straight to the first occurrence on or after `first`
+        k = max(0, -(-(first - start).days // step))
+        while True:
+            if count is not None and k >= count:
+                return
+            day = start + timedelta(days=k * step)
+            if day > last:
+                return
+            if day.isoformat() not in exceptions:
+                yield day
+            k += 1
+    else:
+        step = interval * (12 if rule['freq'] == 'yearly' else 1)
+        base = start.year * 12 + start.month - 1
+        if count is None:
+            # Without a count, skipped short months do not matter, so jump ahead
+            months = max(0, first.year * 12 + first.month - 1 - base)
+            k = -(-months // step)
+        else:
+            k = 0
+        seen = 0
+        while True:
+            index = base + k * step
+            if index // 12 > last.year or (index // 12 == last.year and index % 12 + 1 > last.month):
+                return
+            day = _month_day(index // 12, index % 12 + 1, start.day)
+            k += 1
+            if day is None:
+                continue
+            if count is not None:
+                if seen >= count:
+                    return
+                seen += 1
+            if first <= day <= last and day.isoformat() not in exceptions:
+                yield day
+
+
+class OccurrenceCache:
+    """Expanded occurrences per (year, month), kept in a small LRU.
+
+    month() returns {day_of_month: [(rule_id, text), ...]}. Any change to
+    a rule must be followed by invalidate().
+    """
+
+    def __init__(self, rules, maxsize=24):
+        self.rules = rules
+        self.maxsize = maxsize
+        self._months = OrderedDict()
+
+    def invalidate(self):
+        self._months.clear()
+
+    def month(self, year, month):
+        key = (year, month)
+        days = self._months.get(key)
+        if days is not None:
+            self._months.move_to_end(key)
+            return days
+
+        first = date(year, month, 1)
+        last = date(year, month, calendar.monthrange(year, month)[1])
+        days = {}
+        for rule in self.rules.values():
+            for day in expand(rule, first, last):
+                days.setdefault(day.day, []).append((rule['id'], rule['text']))
+
+        self._months[key] = days
+        if len(self._months) > self.maxsize:
+            self._months.popitem(last=False)
+        return days
+
+    def between(self, first, last):
+        # {date_str: [(rule_id, text), ...]} across months, through the cache
+        result = {}
+        year, month = first.year, first.month
+        while (year, month) <= (last.year, last.month):
+            for day, items in self.month(year, month).items():
+                current = date(year, month, day)
+                if first <= current <= last:
+                    result[current.isoformat()] = list(items)
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        return result
@@ -0,0 +1,145 @@
+"""
+Full-text search for the Personal Calendar & Task Manager
+An inverted token index over appointments, repeating appointments and both
+task lists, kept up to date one edit at a time
+"""
+
+import re
+from bisect import bisect_left, insort
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+class SearchIndex:
+    """Maps lowercase tokens to the entries that contain them.
+
+    An entry is (kind, where, text): kind is 'appt' (where is the date),
+    'rule' (where is the rule id), 'today' or 'later' (where is None).
+    Identical entries share one id with a count. The distinct tokens are
+    also kept sorted, so a prefix maps to one contiguous slice of them.
+
+    Entries are stored by column, indexed by id, rather than as one object
+    each; with an entry per appointment that is most of the index's
+    memory. ids maps each entry back to its id, so an edit finds its entry
+    in constant time however often the same text repeats. Ids of removed
+    entries are reused.
+    """
+
+    def __init__(self):
+        self.kinds = []
+        self.wheres = []
+        self.texts = []
+        self.counts = []
+        self.ids = {}
+        self.postings = {}
+        self.tokens = []
+        self._free = []
+
+    def entry(self, entry_id):
+        return self.kinds[entry_id], self.wheres[entry_id], self.texts[entry_id]
+
+    def add(self, kind, where, text):
+        key = (kind, where, text)
+        entry_id = self.ids.get(key)
+        if entry_id is not None:
+            self.counts[entry_id] += 1
+            return
+        tokens = set(tokenize(text))
+        if not tokens:
+            return
+
+        if self._free:
+            entry_id = self._free.pop()
+            self.kinds[entry_id] = kind
+            self.wheres[entry_id] = where
+            self.texts[entry_id] = text
+            self.counts[entry_id] = 1
+        else:
+            entry_id = len(self.kinds)
+            self.kinds.append(kind)
+            self.wheres.append(where)
+            self.texts.append(text)
+            self.counts.append(1)
+        self.ids[key] = entry_id
+        for token in tokens:
+            ids = self.postings.get(token)
+            if ids is None:
+                ids = self.postings[token] = set()
+                insort(self.tokens, token)
+            ids.add(entry_id)
+
+    def remove(self, kind, where, text):
+        entry_id = self.ids.get((kind, where, text))
+        if entry_id is None:
+            return
+        self.counts[entry_id] -= 1
+        if not self.counts[entry_id]:
+            self._drop(entry_id, set(tokenize(text)))
+
+    def discard(self, kind, wheres=None):
+        # Drop every entry of `kind` whose where is in `wheres` (all of them
+        # without), in one pass
+        doomed = [entry_id for entry_id, entry_kind in enumerate(self.kinds)
+                  if entry_kind == kind and (wheres is None or self.wheres[entry_id] in wheres)]
+        for entry_id in doomed:
+            self._drop(entry_id, set(tokenize(self.texts[entry_id])))
+
+    def _drop(self, entry_id, tokens):
+        del self.ids[self.entry(entry_id)]
+        self.kinds[entry_id] = self.wheres[entry_id] = self.texts[entry_id] = None
+        self.counts[entry_id] = 0
+        self._free.append(entry_id)
+        for token in tokens:
+            ids = self.postings[token]
+            ids.discard(entry_id)
+            if not ids:
+                del self.postings[token]
+                del self.tokens[bisect_left(self.tokens, token)]
+
+    def _prefix_range(self, prefix):
+        lo = bisect_left(self.tokens, prefix)
+        hi = bisect_left(self.tokens, prefix + '\U0010ffff', lo)
+        return lo, hi
+
+    def search(self, query, limit=100):
+        """Return up to `limit` (kind, where, text) entries matching every
+        word of `query` as a prefix, plus whether more were left out."""
+        terms = sorted(set(tokenize(query)), key=len, reverse=True)
+        if not terms:
+            return [], False
+
+        # Drive the search from the longest term, which is usually the most
+        # selective, and check the rest against each candidate's own tokens
+        lo, hi = self._prefix_range(terms[0])
+        others = terms[1:]
+        seen = set()
+        results = []
+        for token in self.tokens[lo:hi]:
+            for entry_id in self.postings[token]:
+                if entry_id in seen:
+                    continue
+                seen.add(entry_id)
+                if others:
+                    words = tokenize(self.texts[entry_id])
+                    if not all(any(word.startswith(term) for word in words) for term in others):
+                        continue
+                if len(results) == limit:
+                    return sorted(results, key=_result_order), True
+                results.append(self.entry(entry_id))
+        return sorted(results, key=_result_order), False
+
+
+def merge(first, second, limit):
+    """Combine two (results, more) pairs, as search() returns, into one
+    of at most `limit` results."""
+    results = sorted(first[0] + second[0], key=_result_order)
+    return results[:limit], first[1] or second[1] or len(results) > limit
+
+
+def _result_order(entry):
+    kind, where, text = entry
+    return ({'today': 0, 'later': 1, 'appt': 2, 'rule': 3}[kind], where or '', text)
@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+"""
+Local HTTP/JSON API for the Personal Calendar & Task Manager
+Lets scripts, cron jobs and status bars read and edit the calendar through
+a running app (or a headless server) instead of racing it on the files
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import signal
+import sys
+import threading
+from datetime import date
+from urllib.parse import parse_qs, urlsplit
+
+from calendar_store import DEFAULT_DATA_FILE, CalendarStore, parse_date, parse_time_range
+
+DEFAULT_PORT = 8723
+MAX_BODY = 1024 * 1024
+# Longest date range one query may cover, as for the command-line tool
+MAX_DAYS = 3660
+# Most search results one query may ask for
+MAX_RESULTS = 1000
+IDLE_TIMEOUT = 30
+
+REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+           405: "Method Not Allowed", 413: "Payload Too Large", 415: "Unsupported Media Type",
+           500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def appointment_json(appt, rule_id=None):
+    value = {'text': appt.text}
+    if appt.time is not None:
+        value['time'] = appt.time_range()
+    if rule_id is not None:
+        value['repeating'] = rule_id
+    return value
+
+
+def tasks_json(store, list_name):
+    return [{'text': text, 'done': done}
+            for text, done in zip(store.task_list(list_name), store.task_done(list_name))]
+
+
+def day_json(store, day):
+    return [appointment_json(appt, rule_id) for appt, rule_id, index in store.day_entries(day)]
+
+
+# Handlers run on the thread that owns the store. Each takes the store, the
+# query ({name: value}) and the JSON body, and returns (status, payload,
+# changes), changes being (days, lists, rules) as CalendarStore.sync()
+# reports them, or None when nothing changed. Every value is checked before
+# the store sees it: an edit is journaled as soon as it is applied, so a bad
+# one would be saved even if the request then failed
+
+def _param(values, name, required=True):
+    value = values.get(name)
+    if value is None or value == '':
+        if required:
+            raise ApiError(400, f"Missing '{name}'")
+        return None
+    if not isinstance(value, str):
+        raise ApiError(400, f"'{name}' must be a string")
+    return value
+
+
+def _flag(values, name, default):
+    value = values.get(name, default)
+    if not isinstance(value, bool):
+        raise ApiError(400, f"'{name}' must be true or false")
+    return value
+
+
+def _index(values, name, from_query=False):
+    # Query values are strings; in a JSON body the index must be a number
+    value = values.get(name)
+    if from_query and value is not None:
+        try:
+            return int(value)
+        except ValueError:
+            pass
+    elif value is None or (isinstance(value, int) and not isinstance(value, bool)):
+        return value
+    raise ApiError(400, f"Invalid {name}: {value}")
+
+
+def _date(values, name, required=True):
+    value = _param(values, name, required)
+    if value is None:
+        return None
+    try:
+        return parse_date(value)
+    except (TypeError, ValueError):
+        raise ApiError(400, f"Invalid date for '{name}': {value}")
+
+
+def _task_list(store, list_name):
+    if list_name not in ('today', 'later'):
+        raise ApiError(404, f"Unknown task list: {list_name}")
+    return store.task_list(list_name)
+
+
+def _task_index(store, list_name, values, from_query=False):
+    # A task is picked by "index", by "text", or by both as a check
+    task_list = _task_list(store, list_name)
+    index, text = _index(values, 'index', from_query), _param(values, 'text', False)
+    if index is not None:
+        if 0 <= index < len(task_list) and (text is None or task_list[index] == text):
+            return index
+    elif text is not None and text in task_list:
+        return task_list.index(text)
+    elif text is None:
+        raise ApiError(400, "Give the task's 'index' or 'text'")
+    raise ApiError(404, "No such task")
+
+
+def get_today(store, query, body):
+    today = date.today()
+    return 200, {'date': today.isoformat(), 'appointments': day_json(store, today),
+                 'todo_today': tasks_json(store, 'today')}, None
+
+
+def get_appointments(store, query, body):
+    start, end = _date(query, 'from'), _date(query, 'to')
+    if end < start:
+        raise ApiError(400, "'to' is before 'from'")
+    if (end - start).days >= MAX_DAYS:
+        raise ApiError(400, f"Ask for at most {MAX_DAYS} days at a time")
+    days = set(store.appointments_between(start, end)) | set(store.occurrences_between(start, end))
+    return 200, {'appointments': {day: day_json(store, day) for day in sorted(days)}}, None
+
+
+def add_appointment(store, query, body):
+    day, text = _date(body, 'date'), _param(body, 'text')
+    try:
+        time, duration = parse_time_range(_param(body, 'time', False) or '')
+    except ValueError as e:
+        raise ApiError(400, str(e))
+    conflicts = store.conflicts(day, time, duration) if time is not None else []
+    store.add_appointment(day, text, time, duration)
+    return 201, {'date': day.isoformat(), 'conflicts': [
+        dict(appointment_json(appt), date=when.isoformat()) for when, appt in conflicts]}, \
+        ({day.isoformat()}, set(), False)
+
+
+def remove_appointment(store, query, body):
+    # The first stored appointment on the day with that text
+    day, text = _date(query, 'date'), _param(query, 'text')
+    appts = store.appointments_on(day)
+    if text not in appts or not store.remove_appointment(day, appts.index(text), text):
+        raise ApiError(404, "No such appointment")
+    return 200, {'removed': text}, ({day.isoformat()}, set(), False)
+
+
+def get_tasks(store, query, body, list_name=None):
+    names = (list_name,) if list_name else ('today', 'later')
+    for name in names:
+        _task_list(store, name)
+    return 200, {f"todo_{name}": tasks_json(store, name) for name in names}, None
+
+
+def add_task(store, query, body, list_name):
+    _task_list(store, list_name)
+    store.add_task(list_name, _param(body, 'text'), _flag(body, 'done', False))
+    return 201, {'index': len(store.task_list(list_name)) - 1}, (set(), {list_name}, False)
+
+
+def remove_task(store, query, body, list_name):
+    index = _task_index(store, list_name, query, True)
+    text = store.task_list(list_name)[index]
+    store.remove_task(list_name, index)
+    return 200, {'removed': text}, (set(), {list_name}, False)
+
+
+def set_done(store, query, body, list_name):
+    index = _task_index(store, list_name, body)
+    store.set_done(list_name, index, _flag(body, 'done', True))
+    return 200, {'index': index}, (set(), {list_name}, False)
+
+
+def move_task(store, query, body, list_name):
+    if list_name != 'later':
+        raise ApiError(404, "Only tasks in 'later' can be moved to today")
+    index = _task_index(store, 'later', body)
+    store.move_to_today(index)
+    return 200, {'index': len(store.todo_today) - 1}, (set(), {'today', 'later'}, False)
+
+
+def search(store, query, body):
+    if not store.search_ready:
+        raise ApiError(503, "The search index is still being built")
+    try:
+        limit = int(query.get('limit', 100))
+    except ValueError:
+        raise ApiError(400, "Invalid limit")
+    if not 1 <= limit <= MAX_RESULTS:
+        raise ApiError(400, f"limit must be from 1 to {MAX_RESULTS}")
+    results, more = store.search(_param(query, 'q'), limit)
+    return 200, {'results': [{'kind': kind, 'where': where, 'text': text}
+                             for kind, where, text in results], 'more': more}, None
+
+
+ROUTES = {
+    ('GET', '/today'): get_today,
+    ('GET', '/appointments'): get_appointments,
+    ('POST', '/appointments'): add_appointment,
+    ('DELETE', '/appointments'): remove_appointment,
+    ('GET', '/tasks'): get_tasks,
+    ('GET', '/search'): search,
+}
+
+# /tasks/<list> and /tasks/<list>/<action>
+TASK_ROUTES = {
+    ('GET', None): get_tasks,
+    ('POST', None): add_task,
+    ('DELETE', None): remove_task,
+    ('POST', 'done'): set_done,
+    ('POST', 'move'): move_task,
+}
+
+
+class CalendarServer:
+    """Serves a CalendarStore over HTTP/1.1 with JSON bodies, on a local
+    TCP port or a Unix socket.
+
+    Every request is answered from the store in memory, and edits go
+    through the store like any other, so they are saved in batches by its
+    SaveScheduler. The store is only touched from the thread that owns it:
+    with submit=None that is the event loop's own thread (the headless
+    server), otherwise each call is handed to submit(job), which must run
+    job() on the owning thread (the app's Tk thread). on_change(days,
+    lists, rules) is called there after each edit, so the app can redraw.
+
+    Only local clients are expected. Requests naming another Host are
+    refused, and edits must be sent as application/json, which a web page
+    cannot do without the browser asking first.
+    """
+
+    def __init__(self, store, host='127.0.0.1', port=DEFAULT_PORT, path=None,
+                 submit=None, on_change=None, sync_interval=1.0):
+        self.store = store
+        self.host = host
+        self.port = port
+        self.path = path
+        self.submit = submit
+        self.on_change = on_change
+        self.sync_interval = sync_interval
+        self.loop = None
+        self._task = None
+
+    @property
+    def address(self):
+        return self.path if self.path else f"http://{self.host}:{self.port}"
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self._task = asyncio.current_task()
+        if self.path:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            # Created readable only by us, with no moment when it is not
+            umask = os.umask(0o077)
+            try:
+                server = await asyncio.start_unix_server(self._handle, path=self.path)
+            finally:
+                os.umask(umask)
+        else:
+            server = await asyncio.start_server(self._handle, self.host, self.port)
+            self.port = server.sockets[0].getsockname()[1]
+        print(f"Calendar API listening on {self.address}", file=sys.stderr)
+        syncing = None
+        if self.submit is None and self.sync_interval:
+            syncing = asyncio.ensure_future(self._sync())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if syncing is not None:
+                syncing.cancel()
+            if self.path and os.path.exists(self.path):
+                os.remove(self.path)
+
+    def start(self):
+        # Serves from a daemon thread, for use inside the app
+        thread = threading.Thread(target=self._serve_thread, name="calendar-api", daemon=True)
+        thread.start()
+        return thread
+
+    def _serve_thread(self):
+        try:
+            asyncio.run(self.serve())
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"Error running the calendar API on {self.address}: {e}", file=sys.stderr)
+
+    def stop(self):
+        # Safe to call from any thread
+        if self.loop is not None and self._task is not None:
+            self.loop.call_soon_threadsafe(self._task.cancel)
+
+    async def _sync(self):
+        # Headless: pick up what the app or the command-line tool saved
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                self.store.sync()
+            except Exception as e:
+                print(f"Error reading changes saved elsewhere: {e}", file=sys.stderr)
+
+    async def _call(self, handler, *args):
+        if self.submit is None:
+            return self._run(handler, *args)
+        future = concurrent.futures.Future()
+
+        def job():
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(self._run(handler, *args))
+                except BaseException as e:
+                    future.set_exception(e)
+
+        self.submit(job)
+        return await asyncio.wrap_future(future)
+
+    def _run(self, handler, *args):
+        status, payload, changes = handler(self.store, *args)
+        if changes is not None and self.on_change is not None:
+            self.on_change(*changes)
+        return status, payload
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if not line.strip():
+                    break
+                parts = line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = header.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = (len(parts) == 3 and parts[2] == 'HTTP/1.1' and
+                              headers.get('connection', '').lower() != 'close')
+                length = int(headers.get('content-length') or 0)
+                if length > MAX_BODY:
+                    await self._respond(writer, 413, {'error': "Request body too large"}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                if len(parts) != 3:
+                    status, payload = 400, {'error': "Malformed request line"}
+                else:
+                    status, payload = await self._dispatch(parts[0], parts[1], headers, body)
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # The server is stopping; drop connections still held open
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method, target, headers, body):
+        try:
+            if not self.path:
+                host = headers.get('host', '').rsplit(':', 1)[0]
+                if host not in ('localhost', '127.0.0.1', '[::1]', self.host):
+                    raise ApiError(403, "Only local clients are served")
+            url = urlsplit(target)
+            query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            parts = [part for part in url.path.split('/') if part]
+            if parts[:1] == ['tasks'] and 2 <= len(parts) <= 3:
+                handler = TASK_ROUTES.get((method, parts[2] if len(parts) == 3 else None))
+                extra = (parts[1],)
+            else:
+                handler = ROUTES.get((method, '/' + '/'.join(parts)))
+                extra = ()
+            if handler is None:
+                known = any(path == url.path for _, path in ROUTES)
+                raise ApiError(405 if known else 404, f"No {method} {url.path}")
+            data = {}
+            if method in ('POST', 'DELETE') and body:
+                if headers.get('content-type', '').split(';')[0].strip() != 'application/json':
+                    raise ApiError(415, "Send the body as application/json")
+                try:
+                    data = json.loads(body)
+                except ValueError:
+                    raise ApiError(400, "The body is not valid JSON")
+                if not isinstance(data, dict):
+                    raise ApiError(400, "The body must be a JSON object")
+            elif method == 'POST':
+                raise ApiError(415, "Send the body as application/json")
+            return await self._call(handler, query, data, *extra)
+        except ApiError as e:
+            return e.status, {'error': str(e)}
+        except Exception as e:
+            print(f"Error answering {method} {target}: {e}", file=sys.stderr)
+            return 500, {'error': "Internal error"}
+
+    async def _respond(self, writer, status, payload, keep_alive):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                f"Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(data)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode('latin-1') + data)
+        await writer.drain()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Personal Calendar & Task Manager (local API server)")
+    parser.add_argument('--backend', choices=['json', 'sqlite'], default='json',
+                        help="storage backend, as for the desktop app")
+    parser.add_argument('--data-file', default=DEFAULT_DATA_FILE,
+                        help="data file (default: %(default)s)")
+    parser.add_argument('--archive-after', metavar='DAYS', type=int, default=365,
+                        help="archive years that ended more than DAYS ago, as the desktop app "
+                             "does (0: never)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help="TCP port on 127.0.0.1 (default: %(default)s)")
+    parser.add_argument('--socket', metavar='PATH', help="listen on a Unix socket instead")
+    args = parser.parse_args(argv)
+
+    store = CalendarStore(args.data_file, backend=args.backend, archive_after=args.archive_after)
+    store.load()
+    server = CalendarServer(store, port=args.port, path=args.socket)
+
+    async def run():
+        # A service manager stops us with SIGTERM: end as Ctrl+C does, so
+        # the store is saved and closed below
+        try:
+            loop = asyncio.get_running_loop()
+            loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        except NotImplementedError:
+            # No signal handlers in the Windows event loop
+            pass
+        await server.serve()
+
+    try:
+        asyncio.run(run())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1580 @@
+"""
+Storage for the Personal Calendar & Task Manager
+Pluggable backends: a JSON snapshot with an append-only journal, or an
+indexed SQLite database that is queried one month or day at a time
+"""
+
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from calendar_model import (MINUTES_PER_DAY, Appointment, Day, TaskList, TextPool, day_key,
+                            day_str, occupied_until)
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks (Windows): a single running instance is assumed
+    fcntl = None
+
+# Bytes each thread has written to the data files, for the profiler
+_written = threading.local()
+
+
+def bytes_written():
+    """Bytes the calling thread has written to the data files so far."""
+    return getattr(_written, 'total', 0)
+
+
+def _count_written(size):
+    _written.total = bytes_written() + size
+
+
+def _thread_wchar():
+    # Bytes this thread has written to any file (Linux); 0 elsewhere. Only
+    # used around SQLite commits, which write nothing else
+    try:
+        with open('/proc/thread-self/io', 'rb') as f:
+            for line in f:
+                if line.startswith(b'wchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def snapshot_data(state):
+    # Copy the lists so a background writer never sees them change under it.
+    # Days in archived years are left to the archive's segment files
+    keys = state.archive.take(state.days, state.occupancy)
+    return {
+        'appointments': {day_str(key): state.days[key].to_json() for key in keys},
+        'todo_today': state.tasks['today'].to_json(),
+        'todo_later': state.tasks['later'].to_json(),
+        'recurring': [dict(rule, exceptions=list(rule['exceptions'])) for rule in state.recurring.values()]
+    }
+
+
+def write_snapshot(path, data):
+    temp_file = path + '.tmp'
+    try:
+        with open(temp_file, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+            _count_written(f.tell())
+        os.replace(temp_file, path)
+    except Exception:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+
+
+@contextmanager
+def file_lock(path, shared=False, blocking=True):
+    # Advisory lock on `path`, honoured by every instance of the app and the
+    # command-line tool. Yields False if non-blocking and someone holds it
+    if fcntl is None:
+        yield True
+        return
+    with open(path, 'a') as f:
+        try:
+            fcntl.flock(f, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) |
+                        (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def file_id(path):
+    # Cheap change check: a replaced file gets a new inode, an appended one
+    # a new size and mtime
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def apply_record(state, record):
+    # Returns False when the record no longer matches anything, e.g. a
+    # removal of an entry that is already gone
+    op = record['op']
+    if op == 'add_appointment':
+        key = day_key(record['date'])
+        day = state.days.get(key)
+        if day is None:
+            day = state.days[key] = Day()
+        day.add(record['text'], record.get('time'), record.get('duration'))
+    elif op == 'remove_appointment':
+        key = day_key(record['date'])
+        day = state.days.get(key)
+        if day is None or day.remove(record.get('index', -1), record['text']) is None:
+            return False
+        if not day:
+            del state.days[key]
+    elif op == 'add_task':
+        tasks = state.tasks[record['list']]
+        tasks.insert(record.get('index', len(tasks)), record['text'], record.get('done', False))
+    elif op == 'remove_task':
+        return state.tasks[record['list']].remove(record.get('index', -1), record['text']) is not None
+    elif op == 'set_done':
+        return state.tasks[record['list']].set_done(record.get('index', -1), record['text'], record['done'])
+    elif op == 'move_task':
+        task = state.tasks['later'].remove(record.get('index', -1), record['text'])
+        if task is None:
+            return False
+        state.tasks['today'].append(task.text, task.done)
+    elif op == 'add_rule':
+        rule = record['rule']
+        state.recurring[rule['id']] = dict(rule, exceptions=list(rule.get('exceptions', ())))
+    elif op == 'remove_rule':
+        return state.recurring.pop(record['id'], None) is not None
+    elif op == 'add_exception':
+        rule = state.recurring.get(record['id'])
+        if rule is None or record['date'] in rule['exceptions']:
+            return False
+        rule['exceptions'].append(record['date'])
+    elif op == 'remove_exception':
+        rule = state.recurring.get(record['id'])
+        if rule is None or record['date'] not in rule['exceptions']:
+            return False
+        rule['exceptions'].remove(record['date'])
+    else:
+        raise ValueError(f"Unknown journal operation: {op}")
+    return True
+
+
+class Journal:
+    """Append-only log of edits that sits next to the JSON snapshot.
+
+    Edits are queued in memory with append() and written as one batch by
+    write(), so a burst of edits costs a single write and fsync. Once the
+    log passes max_records or max_bytes it is folded into a new snapshot.
+    Each record carries a sequence number and the snapshot stores the last
+    one it contains, so replaying after a crash at any point never applies
+    a record twice.
+
+    Several instances may share the files. Writes hold an advisory lock on
+    data_file + '.lock', records are numbered when they are written and
+    tagged with the instance that wrote them, and `applied` tracks how far
+    into the journal this instance's state reaches, so changes() can read
+    just the records others appended since. A snapshot is only written
+    when the state holds every record in the file; otherwise it would drop
+    another instance's edits.
+    """
+
+    def __init__(self, data_file, max_records=1000, max_bytes=512 * 1024):
+        self.data_file = data_file
+        self.path = data_file + '.journal'
+        self.lock_path = data_file + '.lock'
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.src = os.urandom(8).hex()
+        self.seq = 0
+        self.records = 0
+        self.size = 0
+        self.pending = []
+        # Taken by a flush but not yet written
+        self.inflight = []
+        self.applied = 0
+        self.journal_ino = None
+        self.snapshot_id = None
+
+    def _read(self, path, offset=0):
+        records = []
+        good_end = offset
+        if not os.path.exists(path):
+            return records, good_end
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+                good_end += len(line)
+        return records, good_end
+
+    def replay(self, state, base_seq=0):
+        # Called with the file lock held; records go through state.apply()
+        # so ones for archived years read their segment first
+        self.seq = base_seq
+        self.pending = []
+        self.inflight = []
+        self.snapshot_id = file_id(self.data_file)
+        records, good_end = self._read(self.path)
+        for record in records:
+            if record.get('seq', 0) <= self.seq:
+                continue
+            try:
+                state.apply(record, log=False)
+            except (KeyError, ValueError) as e:
+                print(f"Skipping bad journal record {record}: {e}")
+            self.seq = record['seq']
+
+        self.records = len(records)
+        self.size = good_end
+        # A crash mid-append leaves a partial last line; drop it so later
+        # appends start on a clean line
+        if os.path.exists(self.path) and os.path.getsize(self.path) > good_end:
+            print(f"Truncating incomplete journal record in {self.path}")
+            with open(self.path, 'r+b') as f:
+                f.truncate(good_end)
+        journal = file_id(self.path)
+        self.applied = good_end
+        self.journal_ino = journal[0] if journal else None
+
+    def append(self, record):
+        self.pending.append(record)
+
+    def take(self, state, compact=False, snapshot=True):
+        # Called with the state locked: grab the queued records and, when the
+        # log has grown enough (and snapshot allows), a copy of the state to
+        # snapshot along with how much of the journal that copy covers
+        records = self.pending
+        self.pending = []
+        self.inflight = records
+        data = None
+        if snapshot and (compact or self.records + len(records) >= self.max_records or
+                         self.size >= self.max_bytes):
+            data = snapshot_data(state)
+        return records, data, (self.applied, self.journal_ino)
+
+    def write(self, records, data=None, covered=None, archive=None):
+        # Only file I/O happens here, so it can run without the state lock.
+        # Returns whether the snapshot was written
+        written = False
+        with file_lock(self.lock_path):
+            journal = file_id(self.path)
+            size, ino = (journal[1], journal[0]) if journal else (0, None)
+            if size:
+                size = self._trim(size)
+            caught_up = (size, ino) == (self.applied, self.journal_ino)
+            if records:
+                lines = []
+                for record in records:
+                    # Numbered here, under the lock, so they keep increasing
+                    # across instances
+                    self.seq = max(self.seq + 1, time.time_ns())
+                    record = dict(record, seq=self.seq, src=self.src)
+                    lines.append((json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8'))
+                chunk = b''.join(lines)
+                with open(self.path, 'ab') as f:
+                    f.write(chunk)
+                    _count_written(len(chunk))
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.records += len(lines)
+                self.size = size + len(chunk)
+                if caught_up:
+                    self.applied = self.size
+                    self.journal_ino = os.stat(self.path).st_ino
+
+            if (data is not None and covered == (size, ino) and
+                    file_id(self.data_file) == self.snapshot_id):
+                try:
+                    if archive is not None:
+                        # Segments first: none is used until the snapshot lists it
+                        data['archive'] = archive.write()
+                    data['journal_seq'] = self.seq
+                    write_snapshot(self.data_file, data)
+                except Exception:
+                    if archive is not None:
+                        archive.discard()
+                    raise
+                # Anything left in the journal is covered by the new snapshot
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                self.records = 0
+                self.size = 0
+                self.applied = 0
+                self.journal_ino = None
+                self.snapshot_id = file_id(self.data_file)
+                if archive is not None:
+                    archive.commit(data['archive'])
+                written = True
+            self.inflight = []
+        return written
+
+    def _trim(self, size):
+        # An instance that died mid-append leaves a partial line; drop it so
+        # ours start on a clean one
+        with open(self.path, 'r+b') as f:
+            f.seek(size - 1)
+            if f.read(1) == b'\n':
+                return size
+            f.seek(0)
+            size = f.read().rfind(b'\n') + 1
+            f.truncate(size)
+            return size
+
+    def changes(self):
+        # Records other instances have written since we last looked, or None
+        # if the snapshot was replaced and everything has to be read again.
+        # Two stats when nothing changed; never waits for a writer
+        journal = file_id(self.path)
+        size, ino = (journal[1], journal[0]) if journal else (0, None)
+        if (size, ino) == (self.applied, self.journal_ino) and file_id(self.data_file) == self.snapshot_id:
+            return []
+        with file_lock(self.lock_path, shared=True, blocking=False) as locked:
+            if not locked:
+                return []
+            if file_id(self.data_file) != self.snapshot_id:
+                return None
+            journal = file_id(self.path)
+            if journal is None:
+                return [] if self.journal_ino is None else None
+            if self.journal_ino is not None and journal[0] != self.journal_ino:
+                return None
+            records, self.applied = self._read(self.path, self.applied)
+            self.journal_ino = journal[0]
+
+        self.records += len(records)
+        self.size = self.applied
+        for record in records:
+            self.seq = max(self.seq, record.get('seq', 0))
+        # Our own records show up here when we wrote while behind
+        return [record for record in records if record.get('src') != self.src]
+
+
+class Archive:
+    """Appointments from past years, moved out of the JSON snapshot into
+    one gzip-compressed segment file per year under data_file + '.archive'.
+
+    A year is archived by the first snapshot written once it ended more
+    than after_days ago (never with after_days=0). The snapshot lists each
+    archived year with its segment file and its per-month counts, which go
+    straight into the occupancy index, so month views need no segment. A
+    segment is read the first time a query reaches one of its days.
+
+    Segment files are never rewritten. An edited year gets a new file at
+    the next snapshot and the old one is deleted once the snapshot points
+    at the new one, so a crash at any point leaves a complete calendar.
+    Only files the replaced snapshot listed are ever deleted.
+
+    A year is only edited once its segment has been read. If reading it
+    fails, local edits to the year are refused, and journal records for it
+    from other instances wait in `deferred` until it can be read. No
+    snapshot is taken while any do, so they stay in the journal on disk.
+    """
+
+    def __init__(self, data_file, after_days=365):
+        self.dir = data_file + '.archive'
+        self.after_days = after_days
+        # Year -> segment file name, as listed by the snapshot on disk
+        self.segments = {}
+        # Archived years whose days have not been read in yet
+        self.unloaded = set()
+        # Archived years edited since their segment was written
+        self.dirty = set()
+        # Set when a snapshot should be written to archive years
+        self.due = False
+        # Taken for a snapshot but not yet written
+        self.inflight = None
+        # Year -> journal records for it that arrived while it could not be read
+        self.deferred = {}
+        # Segment files written for a snapshot that is not on disk yet
+        self.written = []
+
+    def last_year(self):
+        # The newest year old enough to archive; 0 when archiving is off
+        if not self.after_days:
+            return 0
+        return (date.today() - timedelta(days=self.after_days)).year - 1
+
+    def load(self, listing):
+        # From the snapshot's "archive" entry; returns the archived months'
+        # counts as {(year, month): counts}
+        self.segments = {}
+        months = {}
+        for year, entry in listing.items():
+            year = int(year)
+            self.segments[year] = entry['file']
+            for month, counts in entry['months'].items():
+                months[(year, int(month))] = counts
+        self.unloaded = set(self.segments)
+        self.dirty = set()
+        self.deferred = {}
+        self.due = False
+        return months
+
+    def held(self):
+        # Whether a snapshot now would drop edits to a year not yet read
+        return bool(self.deferred or self.dirty & self.unloaded)
+
+    def read(self, year):
+        # {date_str: [appointment, ...]} as in the snapshot
+        with gzip.open(os.path.join(self.dir, self.segments[year]), 'rt', encoding='utf-8') as f:
+            return json.load(f)['appointments']
+
+    def take(self, days, occupancy):
+        # Called with the state locked while a snapshot is taken. Picks the
+        # segments to write and returns the keys of the days that stay in
+        # the snapshot, oldest first
+        last = self.last_year()
+        hot = []
+        years = {}
+        for key in sorted(days):
+            year = date.fromordinal(key).year
+            if year <= last or year in self.segments:
+                years.setdefault(year, []).append(key)
+            else:
+                hot.append(key)
+        # A year not read in keeps its segment, whatever happened to it
+        dirty = self.dirty - self.unloaded
+        write = {year: {day_str(key): days[key].to_json() for key in keys}
+                 for year, keys in years.items()
+                 if year not in self.unloaded and (year not in self.segments or year in dirty)}
+        listing = {}
+        for year in sorted(set(years) | (set(self.segments) - dirty)):
+            months = {}
+            for month in range(1, 13):
+                counts = occupancy.months.get((year, month))
+                if counts is not None and any(counts):
+                    months[str(month)] = list(counts)
+            listing[year] = {'months': months}
+        self.inflight = (write, listing, dirty)
+        self.dirty -= dirty
+        self.due = False
+        return hot
+
+    def write(self):
+        # Called under the file lock before the snapshot is written; returns
+        # the snapshot's "archive" entry
+        write, listing, dirty = self.inflight
+        if write:
+            os.makedirs(self.dir, exist_ok=True)
+        entry = {}
+        self.written = []
+        for year, value in listing.items():
+            if year in write:
+                name = f"{year}-{os.urandom(4).hex()}.json.gz"
+                self.written.append(name)
+                with open(os.path.join(self.dir, name), 'wb') as f:
+                    with gzip.GzipFile(fileobj=f, mode='wb') as gz:
+                        gz.write(json.dumps({'appointments': write[year]},
+                                            separators=(',', ':')).encode('utf-8'))
+                    f.flush()
+                    os.fsync(f.fileno())
+                    _count_written(f.tell())
+            else:
+                name = self.segments[year]
+            entry[str(year)] = dict(value, file=name)
+        return entry
+
+    def commit(self, entry):
+        # The snapshot listing `entry` is on disk: use its segments and
+        # delete the ones the snapshot it replaced listed and it does not
+        replaced = set(self.segments.values())
+        self.segments = {int(year): value['file'] for year, value in entry.items()}
+        self.inflight = None
+        self.written = []
+        for name in replaced - set(self.segments.values()):
+            try:
+                os.remove(os.path.join(self.dir, name))
+            except FileNotFoundError:
+                pass
+
+    def discard(self):
+        # The snapshot was not written: no snapshot lists the new segments
+        for name in self.written:
+            try:
+                os.remove(os.path.join(self.dir, name))
+            except FileNotFoundError:
+                pass
+        self.written = []
+
+    def restore(self):
+        # No snapshot was written; the taken years are tried again next time
+        if self.inflight is not None:
+            write, listing, dirty = self.inflight
+            self.dirty |= dirty
+            self.due = self.due or bool(write)
+            self.inflight = None
+
+
+class OccupancyIndex:
+    """Appointment counts per day, grouped by (year, month).
+
+    Each month maps to a list of 32 counts indexed by day of month, so
+    rendering a month is one dict lookup. With complete=True every month
+    not in the index is known to be empty; otherwise missing months are
+    unknown and have to be filled in by the backend.
+    """
+
+    def __init__(self, complete=True):
+        self.complete = complete
+        self.months = {}
+
+    @staticmethod
+    def split(date_str):
+        return int(date_str[0:4]), int(date_str[5:7]), int(date_str[8:10])
+
+    def build(self, days):
+        # From {ordinal: appointments}
+        self.months = {}
+        for key, appts in days.items():
+            if appts:
+                day = date.fromordinal(key)
+                counts = self.months.get((day.year, day.month))
+                if counts is None:
+                    counts = self.months[(day.year, day.month)] = [0] * 32
+                counts[day.day] += len(appts)
+
+    def get(self, year, month):
+        counts = self.months.get((year, month))
+        if counts is None and self.complete:
+            return [0] * 32
+        return counts
+
+    def add(self, date_str, delta):
+        year, month, day = self.split(date_str)
+        counts = self.months.get((year, month))
+        if counts is None:
+            if not self.complete:
+                return
+            counts = self.months[(year, month)] = [0] * 32
+        counts[day] += delta
+
+
+class IntervalIndex:
+    """Timed appointments by start, in minutes counted from 0001-01-01.
+
+    starts is kept sorted with durations and texts alongside, so the
+    appointments that overlap a range are found by bisecting from the
+    range start minus the longest appointment held. lengths counts the
+    appointments of each length to keep that bound current. A day's
+    entries are replaced together whenever one of them changes.
+    """
+
+    def __init__(self):
+        self.starts = []
+        self.durations = []
+        self.texts = []
+        self.lengths = {}
+
+    def build(self, days):
+        # From {ordinal: Day}
+        self.__init__()
+        for key in sorted(days):
+            if days[key].times is not None:
+                self.set_day(key, days[key])
+
+    def set_day(self, key, day):
+        lo = bisect_left(self.starts, key * MINUTES_PER_DAY)
+        hi = bisect_left(self.starts, (key + 1) * MINUTES_PER_DAY, lo)
+        lengths = self.lengths
+        for duration in self.durations[lo:hi]:
+            length = max(duration or 0, 1)
+            lengths[length] -= 1
+            if not lengths[length]:
+                del lengths[length]
+        starts, durations, texts = [], [], []
+        if day is not None and day.times is not None:
+            # The day is in time order, so these come out sorted
+            base = key * MINUTES_PER_DAY
+            day_durations = day.durations or [None] * len(day)
+            for text, minute, duration in zip(day.texts, day.times, day_durations):
+                if minute is not None:
+                    starts.append(base + minute)
+                    durations.append(duration)
+                    texts.append(text)
+                    length = max(duration or 0, 1)
+                    lengths[length] = lengths.get(length, 0) + 1
+        self.starts[lo:hi] = starts
+        self.durations[lo:hi] = durations
+        self.texts[lo:hi] = texts
+
+    def overlapping(self, first, last):
+        lo = bisect_left(self.starts, first - max(self.lengths, default=1) + 1)
+        hi = bisect_left(self.starts, max(last, first + 1), lo)
+        return [(start, duration, text) for start, duration, text in
+                zip(self.starts[lo:hi], self.durations[lo:hi], self.texts[lo:hi])
+                if occupied_until(start, duration) > first]
+
+
+class StorageBackend:
+    """Interface the app talks to; edits arrive as journal-style records.
+
+    Task lists and recurrence rules are small and always held in memory as
+    todo_today, todo_later and recurring (rule id -> rule). Appointments
+    are only reached through the query methods, so a backend is free to
+    keep them on disk.
+
+    apply() only changes memory (or an open transaction) and is cheap;
+    flush() makes the applied edits durable and may run on a worker
+    thread. Both take self.lock so they never interleave. merge_changes()
+    picks up edits saved by other instances sharing the same files.
+    """
+
+    lock = None
+
+    def load(self):
+        raise NotImplementedError
+
+    def appointments_on(self, date_str):
+        # Appointment texts in time order, untimed ones first
+        raise NotImplementedError
+
+    def entries_on(self, date_str):
+        # The same appointments as Appointment records, with their times
+        raise NotImplementedError
+
+    def insert_position(self, date_str, time):
+        # The index in entries_on() an appointment at `time` (None: no time)
+        # is added at: after the untimed ones and any starting no later
+        return sum(1 for appt in self.entries_on(date_str)
+                   if appt.time is None or (time is not None and appt.time <= time))
+
+    def appointments_between(self, start, end):
+        # Returns {date_str: [appointment, ...]} for start <= date <= end
+        raise NotImplementedError
+
+    def timed_between(self, first, last):
+        # Returns [(start, duration, text), ...] by start for the timed
+        # appointments that overlap minutes first..last, counted from
+        # 0001-01-01, each taking up the time occupied_until() gives
+        raise NotImplementedError
+
+    def month_counts(self, year, month):
+        # Returns a list of 32 appointment counts indexed by day of month
+        raise NotImplementedError
+
+    def year_counts(self, year):
+        # month_counts() for January to December, in a list
+        return [self.month_counts(year, month) for month in range(1, 13)]
+
+    def task_done(self, list_name):
+        # Whether each task in the list is done, in list order
+        raise NotImplementedError
+
+    def is_done(self, list_name, index):
+        return self.task_done(list_name)[index]
+
+    def iter_days(self, entries=False, archived=True):
+        # Yields (date_str, [appointment, ...]) for every day, oldest first;
+        # Appointment records rather than texts with entries=True. With
+        # archived=False, days in archived years are left out
+        raise NotImplementedError
+
+    def iter_archived(self):
+        # Yields (date_str, [appointment, ...]) for the days in archived years
+        return iter(())
+
+    # Set when search_appointments() works; otherwise the store keeps every
+    # appointment's words in its own SearchIndex
+    searches_text = False
+
+    def search_appointments(self, terms, limit):
+        # Distinct (date_str, text) appointments with a word starting with
+        # each of the lowercase terms, up to limit, plus whether more were
+        # left out
+        raise NotImplementedError
+
+    def apply(self, record):
+        # Returns whether the record changed anything
+        raise NotImplementedError
+
+    def flush(self, compact=False):
+        # Saves nothing while held
+        pass
+
+    # A batch holds the backend while it is applied, so the save worker
+    # never writes half of one
+    held = 0
+
+    def hold(self):
+        with self.lock:
+            self.held += 1
+
+    def release(self):
+        with self.lock:
+            self.held -= 1
+
+    def merge_changes(self):
+        # Applies what other instances saved since the last call and returns
+        # [(record, changed), ...], or None when only reload() will do
+        return []
+
+    def reload(self):
+        # Reads everything again; returns the changed (days, task lists,
+        # whether rules changed), days being None if unknown, or None when
+        # the files are busy and it should be retried later
+        return None
+
+    def close(self, save=True):
+        # save=False drops the edits not yet flushed
+        if save:
+            self.flush()
+
+
+class JsonBackend(StorageBackend):
+    """Everything is held in memory in the compact calendar_model records:
+    days maps ordinal day numbers to Day records and tasks maps each list
+    name to a TaskList. Text repeated in the file is shared on load.
+
+    Past years are kept in an Archive and only read into days when a
+    query reaches them; see Archive for archive_after.
+    """
+
+    def __init__(self, data_file, archive_after=365):
+        self.data_file = data_file
+        self.journal = Journal(data_file)
+        self.archive = Archive(data_file, archive_after)
+        self.days = {}
+        self.tasks = {'today': TaskList(), 'later': TaskList()}
+        self.recurring = {}
+        self.occupancy = OccupancyIndex()
+        self.intervals = IntervalIndex()
+        self.lock = threading.RLock()
+
+    def set_aside(self, suffix):
+        # Keep the journal and the archived years with the snapshot they
+        # belong to; the archive goes where a backend opened on the set
+        # aside file would look for it
+        os.rename(self.data_file, self.data_file + suffix)
+        if os.path.exists(self.journal.path):
+            os.rename(self.journal.path, self.journal.path + suffix)
+        if os.path.isdir(self.archive.dir):
+            target = Archive(self.data_file + suffix).dir
+            if os.path.isdir(target):
+                # As the snapshot it belonged to was just replaced
+                shutil.rmtree(target)
+            os.rename(self.archive.dir, target)
+        self.journal.snapshot_id = None
+
+    def load(self):
+        # Exclusive, since replaying may truncate a half-written record
+        with file_lock(self.journal.lock_path):
+            self._load()
+
+    @property
+    def todo_today(self):
+        return self.tasks['today'].texts
+
+    @property
+    def todo_later(self):
+        return self.tasks['later'].texts
+
+    def _load(self):
+        self.days = {}
+        self.tasks = {'today': TaskList(), 'later': TaskList()}
+        self.recurring = {}
+        self.occupancy = OccupancyIndex()
+        self.intervals = IntervalIndex()
+        archived = self.archive.load({})
+        base_seq = 0
+
+        if os.path.exists(self.data_file):
+            try:
+                with open(self.data_file, 'r') as f:
+                    content = f.read()
+
+                if not content.strip():
+                    print("Data file is empty, starting fresh.")
+                else:
+                    data = json.loads(content)
+                    pool = TextPool()
+                    self.tasks = {'today': TaskList.from_json(data.get('todo_today', []), pool),
+                                  'later': TaskList.from_json(data.get('todo_later', []), pool)}
+                    self.days = {day_key(date_str): Day.from_json(appts, pool)
+                                 for date_str, appts in data.get('appointments', {}).items() if appts}
+                    self.recurring = {rule['id']: rule for rule in data.get('recurring', [])}
+                    archived = self.archive.load(data.get('archive', {}))
+                    base_seq = data.get('journal_seq', 0)
+                    print(f"Successfully loaded data from {self.data_file}")
+
+            except json.JSONDecodeError as e:
+                print(f"JSON parsing error: {e}")
+                print("Creating backup and starting with fresh data.")
+                self.set_aside('.corrupted')
+                return
+            except Exception as e:
+                print(f"Error loading data: {e}")
+                print("Starting with fresh data.")
+                self.days = {}
+                self.tasks = {'today': TaskList(), 'later': TaskList()}
+                return
+        else:
+            print(f"No existing data file found at {self.data_file}. Starting fresh.")
+
+        try:
+            self.journal.replay(self, base_seq)
+            if self.journal.records:
+                print(f"Replayed {self.journal.records} journal records")
+        except Exception as e:
+            print(f"Error replaying journal: {e}")
+
+        self.occupancy.build(self.days)
+        for (year, month), counts in archived.items():
+            if year in self.archive.unloaded:
+                self.occupancy.months[(year, month)] = counts
+        self.intervals.build(self.days)
+        last = self.archive.last_year()
+        if last:
+            cutoff = date(last + 1, 1, 1).toordinal()
+            self.archive.due = any(key < cutoff and date.fromordinal(key).year not in self.archive.segments
+                                   for key in self.days)
+
+    def _need(self, year):
+        # Reads an archived year's days in the first time a query reaches it
+        if year not in self.archive.unloaded:
+            return
+        with self.lock:
+            if year not in self.archive.unloaded:
+                return
+            try:
+                appointments = self.archive.read(year)
+            except (OSError, ValueError) as e:
+                print(f"Error reading archived appointments for {year}: {e}")
+                return
+            self.archive.unloaded.discard(year)
+            pool = TextPool()
+            for date_str, appts in appointments.items():
+                key = day_key(date_str)
+                day = self.days[key] = Day.from_json(appts, pool)
+                if day.times is not None:
+                    self.intervals.set_day(key, day)
+            for record in self.archive.deferred.pop(year, ()):
+                self.apply(record, log=False)
+
+    def _need_between(self, first, last):
+        # The same for every archived year from ordinal first to last
+        if self.archive.unloaded:
+            first, last = date.fromordinal(max(first, 1)).year, date.fromordinal(last).year
+            for year in sorted(self.archive.unloaded):
+                if first <= year <= last:
+                    self._need(year)
+
+    def appointments_on(self, date_str):
+        self._need(int(date_str[:4]))
+        day = self.days.get(day_key(date_str))
+        return list(day.texts) if day is not None else []
+
+    def entries_on(self, date_str):
+        self._need(int(date_str[:4]))
+        day = self.days.get(day_key(date_str))
+        return [day.entry(i) for i in range(len(day))] if day is not None else []
+
+    def insert_position(self, date_str, time):
+        self._need(int(date_str[:4]))
+        day = self.days.get(day_key(date_str))
+        if day is None or day.times is None:
+            return len(day) if day is not None else 0
+        return sum(1 for other in day.times if other is None or (time is not None and other <= time))
+
+    def appointments_between(self, start, end):
+        first, last = start.toordinal(), end.toordinal()
+        self._need_between(first, last)
+        if last - first < len(self.days):
+            keys = range(first, last + 1)
+        else:
+            keys = sorted(key for key in self.days if first <= key <= last)
+        result = {}
+        for key in keys:
+            day = self.days.get(key)
+            if day is not None:
+                result[day_str(key)] = list(day.texts)
+        return result
+
+    def timed_between(self, first, last):
+        with self.lock:
+            # Back a day for appointments running past midnight
+            self._need_between(first // MINUTES_PER_DAY - 1, last // MINUTES_PER_DAY)
+            return self.intervals.overlapping(first, last)
+
+    def month_counts(self, year, month):
+        return self.occupancy.get(year, month)
+
+    def iter_days(self, entries=False, archived=True):
+        # Tolerates edits from another thread while it runs; days added
+        # after it starts are not visited
+        if archived:
+            for year in sorted(self.archive.unloaded):
+                self._need(year)
+            return self._iter_days(sorted(self.days), entries)
+        years = set(self.archive.segments)
+        return self._iter_days([key for key in sorted(self.days)
+                                if not years or date.fromordinal(key).year not in years], entries)
+
+    def iter_archived(self):
+        for year in sorted(self.archive.unloaded):
+            self._need(year)
+        years = set(self.archive.segments)
+        return self._iter_days([key for key in sorted(self.days)
+                                if years and date.fromordinal(key).year in years], False)
+
+    def _iter_days(self, keys, entries):
+        for key in keys:
+            day = self.days.get(key)
+            if day:
+                if entries:
+                    yield day_str(key), [day.entry(i) for i in range(len(day))]
+                else:
+                    yield day_str(key), list(day.texts)
+
+    def apply(self, record, log=True):
+        with self.lock:
+            date_str = record['date'] if record['op'].endswith('_appointment') else None
+            if date_str is not None:
+                year = int(date_str[:4])
+                self._need(year)
+                if year in self.archive.unloaded:
+                    if log:
+                        raise OSError(f"Archived appointments for {year} could not be read; "
+                                      f"not changing them")
+                    # Already in the journal; applied once the year is read
+                    self.archive.deferred.setdefault(year, []).append(record)
+                    return False
+                if year in self.archive.segments or year <= self.archive.last_year():
+                    self.archive.dirty.add(year)
+                key = day_key(date_str)
+                day = self.days.get(key)
+                before = len(day) if day is not None else 0
+                timed = day is not None and day.times is not None
+            changed = apply_record(self, record)
+            if date_str is not None:
+                day = self.days.get(key)
+                self.occupancy.add(date_str, (len(day) if day is not None else 0) - before)
+                if timed or (day is not None and day.times is not None):
+                    self.intervals.set_day(key, day)
+            if log:
+                self.journal.append(record)
+            return changed
+
+    def flush(self, compact=False):
+        # Copy under the lock, write without it so the UI thread can keep editing
+        with self.lock:
+            if self.held:
+                return
+            if not self.journal.pending and not compact:
+                # Nothing to save, so a store that was only read (a listing
+                # from the command-line tool) leaves the files as they were;
+                # archiving waits for a save with edits in it
+                return
+            records, data, covered = self.journal.take(self, compact or self.archive.due,
+                                                       not self.archive.held())
+        try:
+            written = self.journal.write(records, data, covered,
+                                         self.archive if data is not None else None)
+        except Exception:
+            with self.lock:
+                self.journal.pending[:0] = records
+                self.journal.inflight = []
+                self.archive.restore()
+            raise
+        if data is not None and not written:
+            with self.lock:
+                self.archive.restore()
+
+    def merge_changes(self):
+        with self.lock:
+            records = self.journal.changes()
+            if records is None:
+                return None
+            return [(record, self.apply(record, log=False)) for record in records]
+
+    def reload(self):
+        # Another instance folded the journal into a new snapshot. Read it
+        # all again and put back our edits that are not on disk yet
+        with self.lock, file_lock(self.journal.lock_path, blocking=False) as locked:
+            if not locked:
+                return None
+            old_days = self.days
+            old_tasks = self.tasks
+            old_rules = self.recurring
+            unsaved = self.journal.inflight + self.journal.pending
+            pending = self.journal.pending
+            self._load()
+            self.journal.pending = pending
+            for record in unsaved:
+                self.apply(record, log=False)
+
+        days = {day_str(key) for key in set(old_days) | set(self.days)
+                if old_days.get(key) != self.days.get(key)}
+        lists = {name for name, tasks in old_tasks.items() if tasks != self.tasks[name]}
+        return days, lists, old_rules != self.recurring
+
+    def task_list(self, list_name):
+        return self.todo_today if list_name == 'today' else self.todo_later
+
+    def task_done(self, list_name):
+        tasks = self.tasks[list_name]
+        return list(tasks.done) if tasks.done is not None else [False] * len(tasks)
+
+    def is_done(self, list_name, index):
+        return self.tasks[list_name].entry(index).done
+
+
+class SQLiteBackend(StorageBackend):
+    """Appointments live in an indexed table and are never loaded wholesale.
+
+    A timed appointment stores its start in minutes counted from
+    0001-01-01, so overlaps and free time are found through an index
+    across days; appointments without a time leave start NULL.
+
+    On first use an existing JSON data file (snapshot plus journal) is
+    imported once; the JSON files are left in place untouched.
+
+    Every edit is also logged in the changes table, in the same
+    transaction, so other instances can tell what changed. They notice
+    that something did through PRAGMA data_version, which costs no disk
+    read.
+
+    Appointment texts are also in an FTS5 full-text table, kept in step
+    by triggers, which search_appointments() queries, so searching holds
+    no appointment in memory either. Without FTS5 in the SQLite library
+    the store's in-memory search index is used instead.
+    """
+
+    # Rows kept in the changes table; an instance further behind reloads
+    KEEP_CHANGES = 10000
+
+    SCHEMA_VERSION = 3
+
+    def __init__(self, db_file, json_file=None):
+        self.db_file = db_file
+        self.json_file = json_file
+        self.conn = None
+        self.todo_today = []
+        self.todo_later = []
+        self.recurring = {}
+        self._task_ids = {'today': [], 'later': []}
+        self._task_done = {'today': [], 'later': []}
+        self._next_position = 0
+        self.src = os.urandom(8).hex()
+        self.change_seq = 0
+        self.data_version = None
+        # Months are counted on first display and kept up to date after that
+        self.occupancy = OccupancyIndex(complete=False)
+        # The connection is shared with the save worker, which commits
+        self.lock = threading.RLock()
+
+    def load(self):
+        # Imported here so the JSON backend never pays for it at startup
+        import sqlite3
+        self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+                CREATE TABLE IF NOT EXISTS appointments (
+                    id INTEGER PRIMARY KEY,
+                    day TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    start INTEGER,
+                    duration INTEGER);
+                CREATE INDEX IF NOT EXISTS appointments_day ON appointments (day, id);
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id INTEGER PRIMARY KEY,
+                    list TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    text TEXT NOT NULL,
+                    done INTEGER NOT NULL DEFAULT 0);
+                CREATE TABLE IF NOT EXISTS recurrences (
+                    id TEXT PRIMARY KEY,
+                    rule TEXT NOT NULL);
+                CREATE TABLE IF NOT EXISTS changes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    src TEXT NOT NULL,
+                    record TEXT NOT NULL);
+            """)
+
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+        if row is None:
+            self.migrate()
+        elif int(row[0]) < self.SCHEMA_VERSION:
+            self.upgrade()
+        with self.conn:
+            self.conn.executescript("""
+                CREATE INDEX IF NOT EXISTS appointments_start ON appointments (start)
+                    WHERE start IS NOT NULL;
+                CREATE INDEX IF NOT EXISTS appointments_duration ON appointments (duration)
+                    WHERE duration IS NOT NULL;
+            """)
+        self._create_text_index()
+
+        self._load_tasks()
+        self.recurring = {rule_id: json.loads(rule) for rule_id, rule in
+                          self.conn.execute("SELECT id, rule FROM recurrences")}
+        self.change_seq = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+        self.data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        print(f"Successfully opened {self.db_file}")
+
+    def _create_text_index(self):
+        # Filled from the table the first time. The triggers live in the
+        # database, so every writer keeps the index current
+        import sqlite3
+        try:
+            with self.conn:
+                exists = self.conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'appointments_text'").fetchone()
+                if exists:
+                    self.searches_text = True
+                    return
+                self.conn.executescript("""
+                    CREATE VIRTUAL TABLE appointments_text USING fts5(
+                        text, content='appointments', content_rowid='id',
+                        tokenize="unicode61 remove_diacritics 0 tokenchars '_'");
+                    CREATE TRIGGER appointments_text_insert AFTER INSERT ON appointments BEGIN
+                        INSERT INTO appointments_text (rowid, text) VALUES (new.id, new.text);
+                    END;
+                    CREATE TRIGGER appointments_text_delete AFTER DELETE ON appointments BEGIN
+                        INSERT INTO appointments_text (appointments_text, rowid, text)
+                            VALUES ('delete', old.id, old.text);
+                    END;
+                    CREATE TRIGGER appointments_text_update AFTER UPDATE OF text ON appointments
+                    BEGIN
+                        INSERT INTO appointments_text (appointments_text, rowid, text)
+                            VALUES ('delete', old.id, old.text);
+                        INSERT INTO appointments_text (rowid, text) VALUES (new.id, new.text);
+                    END;
+                    INSERT INTO appointments_text (appointments_text) VALUES ('rebuild');
+                """)
+            self.searches_text = True
+        except sqlite3.OperationalError as e:
+            print(f"Full-text search not available in SQLite ({e}); searching in memory")
+
+    def _load_tasks(self):
+        self.todo_today[:] = []
+        self.todo_later[:] = []
+        self._task_ids = {'today': [], 'later': []}
+        self._task_done = {'today': [], 'later': []}
+        for task_id, list_name, position, text, done in self.conn.execute(
+                "SELECT id, list, position, text, done FROM tasks ORDER BY position"):
+            self.task_list(list_name).append(text)
+            self._task_ids[list_name].append(task_id)
+            self._task_done[list_name].append(bool(done))
+            self._next_position = max(self._next_position, position + 1)
+
+    def migrate(self):
+        source = None
+        if self.json_file and (os.path.exists(self.json_file) or
+                               os.path.exists(self.json_file + '.journal')):
+            print(f"Importing {self.json_file} into {self.db_file}...")
+            # Only read: no archiving and no flush, so the JSON files stay
+            # as they were for older versions and the JSON backend
+            source = JsonBackend(self.json_file, archive_after=0)
+            source.load()
+
+        with self.conn:
+            if source is not None:
+                self.conn.executemany(
+                    "INSERT INTO appointments (day, text, start, duration) VALUES (?, ?, ?, ?)",
+                    ((day, appt.text,
+                      day_key(day) * MINUTES_PER_DAY + appt.time if appt.time is not None else None,
+                      appt.duration)
+                     for day, appts in source.iter_days(entries=True) for appt in appts))
+                tasks = [(list_name, text, done) for list_name in ('today', 'later')
+                         for text, done in zip(source.task_list(list_name), source.task_done(list_name))]
+                self.conn.executemany(
+                    "INSERT INTO tasks (list, position, text, done) VALUES (?, ?, ?, ?)",
+                    ((list_name, position, text, done)
+                     for position, (list_name, text, done) in enumerate(tasks)))
+                self.conn.executemany(
+                    "INSERT INTO recurrences (id, rule) VALUES (?, ?)",
+                    ((rule_id, json.dumps(rule)) for rule_id, rule in source.recurring.items()))
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('schema_version', ?)",
+                              (str(self.SCHEMA_VERSION),))
+            if source is not None:
+                self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('migrated_from', ?)",
+                                  (self.json_file,))
+
+    def upgrade(self):
+        # Databases from before appointments had times or tasks could be done
+        with self.conn:
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(appointments)")}
+            if 'start' not in columns:
+                self.conn.execute("ALTER TABLE appointments ADD COLUMN start INTEGER")
+                self.conn.execute("ALTER TABLE appointments ADD COLUMN duration INTEGER")
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(tasks)")}
+            if 'done' not in columns:
+                self.conn.execute("ALTER TABLE tasks ADD COLUMN done INTEGER NOT NULL DEFAULT 0")
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('schema_version', ?)",
+                              (str(self.SCHEMA_VERSION),))
+
+    def task_list(self, list_name):
+        return self.todo_today if list_name == 'today' else self.todo_later
+
+    def task_done(self, list_name):
+        return list(self._task_done[list_name])
+
+    def is_done(self, list_name, index):
+        return self._task_done[list_name][index]
+
+    @staticmethod
+    def _entry(text, start, duration):
+        return Appointment(text, start % MINUTES_PER_DAY if start is not None else None, duration)
+
+    def appointments_on(self, date_str):
+        # NULL sorts first, so appointments without a time come first
+        with self.lock:
+            return [text for (text,) in self.conn.execute(
+                "SELECT text FROM appointments WHERE day = ? ORDER BY start, id", (date_str,))]
+
+    def entries_on(self, date_str):
+        with self.lock:
+            return [self._entry(*row) for row in self.conn.execute(
+                "SELECT text, start, duration FROM appointments WHERE day = ? ORDER BY start, id",
+                (date_str,))]
+
+    def insert_position(self, date_str, time):
+        with self.lock:
+            if time is None:
+                return self.conn.execute(
+                    "SELECT COUNT(*) FROM appointments WHERE day = ? AND start IS NULL",
+                    (date_str,)).fetchone()[0]
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM appointments WHERE day = ? AND (start IS NULL OR start <= ?)",
+                (date_str, day_key(date_str) * MINUTES_PER_DAY + time)).fetchone()[0]
+
+    def search_appointments(self, terms, limit):
+        # Each term as a quoted prefix query; terms only hold word characters
+        match = ' '.join(f'"{term}"*' for term in terms)
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT DISTINCT day, text FROM appointments "
+                "WHERE id IN (SELECT rowid FROM appointments_text WHERE appointments_text MATCH ?) "
+                "LIMIT ?", (match, limit + 1)).fetchall()
+        return rows[:limit], len(rows) > limit
+
+    def appointments_between(self, start, end):
+        result = {}
+        with self.lock:
+            for day, text in self.conn.execute(
+                    "SELECT day, text FROM appointments WHERE day BETWEEN ? AND ? ORDER BY day, start, id",
+                    (start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"))):
+                result.setdefault(day, []).append(text)
+        return result
+
+    def timed_between(self, first, last):
+        with self.lock:
+            longest = self.conn.execute(
+                "SELECT MAX(duration) FROM appointments WHERE duration IS NOT NULL").fetchone()[0]
+            rows = self.conn.execute(
+                "SELECT start, duration, text FROM appointments WHERE start >= ? AND start < ? "
+                "ORDER BY start, id",
+                (first - occupied_until(0, longest) + 1, max(last, first + 1))).fetchall()
+        return [row for row in rows if occupied_until(row[0], row[1]) > first]
+
+    def month_counts(self, year, month):
+        with self.lock:
+            counts = self.occupancy.get(year, month)
+            if counts is None:
+                counts = [0] * 32
+                first = f"{year:04d}-{month:02d}-01"
+                last = f"{year:04d}-{month:02d}-31"
+                for day, count in self.conn.execute(
+                        "SELECT day, COUNT(*) FROM appointments WHERE day BETWEEN ? AND ? GROUP BY day",
+                        (first, last)):
+                    counts[int(day[8:10])] = count
+                self.occupancy.months[(year, month)] = counts
+            return counts
+
+    def year_counts(self, year):
+        # One query for the months of the year not counted yet
+        with self.lock:
+            missing = [month for month in range(1, 13) if self.occupancy.get(year, month) is None]
+            if missing:
+                months = {month: [0] * 32 for month in missing}
+                for day, count in self.conn.execute(
+                        "SELECT day, COUNT(*) FROM appointments WHERE day BETWEEN ? AND ? GROUP BY day",
+                        (f"{year:04d}-{missing[0]:02d}-01", f"{year:04d}-{missing[-1]:02d}-31")):
+                    counts = months.get(int(day[5:7]))
+                    if counts is not None:
+                        counts[int(day[8:10])] = count
+                for month, counts in months.items():
+                    self.occupancy.months[(year, month)] = counts
+            return [self.occupancy.get(year, month) for month in range(1, 13)]
+
+    def iter_days(self, entries=False, archived=True, chunk=5000):
+        # Page through the (day, id) index so the lock is never held for long
+        last = ('', 0)
+        date_str, rows_of_day = None, []
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT day, id, text, start, duration FROM appointments WHERE (day, id) > (?, ?) "
+                    "ORDER BY day, id LIMIT ?", (last[0], last[1], chunk)).fetchall()
+            if not rows:
+                break
+            for row in rows:
+                if row[0] != date_str:
+                    if rows_of_day:
+                        yield date_str, self._day_order(rows_of_day, entries)
+                    date_str, rows_of_day = row[0], []
+                rows_of_day.append(row)
+            last = rows[-1][:2]
+        if rows_of_day:
+            yield date_str, self._day_order(rows_of_day, entries)
+
+    def _day_order(self, rows, entries):
+        # Rows arrive by id; put timed ones after the rest, by start
+        if any(row[3] is not None for row in rows):
+            rows.sort(key=lambda row: (row[3] is not None, row[3] or 0))
+        if entries:
+            return [self._entry(text, start, duration) for day, appt_id, text, start, duration in rows]
+        return [row[2] for row in rows]
+
+    def _find_task(self, list_name, index, text):
+        task_list = self.task_list(list_name)
+        if not (0 <= index < len(task_list) and task_list[index] == text):
+            if text not in task_list:
+                return None
+            index = task_list.index(text)
+        return index
+
+    def apply(self, record):
+        # Statements run in the open transaction; flush() commits them
+        with self.lock:
+            changed = self._apply(record)
+            if changed:
+                self.conn.execute("INSERT INTO changes (src, record) VALUES (?, ?)",
+                                  (self.src, json.dumps(record)))
+            return changed
+
+    def _apply(self, record):
+        op = record['op']
+        changed = True
+        with self.lock:
+            if op == 'add_appointment':
+                minute = record.get('time')
+                start = day_key(record['date']) * MINUTES_PER_DAY + minute if minute is not None else None
+                self.conn.execute("INSERT INTO appointments (day, text, start, duration) VALUES (?, ?, ?, ?)",
+                                  (record['date'], record['text'], start, record.get('duration')))
+                self.occupancy.add(record['date'], 1)
+            elif op == 'remove_appointment':
+                ids = [(appt_id, text) for appt_id, text in self.conn.execute(
+                    "SELECT id, text FROM appointments WHERE day = ? ORDER BY start, id", (record['date'],))]
+                index = record.get('index', -1)
+                if not (0 <= index < len(ids) and ids[index][1] == record['text']):
+                    index = next((i for i, (_, text) in enumerate(ids) if text == record['text']), None)
+                if index is None:
+                    return False
+                self.conn.execute("DELETE FROM appointments WHERE id = ?", (ids[index][0],))
+                self.occupancy.add(record['date'], -1)
+            elif op == 'add_task':
+                list_name = record['list']
+                task_ids = self._task_ids[list_name]
+                index = record.get('index', len(task_ids))
+                done = record.get('done', False)
+                cur = self.conn.execute("INSERT INTO tasks (list, position, text, done) VALUES (?, ?, ?, ?)",
+                                        (list_name, self._next_position, record['text'], done))
+                self._next_position += 1
+                self.task_list(list_name).insert(index, record['text'])
+                task_ids.insert(index, cur.lastrowid)
+                self._task_done[list_name].insert(index, done)
+                if index < len(task_ids) - 1:
+                    # Put back in the middle (undo): number the list afresh
+                    self.conn.executemany("UPDATE tasks SET position = ? WHERE id = ?",
+                                          ((self._next_position + i, task_id)
+                                           for i, task_id in enumerate(task_ids)))
+                    self._next_position += len(task_ids)
+            elif op == 'remove_task':
+                index = self._find_task(record['list'], record.get('index', -1), record['text'])
+                if index is None:
+                    return False
+                task_id = self._task_ids[record['list']].pop(index)
+                del self.task_list(record['list'])[index]
+                del self._task_done[record['list']][index]
+                self.conn.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+            elif op == 'set_done':
+                index = self._find_task(record['list'], record.get('index', -1), record['text'])
+                if index is None or self._task_done[record['list']][index] == record['done']:
+                    return False
+                self._task_done[record['list']][index] = record['done']
+                self.conn.execute("UPDATE tasks SET done = ? WHERE id = ?",
+                                  (record['done'], self._task_ids[record['list']][index]))
+            elif op == 'move_task':
+                index = self._find_task('later', record.get('index', -1), record['text'])
+                if index is None:
+                    return False
+                task_id = self._task_ids['later'].pop(index)
+                self.todo_today.append(self.todo_later.pop(index))
+                self._task_ids['today'].append(task_id)
+                self._task_done['today'].append(self._task_done['later'].pop(index))
+                self.conn.execute("UPDATE tasks SET list = 'today', position = ? WHERE id = ?",
+                                  (self._next_position, task_id))
+                self._next_position += 1
+            elif op in ('add_rule', 'remove_rule', 'add_exception', 'remove_exception'):
+                changed = apply_record(self, record)
+                rule = self.recurring.get(record['rule']['id'] if op == 'add_rule' else record['id'])
+                if rule is None:
+                    self.conn.execute("DELETE FROM recurrences WHERE id = ?", (record['id'],))
+                else:
+                    self.conn.execute("INSERT OR REPLACE INTO recurrences (id, rule) VALUES (?, ?)",
+                                      (rule['id'], json.dumps(rule)))
+            else:
+                raise ValueError(f"Unknown operation: {op}")
+        return changed
+
+    def flush(self, compact=False):
+        with self.lock:
+            if self.conn is not None and not self.held:
+                self.conn.execute("DELETE FROM changes WHERE seq <= ?",
+                                  (self.change_seq - self.KEEP_CHANGES,))
+                before = _thread_wchar()
+                self.conn.commit()
+                _count_written(_thread_wchar() - before)
+
+    def merge_changes(self):
+        # The rows are already in the tables; only what is held in memory
+        # (task lists, rules, month counts) needs catching up
+        with self.lock:
+            if self.conn is None:
+                return []
+            version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+            if version == self.data_version:
+                return []
+            self.data_version = version
+            first = self.conn.execute("SELECT MIN(seq) FROM changes").fetchone()[0]
+            if first is not None and first > self.change_seq + 1:
+                return None
+            rows = self.conn.execute("SELECT seq, src, record FROM changes WHERE seq > ? ORDER BY seq",
+                                     (self.change_seq,)).fetchall()
+            merged = []
+            tasks_changed = False
+            for seq, src, text in rows:
+                self.change_seq = seq
+                if src == self.src:
+                    continue
+                record = json.loads(text)
+                op = record['op']
+                if op == 'add_appointment':
+                    self.occupancy.add(record['date'], 1)
+                elif op == 'remove_appointment':
+                    self.occupancy.add(record['date'], -1)
+                elif op in ('add_task', 'remove_task', 'set_done', 'move_task'):
+                    tasks_changed = True
+                else:
+                    rule_id = record['rule']['id'] if op == 'add_rule' else record['id']
+                    row = self.conn.execute("SELECT rule FROM recurrences WHERE id = ?", (rule_id,)).fetchone()
+                    if row is None:
+                        self.recurring.pop(rule_id, None)
+                    else:
+                        self.recurring[rule_id] = json.loads(row[0])
+                merged.append((record, True))
+            if tasks_changed:
+                self._load_tasks()
+            return merged
+
+    def reload(self):
+        with self.lock:
+            self._load_tasks()
+            self.recurring.clear()
+            self.recurring.update((rule_id, json.loads(rule)) for rule_id, rule in
+                                  self.conn.execute("SELECT id, rule FROM recurrences"))
+            self.occupancy = OccupancyIndex(complete=False)
+            self.change_seq = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+        return None, {'today', 'later'}, True
+
+    def close(self, save=True):
+        with self.lock:
+            if self.conn is not None:
+                if save:
+                    self.conn.commit()
+                else:
+                    self.conn.rollback()
+                self.conn.close()
+                self.conn = None
+
+
+def open_backend(kind, data_file, archive_after=365):
+    if kind == 'sqlite':
+        return SQLiteBackend(os.path.splitext(data_file)[0] + '.db', json_file=data_file)
+    return JsonBackend(data_file, archive_after)
+
+
+class SaveScheduler:
+    """Flushes a backend on a worker thread once edits stop arriving.
+
+    mark_dirty() is called after every edit. The worker waits until no
+    edit has arrived for `delay` seconds, so a burst of edits is written
+    once, but never more than `max_delay` after the first unsaved edit, so
+    other instances see the changes (and, with SQLite, are not kept
+    waiting on the open transaction) during a long burst. status is one
+    of 'saved', 'unsaved', 'saving' or 'error' and is safe to read from
+    the UI thread.
+    """
+
+    def __init__(self, backend, delay=0.5, retry_delay=5.0, max_delay=2.0):
+        self.backend = backend
+        self.delay = delay
+        self.max_delay = max_delay
+        self.retry_delay = retry_delay
+        self.status = 'saved'
+        self._cond = threading.Condition()
+        self._io_lock = threading.Lock()
+        self._dirty = False
+        self._due = 0
+        self._first = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='save-worker', daemon=True)
+        self._thread.start()
+
+    def mark_dirty(self):
+        with self._cond:
+            now = time.monotonic()
+            if not self._dirty:
+                self._first = now
+            self._dirty = True
+            self._due = min(now + self.delay, self._first + self.max_delay)
+            self.status = 'unsaved'
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if self._dirty:
+                        remaining = self._due - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                if self._closed:
+                    return
+            self.flush()
+
+    def flush(self):
+        with self._io_lock:
+            with self._cond:
+                if not self._dirty:
+                    return
+                self._dirty = False
+                self.status = 'saving'
+            try:
+                self.backend.flush()
+            except Exception as e:
+                print(f"Error saving data: {e}")
+                with self._cond:
+                    self._dirty = True
+                    self._due = time.monotonic() + self.retry_delay
+                    self.status = 'error'
+                return
+            with self._cond:
+                if not self._dirty:
+                    self.status = 'saved'
+
+    def close(self, save=True):
+        # Stop the worker, then write whatever is still pending
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        if save:
+            self.flush()
@@ -0,0 +1,663 @@
+"""
+Headless core of the Personal Calendar & Task Manager
+Appointments and task lists behind a small API with no Tk dependency,
+shared by the desktop app and the command-line tool
+"""
+
+import os
+from contextlib import contextmanager
+from datetime import date, datetime
+
+from calendar_model import MINUTES_PER_DAY, Appointment, occupied_until, parse_time
+from calendar_recurrence import OccurrenceCache, expand, make_rule
+from calendar_search import SearchIndex, merge, tokenize
+from calendar_storage import SaveScheduler, open_backend
+
+DEFAULT_DATA_FILE = os.path.expanduser("~/calendar_data.json")
+
+RULE_OPS = ('add_rule', 'remove_rule', 'add_exception', 'remove_exception')
+
+
+def parse_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def parse_time_range(value):
+    # "09:30", "09:30-10:15" or "" -> (minutes after midnight, duration),
+    # either of which may be None. An end before the start is the next day
+    value = value.strip()
+    if not value:
+        return None, None
+    start, sep, end = value.replace('–', '-').partition('-')
+    time = parse_time(start)
+    if not sep:
+        return time, None
+    duration = (parse_time(end) - time) % MINUTES_PER_DAY
+    if not duration:
+        raise ValueError(f"Ends when it starts: {value}")
+    return time, duration
+
+
+def _locate(texts, index, text):
+    # The entry a record means: its index if the text still matches there,
+    # else the first one with that text, as the backends resolve it
+    if 0 <= index < len(texts) and texts[index] == text:
+        return index
+    return texts.index(text) if text in texts else None
+
+
+def shift_month(day, delta):
+    # First day of the month `delta` months away from `day`
+    index = day.year * 12 + day.month - 1 + delta
+    return day.replace(year=index // 12, month=index % 12 + 1, day=1)
+
+
+class CalendarStore:
+    """Appointments and the two task lists, independent of any GUI.
+
+    Edits are applied in memory right away. With autosave a SaveScheduler
+    writes them out in the background; without it nothing is written until
+    flush() or close(). Wrap bulk edits in batch() so they are saved once;
+    if the block raises, the edits it made are rolled back.
+
+    With undo_depth set, each edit outside a batch and each whole batch is
+    remembered as the records that reverse it, and undo() applies them;
+    the last undo_depth of them are kept.
+
+    Recurring appointments are stored as rules and expanded per month
+    through an OccurrenceCache; appointments_on() and appointments_between()
+    return stored appointments only, while day_entries() and month_counts()
+    include the occurrences.
+
+    An appointment may have a start time and a duration. Each day is kept
+    in time order, and the storage indexes timed appointments across days,
+    so conflicts() and find_free_slot() never scan whole days.
+
+    A SearchIndex over every appointment, rule and task is built at load
+    and updated by each edit. load(index=False) leaves it to the caller,
+    so the appointments can be indexed on another thread with
+    index_appointments() while edits go on, then handed back through
+    install_search_index(). Archived years (see calendar_storage.Archive)
+    are left out until the first search, which reads and indexes them.
+    A backend that can search its appointments itself (SQLite, through
+    FTS5) is asked instead, and the index then only holds the rules and
+    tasks, so its memory does not grow with the history.
+
+    Other instances may edit the same data; sync() merges what they saved.
+    """
+
+    def __init__(self, data_file=DEFAULT_DATA_FILE, backend='json', autosave=True,
+                 archive_after=365, undo_depth=0):
+        self.data_file = data_file
+        self.storage = open_backend(backend, data_file, archive_after)
+        self.autosave = autosave
+        self.saver = None
+        self.dirty = False
+        self._batch_depth = 0
+        self.undo_depth = undo_depth
+        self.undo_stack = []
+        # Reversing records of the batch in progress, one list per edit;
+        # kept without undo too, to roll the batch back if it fails
+        self._undo_group = None
+        self._undoing = False
+        self.occurrences = OccurrenceCache({})
+        self.search_index = SearchIndex()
+        # Days edited while the search index is being built; None once it is current
+        self._index_backlog = None
+        self._archive_indexed = False
+
+    def load(self, index=True):
+        self.storage.load()
+        self.occurrences = OccurrenceCache(self.storage.recurring)
+        if index:
+            self.build_search_index()
+        else:
+            self._index_backlog = set()
+        if self.autosave:
+            self.saver = SaveScheduler(self.storage)
+
+    @property
+    def todo_today(self):
+        return self.storage.todo_today
+
+    @property
+    def todo_later(self):
+        return self.storage.todo_later
+
+    @property
+    def save_status(self):
+        if self.saver is not None:
+            return self.saver.status
+        return 'unsaved' if self.dirty else 'saved'
+
+    def task_list(self, list_name):
+        if list_name not in ('today', 'later'):
+            raise ValueError(f"Unknown task list: {list_name}")
+        return self.todo_today if list_name == 'today' else self.todo_later
+
+    def task_done(self, list_name):
+        # Whether each task in the list is done, in list order
+        self.task_list(list_name)
+        return self.storage.task_done(list_name)
+
+    # Queries
+
+    def appointments_on(self, day):
+        return self.storage.appointments_on(parse_date(day).isoformat())
+
+    def appointments_between(self, start, end):
+        return self.storage.appointments_between(parse_date(start), parse_date(end))
+
+    def iter_appointments(self, entries=False):
+        return self.storage.iter_days(entries)
+
+    def month_counts(self, year, month):
+        return self._with_occurrences(year, month, self.storage.month_counts(year, month))
+
+    def year_counts(self, year):
+        # month_counts() for each month of the year, January first; read
+        # from the occupancy index a month at a time rather than per day
+        return [self._with_occurrences(year, month, counts)
+                for month, counts in enumerate(self.storage.year_counts(year), 1)]
+
+    def _with_occurrences(self, year, month, counts):
+        occurrences = self.occurrences.month(year, month)
+        if not occurrences:
+            return counts
+        counts = list(counts)
+        for day, items in occurrences.items():
+            counts[day] += len(items)
+        return counts
+
+    def recurring_rules(self):
+        return list(self.storage.recurring.values())
+
+    def occurrences_between(self, start, end):
+        # {date_str: [(rule_id, text), ...]}
+        return self.occurrences.between(parse_date(start), parse_date(end))
+
+    def day_entries(self, day):
+        # (Appointment, rule_id, index) in time order: stored appointments
+        # without a time, then the recurring ones that fall on the day, then
+        # the timed ones. index is the position remove_appointment() takes,
+        # and None for a recurring appointment
+        day = parse_date(day)
+        stored = self.storage.entries_on(day.isoformat())
+        untimed = sum(1 for appt in stored if appt.time is None)
+        entries = [(appt, None, i) for i, appt in enumerate(stored[:untimed])]
+        for rule_id, text in self.occurrences.month(day.year, day.month).get(day.day, ()):
+            entries.append((Appointment(text), rule_id, None))
+        entries += [(appt, None, i) for i, appt in enumerate(stored[untimed:], untimed)]
+        return entries
+
+    def conflicts(self, day, time, duration=None):
+        # [(date, Appointment), ...] for the timed appointments that overlap
+        # one at `time` on `day`, including any running over from the day before
+        start = parse_date(day).toordinal() * MINUTES_PER_DAY + time
+        return [(date.fromordinal(begin // MINUTES_PER_DAY),
+                 Appointment(text, begin % MINUTES_PER_DAY, length))
+                for begin, length, text in self.storage.timed_between(start, occupied_until(start, duration))]
+
+    def find_free_slot(self, start, end, minutes, day_start=9 * 60, day_end=17 * 60):
+        """First gap of `minutes` between timed appointments from start to
+        end (dates, inclusive), looking only between day_start and day_end
+        (minutes after midnight) on each day. Given a datetime, the search
+        starts from its time. Returns (date, minutes after midnight) or None.
+        Slots start on a multiple of five minutes.
+
+        Appointments without a time and repeating ones take up no time.
+        """
+        earliest = 0
+        if isinstance(start, datetime):
+            earliest = start.toordinal() * MINUTES_PER_DAY + start.hour * 60 + start.minute
+        first, last = parse_date(start).toordinal(), parse_date(end).toordinal()
+        busy_until = 0
+        for key in range(first, last + 1):
+            if (key - first) % 31 == 0:
+                # A month at a time, so a slot found early costs little;
+                # entries running into the next month are fetched again
+                chunk_end = min(key + 30, last)
+                busy = self.storage.timed_between(max(key * MINUTES_PER_DAY + day_start, earliest),
+                                                  chunk_end * MINUTES_PER_DAY + day_end)
+                i = 0
+            window_end = key * MINUTES_PER_DAY + day_end
+            free = -(-max(key * MINUTES_PER_DAY + day_start, earliest, busy_until) // 5) * 5
+            # busy is sorted by start, so each entry is looked at once
+            while i < len(busy) and busy[i][0] < window_end:
+                begin, length, text = busy[i]
+                if begin - free >= minutes:
+                    break
+                busy_until = max(busy_until, occupied_until(begin, length))
+                free = max(free, -(-busy_until // 5) * 5)
+                i += 1
+            if min(window_end, busy[i][0] if i < len(busy) else window_end) - free >= minutes:
+                return date.fromordinal(key), free - key * MINUTES_PER_DAY
+        return None
+
+    def next_occurrence(self, rule_id, after):
+        rule = self.storage.recurring.get(rule_id)
+        if rule is None:
+            return None
+        for day in expand(rule, parse_date(after), date.max):
+            return day
+        return date.fromisoformat(rule['start'])
+
+    # Search
+
+    @property
+    def search_ready(self):
+        return self._index_backlog is None
+
+    def build_search_index(self):
+        self._index_backlog = set()
+        self.install_search_index(self.index_appointments())
+
+    def index_appointments(self):
+        # Safe to run on a worker thread while edits go on; the days they
+        # touch are re-read by install_search_index()
+        index = SearchIndex()
+        if self.storage.searches_text:
+            return index
+        for date_str, appts in self.storage.iter_days(archived=False):
+            for appt in appts:
+                index.add('appt', date_str, appt)
+        return index
+
+    def install_search_index(self, index):
+        # Called from the thread that makes the edits
+        backlog = self._index_backlog
+        if backlog and not self.storage.searches_text:
+            index.discard('appt', backlog)
+            for date_str in backlog:
+                for appt in self.storage.appointments_on(date_str):
+                    index.add('appt', date_str, appt)
+        for rule in self.storage.recurring.values():
+            index.add('rule', rule['id'], rule['text'])
+        for list_name in ('today', 'later'):
+            for task in self.task_list(list_name):
+                index.add(list_name, None, task)
+        self.search_index = index
+        self._index_backlog = None
+        self._archive_indexed = False
+
+    def search(self, query, limit=100):
+        if not self._archive_indexed and self.search_ready:
+            self._index_archive()
+        results = self.search_index.search(query, limit)
+        terms = sorted(set(tokenize(query))) if self.storage.searches_text else None
+        if terms:
+            # Appointments come from the backend's own text index
+            found, more = self.storage.search_appointments(terms, limit)
+            results = merge(results, ([('appt', date_str, text) for date_str, text in found], more),
+                            limit)
+        return results
+
+    def _index_archive(self):
+        # Days of archived years already in the index (edited or read
+        # since) are dropped first so none is counted twice
+        days = list(self.storage.iter_archived())
+        index = self.search_index
+        if days:
+            index.discard('appt', {date_str for date_str, appts in days})
+        for date_str, appts in days:
+            for appt in appts:
+                index.add('appt', date_str, appt)
+        self._archive_indexed = True
+
+    def _reindex(self, days, lists, rules):
+        # After a reload: re-read whatever changed; days=None means all
+        if self.storage.searches_text:
+            # The backend's own text index is current already
+            days = set()
+        if self._index_backlog is not None:
+            # Still being built; install_search_index() re-reads these
+            if days is None:
+                days = (date_str for date_str, appts in self.storage.iter_days(archived=False))
+            self._index_backlog.update(days)
+            return
+        if days is None:
+            self.build_search_index()
+            return
+        index = self.search_index
+        if days:
+            index.discard('appt', days)
+            for date_str in days:
+                for appt in self.storage.appointments_on(date_str):
+                    index.add('appt', date_str, appt)
+        for list_name in lists:
+            index.discard(list_name)
+            for task in self.task_list(list_name):
+                index.add(list_name, None, task)
+        if rules:
+            index.discard('rule')
+            for rule in self.storage.recurring.values():
+                index.add('rule', rule['id'], rule['text'])
+
+    def _update_search_index(self, record, removed_rule):
+        op = record['op']
+        index = self.search_index
+        if op.endswith('_appointment') and self.storage.searches_text:
+            return
+        if op == 'add_appointment':
+            index.add('appt', record['date'], record['text'])
+        elif op == 'remove_appointment':
+            index.remove('appt', record['date'], record['text'])
+        elif op == 'add_task':
+            index.add(record['list'], None, record['text'])
+        elif op == 'remove_task':
+            index.remove(record['list'], None, record['text'])
+        elif op == 'move_task':
+            index.remove('later', None, record['text'])
+            index.add('today', None, record['text'])
+        elif op == 'add_rule':
+            index.add('rule', record['rule']['id'], record['rule']['text'])
+        elif op == 'remove_rule' and removed_rule is not None:
+            index.remove('rule', removed_rule['id'], removed_rule['text'])
+
+    # Edits
+
+    def apply(self, record):
+        removed_rule = None
+        if record['op'] == 'remove_rule':
+            removed_rule = self.storage.recurring.get(record['id'])
+        # Worked out inside every batch, so a failed one can be rolled back,
+        # and outside one when undo is on
+        collect = (self.undo_depth or self._batch_depth) and not self._undoing
+        undo = self._reverse(record) if collect else None
+        changed = self.storage.apply(record)
+        if changed and undo:
+            if self._batch_depth:
+                self._undo_group.append(undo)
+            else:
+                self._push_undo([undo])
+        if changed:
+            if self._index_backlog is None:
+                self._update_search_index(record, removed_rule)
+            elif record['op'].endswith('_appointment'):
+                self._index_backlog.add(record['date'])
+        if record['op'] in RULE_OPS:
+            self.occurrences.invalidate()
+        self.dirty = True
+        if self.saver is not None and not self._batch_depth:
+            self.saver.mark_dirty()
+        return changed
+
+    def sync(self):
+        """Merge in edits another instance (or the command-line tool) saved.
+
+        Cheap when nothing changed. Returns None in that case, otherwise
+        (days, lists, rules): the date strings whose appointments changed
+        (None if unknown), the task lists that changed and whether any
+        repeating appointment did.
+        """
+        merged = self.storage.merge_changes()
+        if merged is None:
+            changes = self.storage.reload()
+            if changes is None:
+                return None
+            self.occurrences = OccurrenceCache(self.storage.recurring)
+            self._reindex(*changes)
+            return changes
+        if not merged:
+            return None
+
+        days, lists, rules = set(), set(), False
+        for record, changed in merged:
+            op = record['op']
+            if op.endswith('_appointment'):
+                days.add(record['date'])
+            elif op == 'move_task':
+                lists.update(('today', 'later'))
+            elif op in RULE_OPS:
+                rules = True
+            else:
+                lists.add(record['list'])
+            if not changed:
+                continue
+            if self._index_backlog is None:
+                if op == 'remove_rule':
+                    # The rule is gone already, so its text is not at hand
+                    self.search_index.discard('rule', (record['id'],))
+                else:
+                    self._update_search_index(record, None)
+            elif op.endswith('_appointment'):
+                self._index_backlog.add(record['date'])
+        if rules:
+            self.occurrences.invalidate()
+        return days, lists, rules
+
+    @contextmanager
+    def batch(self):
+        # Edits inside the block are saved together: the backend is held so
+        # the save worker cannot write part of them, and they are handed to
+        # it once, at the end. They are undone together too. If the block
+        # raises, what it did so far is put back, with or without undo
+        if not self._batch_depth:
+            self._undo_group = []
+            self.storage.hold()
+        self._batch_depth += 1
+        failed = False
+        try:
+            yield self
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                group, self._undo_group = self._undo_group, None
+                try:
+                    if failed:
+                        self._rollback(group)
+                    elif self.undo_depth:
+                        self._push_undo(group)
+                finally:
+                    self.storage.release()
+                if self.saver is not None and self.dirty:
+                    self.saver.mark_dirty()
+
+    # Undo
+
+    def _reverse(self, record):
+        # The records that put back what `record` is about to change,
+        # worked out before it is applied
+        op = record['op']
+        if op == 'add_appointment':
+            # Where Day.add() will put it
+            index = self.storage.insert_position(record['date'], record.get('time'))
+            return [{'op': 'remove_appointment', 'date': record['date'], 'index': index,
+                     'text': record['text']}]
+        if op == 'remove_appointment':
+            entries = self.storage.entries_on(record['date'])
+            index = _locate([appt.text for appt in entries], record.get('index', -1), record['text'])
+            if index is None:
+                return None
+            undo = {'op': 'add_appointment', 'date': record['date'], 'text': record['text']}
+            if entries[index].time is not None:
+                undo['time'] = entries[index].time
+            if entries[index].duration is not None:
+                undo['duration'] = entries[index].duration
+            return [undo]
+        if op == 'add_task':
+            index = record.get('index', len(self.task_list(record['list'])))
+            return [{'op': 'remove_task', 'list': record['list'], 'index': index, 'text': record['text']}]
+        if op in ('remove_task', 'move_task', 'set_done'):
+            list_name = record.get('list', 'later')
+            index = _locate(self.task_list(list_name), record.get('index', -1), record['text'])
+            if index is None:
+                return None
+            if op == 'set_done':
+                return [dict(record, index=index, done=not record['done'])]
+            undo = {'op': 'add_task', 'list': list_name, 'text': record['text'], 'index': index}
+            if self.storage.is_done(list_name, index):
+                undo['done'] = True
+            if op == 'remove_task':
+                return [undo]
+            return [{'op': 'remove_task', 'list': 'today', 'index': len(self.todo_today),
+                     'text': record['text']}, undo]
+        if op == 'add_rule':
+            return [{'op': 'remove_rule', 'id': record['rule']['id']}]
+        if op == 'remove_rule':
+            rule = self.storage.recurring.get(record['id'])
+            return [{'op': 'add_rule', 'rule': rule}] if rule is not None else None
+        if op in ('add_exception', 'remove_exception'):
+            return [dict(record, op='remove_exception' if op == 'add_exception' else 'add_exception')]
+        return None
+
+    def _rollback(self, group):
+        self._undoing = True
+        self._batch_depth += 1
+        try:
+            for records in reversed(group):
+                for record in records:
+                    self.apply(record)
+        finally:
+            self._batch_depth -= 1
+            self._undoing = False
+
+    def _push_undo(self, group):
+        if group:
+            self.undo_stack.append(group)
+            del self.undo_stack[:-self.undo_depth]
+
+    def undo(self):
+        """Reverse the last edit or batch as one batch; False if there is none."""
+        if not self.undo_stack:
+            return False
+        group = self.undo_stack.pop()
+        self._undoing = True
+        try:
+            with self.batch():
+                for records in reversed(group):
+                    for record in records:
+                        self.apply(record)
+        finally:
+            self._undoing = False
+        return True
+
+    def add_appointment(self, day, text, time=None, duration=None):
+        record = {'op': 'add_appointment', 'date': parse_date(day).isoformat(), 'text': text}
+        if time is not None:
+            record['time'] = time
+        if duration is not None:
+            record['duration'] = duration
+        self.apply(record)
+
+    def remove_appointment(self, day, index, text=None):
+        date_str = parse_date(day).isoformat()
+        if text is None:
+            appts = self.storage.appointments_on(date_str)
+            if not 0 <= index < len(appts):
+                return False
+            text = appts[index]
+        self.apply({'op': 'remove_appointment', 'date': date_str, 'index': index, 'text': text})
+        return True
+
+    def add_task(self, list_name, text, done=False):
+        self.task_list(list_name)
+        record = {'op': 'add_task', 'list': list_name, 'text': text}
+        if done:
+            record['done'] = True
+        self.apply(record)
+
+    def remove_task(self, list_name, index):
+        task_list = self.task_list(list_name)
+        if not 0 <= index < len(task_list):
+            return False
+        self.apply({'op': 'remove_task', 'list': list_name, 'index': index, 'text': task_list[index]})
+        return True
+
+    def set_done(self, list_name, index, done=True):
+        task_list = self.task_list(list_name)
+        if not 0 <= index < len(task_list):
+            return False
+        return self.apply({'op': 'set_done', 'list': list_name, 'index': index,
+                           'text': task_list[index], 'done': done})
+
+    def move_to_today(self, index):
+        if not 0 <= index < len(self.todo_later):
+            return False
+        self.apply({'op': 'move_task', 'index': index, 'text': self.todo_later[index]})
+        return True
+
+    # Batch edits: each is one batch, so one save and one undo step, and
+    # returns how many entries it changed
+
+    def remove_tasks(self, list_name, indexes):
+        with self.batch():
+            # Last first, so the indexes still to go keep their places
+            return sum(self.remove_task(list_name, index) for index in sorted(set(indexes), reverse=True))
+
+    def mark_done(self, list_name, indexes, done=True):
+        with self.batch():
+            return sum(bool(self.set_done(list_name, index, done)) for index in sorted(set(indexes)))
+
+    def move_tasks_to_today(self, indexes):
+        # In list order; each move shifts the ones after it up by one
+        moved = 0
+        with self.batch():
+            for index in sorted(set(indexes)):
+                moved += self.move_to_today(index - moved)
+        return moved
+
+    def move_all_to_today(self):
+        return self.move_tasks_to_today(range(len(self.todo_later)))
+
+    def clear_completed(self, list_name='today'):
+        return self.remove_tasks(list_name, [index for index, done in
+                                             enumerate(self.task_done(list_name)) if done])
+
+    def remove_day_entries(self, day, entries, series=False):
+        # Removes entries as day_entries() lists them: stored appointments,
+        # and either the occurrence of each repeating one or, with
+        # series=True, its whole series
+        removed = 0
+        stored = sorted((entry for entry in entries if entry[1] is None), key=lambda entry: -entry[2])
+        rules = list(dict.fromkeys(rule_id for appt, rule_id, index in entries if rule_id is not None))
+        with self.batch():
+            for appt, rule_id, index in stored:
+                removed += self.remove_appointment(day, index, appt.text)
+            for rule_id in rules:
+                removed += (self.remove_recurring(rule_id) if series else
+                            self.skip_occurrence(rule_id, day))
+        return removed
+
+    def add_recurring(self, start, text, freq, interval=1, until=None, count=None):
+        import uuid
+        rule = make_rule(uuid.uuid4().hex, parse_date(start), text, freq, interval,
+                         parse_date(until) if until else None, count)
+        self.apply({'op': 'add_rule', 'rule': rule})
+        return rule['id']
+
+    def remove_recurring(self, rule_id):
+        if rule_id not in self.storage.recurring:
+            return False
+        self.apply({'op': 'remove_rule', 'id': rule_id})
+        return True
+
+    def skip_occurrence(self, rule_id, day):
+        if rule_id not in self.storage.recurring:
+            return False
+        self.apply({'op': 'add_exception', 'id': rule_id, 'date': parse_date(day).isoformat()})
+        return True
+
+    # Persistence
+
+    def flush(self):
+        if self.saver is not None:
+            self.saver.flush()
+        else:
+            self.storage.flush()
+        self.dirty = False
+
+    def close(self, save=True):
+        # save=False drops whatever was not saved yet
+        if self.saver is not None:
+            self.saver.close(save)
+            self.saver = None
+        self.storage.close(save)
+        self.dirty = False
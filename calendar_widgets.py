@@ -0,0 +1,349 @@
+"""
+Tk helpers for the Personal Calendar & Task Manager
+"""
+
+import calendar
+import tkinter as tk
+import tkinter.font as tkfont
+from datetime import date, timedelta
+
+# Modifier bits in a Tk event's state
+SHIFT = 0x0001
+CONTROL = 0x0004
+
+
+class ListView:
+    """Keeps a Listbox in step with a list of rows, one changed row at a time.
+
+    insert() and delete() touch a single Listbox row; set_rows() works out
+    the changed middle section from the common prefix and suffix. Past
+    `virtual_threshold` rows the view goes virtual: only the rows in sight
+    are materialized and the scrollbar is driven by hand, so editing and
+    scrolling cost the same however long the list gets. All indexes taken
+    and returned are positions in the full list.
+
+    In virtual mode the selection is kept here, since most selected rows
+    may be off screen. A plain click or key selects just what Tk selects;
+    Ctrl keeps the rest of the selection and Shift-click selects the range
+    from the last row clicked, wherever that has scrolled to.
+    """
+
+    def __init__(self, listbox, scrollbar, virtual_threshold=1000):
+        self.listbox = listbox
+        self.scrollbar = scrollbar
+        self.virtual_threshold = virtual_threshold
+        self.rows = []
+        self.virtual = False
+        self.top = 0
+        self.selected = set()
+        self.anchor = None
+        self.linespace = None
+        # What started the selection change, noted before Tk's class bindings run
+        self._modifiers = 0
+        self._clicked = None
+
+        listbox.bind('<ButtonPress-1>', self._on_press, add='+')
+        listbox.bind('<KeyPress>', self._on_key, add='+')
+        listbox.bind('<<ListboxSelect>>', self._on_select, add='+')
+        listbox.bind('<MouseWheel>', self._on_wheel)
+        listbox.bind('<Button-4>', self._on_wheel)
+        listbox.bind('<Button-5>', self._on_wheel)
+        listbox.bind('<Configure>', self._on_configure)
+
+    # Row changes
+
+    def set_rows(self, rows):
+        rows = list(rows)
+        old = self.rows
+        self.rows = rows
+        if self._update_mode():
+            return
+        if self.virtual:
+            self.selected = {i for i in self.selected if i < len(rows)}
+            self._render()
+            return
+
+        # Replace only the section between the common prefix and suffix
+        start = 0
+        limit = min(len(old), len(rows))
+        while start < limit and old[start] == rows[start]:
+            start += 1
+        end_old, end_new = len(old), len(rows)
+        while end_old > start and end_new > start and old[end_old - 1] == rows[end_new - 1]:
+            end_old -= 1
+            end_new -= 1
+        if end_old > start:
+            self.listbox.delete(start, end_old - 1)
+        if end_new > start:
+            self.listbox.insert(start, *rows[start:end_new])
+
+    def insert(self, index, row):
+        if index == tk.END:
+            index = len(self.rows)
+        self.rows.insert(index, row)
+        self.selected = {i + 1 if i >= index else i for i in self.selected}
+        if self._update_mode():
+            return
+        if not self.virtual:
+            self.listbox.insert(index, row)
+        elif index < self.top + self._page_size():
+            self._render()
+        else:
+            self._update_scrollbar()
+
+    def append(self, row):
+        self.insert(tk.END, row)
+
+    def delete(self, index):
+        del self.rows[index]
+        self.selected = {i - 1 if i > index else i for i in self.selected if i != index}
+        if self._update_mode():
+            return
+        if not self.virtual:
+            self.listbox.delete(index)
+        elif index < self.top + self._page_size():
+            self._render()
+        else:
+            self._update_scrollbar()
+
+    # Selection
+
+    def curselection(self):
+        if not self.virtual:
+            return self.listbox.curselection()
+        return tuple(sorted(self.selected))
+
+    def select(self, index):
+        self.selected = {index}
+        self.anchor = index
+        if not self.virtual:
+            self.listbox.selection_clear(0, tk.END)
+            self.listbox.selection_set(index)
+            self.listbox.see(index)
+            return
+        page = self._page_size()
+        if not self.top <= index < self.top + page:
+            self.top = max(0, index - page // 2)
+        self._render()
+
+    def _on_press(self, event):
+        self._modifiers = event.state & (SHIFT | CONTROL)
+        self._clicked = self.top + self.listbox.nearest(event.y) if self.virtual else None
+
+    def _on_key(self, event):
+        self._modifiers = event.state & (SHIFT | CONTROL)
+        self._clicked = None
+
+    def _on_select(self, event=None):
+        modifiers, clicked = self._modifiers, self._clicked
+        self._modifiers, self._clicked = 0, None
+        if not self.virtual:
+            return
+        if modifiers & SHIFT and clicked is not None and self.anchor is not None:
+            # Tk only knows the rows on screen, so the range is set from here
+            last = len(self.rows) - 1
+            lo, hi = sorted((min(self.anchor, last), min(clicked, last)))
+            self.selected = set(range(lo, hi + 1))
+            self._show_selection()
+            return
+        if modifiers:
+            visible = range(self.top, self.top + self._page_size())
+            self.selected = {i for i in self.selected if i not in visible}
+        else:
+            self.selected = set()
+        self.selected.update(self.top + i for i in self.listbox.curselection())
+        if clicked is not None:
+            self.anchor = clicked
+
+    # Virtual mode
+
+    def _update_mode(self):
+        # Switch modes when the list crosses the threshold; True if re-rendered
+        virtual = len(self.rows) > self.virtual_threshold
+        if virtual == self.virtual:
+            return False
+        self.virtual = virtual
+        self.top = 0
+        if virtual:
+            self.selected = {i for i in self.listbox.curselection()}
+            self.listbox.config(yscrollcommand='')
+            self.scrollbar.config(command=self._on_scroll)
+            self._render()
+        else:
+            self.listbox.config(yscrollcommand=self.scrollbar.set)
+            self.scrollbar.config(command=self.listbox.yview)
+            self.listbox.delete(0, tk.END)
+            self.listbox.insert(0, *self.rows)
+            for i in self.selected:
+                self.listbox.selection_set(i)
+        return True
+
+    def _page_size(self):
+        if self.linespace is None:
+            self.linespace = max(1, tkfont.Font(font=self.listbox.cget('font')).metrics('linespace'))
+        return max(int(self.listbox.cget('height')), self.listbox.winfo_height() // self.linespace + 1)
+
+    def _render(self):
+        page = self._page_size()
+        self.top = max(0, min(self.top, len(self.rows) - page))
+        self.listbox.delete(0, tk.END)
+        self.listbox.insert(0, *self.rows[self.top:self.top + page])
+        self._show_selection()
+        self._update_scrollbar()
+
+    def _show_selection(self):
+        page = self._page_size()
+        self.listbox.selection_clear(0, tk.END)
+        for i in self.selected:
+            if self.top <= i < self.top + page:
+                self.listbox.selection_set(i - self.top)
+
+    def _update_scrollbar(self):
+        total = max(1, len(self.rows))
+        self.scrollbar.set(self.top / total, min(1.0, (self.top + self._page_size()) / total))
+
+    def _scroll_to(self, top):
+        top = max(0, min(top, len(self.rows) - self._page_size()))
+        if top != self.top:
+            self.top = top
+            self._render()
+
+    def _on_scroll(self, action, amount, unit=None):
+        if action == 'moveto':
+            self._scroll_to(int(float(amount) * len(self.rows)))
+        elif action == 'scroll':
+            step = self._page_size() if unit == 'pages' else 1
+            self._scroll_to(self.top + int(amount) * step)
+
+    def _on_wheel(self, event):
+        if not self.virtual:
+            return None
+        if getattr(event, 'num', None) == 4 or getattr(event, 'delta', 0) > 0:
+            self._scroll_to(self.top - 3)
+        else:
+            self._scroll_to(self.top + 3)
+        return "break"
+
+    def _on_configure(self, event=None):
+        if self.virtual:
+            self._render()
+
+
+class HeatMap:
+    """Whole years on one Canvas, a small square per day shaded by how many
+    appointments it has.
+
+    Each year is a strip of week columns with Monday at the top. layout()
+    creates the squares once for the years shown; set_counts() then shades
+    a year from month counts in one pass, reconfiguring only the squares
+    whose shade changed. Clicks and hovers are resolved from the pointer
+    position, so there are no bindings per square.
+    """
+
+    CELL = 11
+    STEP = 13
+    LEFT = 30
+    HEADER = 32
+    COLORS = ('#ebedf0', '#c6e48b', '#7bc96f', '#239a3b', '#196127')
+
+    def __init__(self, canvas, on_click=None, on_hover=None):
+        self.canvas = canvas
+        self.on_click = on_click
+        self.on_hover = on_hover
+        self.years = []
+        self.items = {}
+        self.levels = {}
+        self.counts = {}
+        self.outlined = []
+        self.outlined_month = None
+        canvas.bind('<Button-1>', self._on_click)
+        canvas.bind('<Motion>', self._on_motion)
+
+    def block_height(self):
+        return self.HEADER + 7 * self.STEP + 8
+
+    def grid_start(self, year):
+        # The Monday on or before January 1st
+        first = date(year, 1, 1)
+        return first - timedelta(days=first.weekday())
+
+    def layout(self, years):
+        self.canvas.delete('all')
+        self.years = list(years)
+        self.items = {}
+        self.levels = {}
+        self.counts = {}
+        self.outlined = []
+        self.outlined_month = None
+        for block, year in enumerate(self.years):
+            top = block * self.block_height()
+            self.canvas.create_text(0, top + 2, text=str(year), anchor=tk.NW, font=('Arial', 11, 'bold'))
+            for row, name in ((0, "Mon"), (2, "Wed"), (4, "Fri")):
+                self.canvas.create_text(0, top + self.HEADER + row * self.STEP, text=name,
+                                        anchor=tk.NW, font=('Arial', 7))
+            start = self.grid_start(year)
+            for month in range(1, 13):
+                col = (date(year, month, 1) - start).days // 7
+                self.canvas.create_text(self.LEFT + col * self.STEP, top + 18, text=calendar.month_abbr[month],
+                                        anchor=tk.NW, font=('Arial', 7))
+            day = date(year, 1, 1)
+            while day.year == year:
+                offset = (day - start).days
+                x = self.LEFT + offset // 7 * self.STEP
+                y = top + self.HEADER + offset % 7 * self.STEP
+                self.items[day] = self.canvas.create_rectangle(
+                    x, y, x + self.CELL, y + self.CELL, fill=self.COLORS[0], outline='')
+                self.levels[day] = 0
+                day += timedelta(days=1)
+        width = self.LEFT + 54 * self.STEP
+        self.canvas.config(width=width, height=len(self.years) * self.block_height(),
+                           scrollregion=(0, 0, width, len(self.years) * self.block_height()))
+
+    def set_counts(self, counts_by_year):
+        # {year: [counts for January, ...]} as CalendarStore.year_counts()
+        # returns. Shades are relative to the busiest day shown
+        peak = max((max(counts) for months in counts_by_year.values() for counts in months), default=0)
+        step = max(1, peak / 4)
+        items, levels = self.items, self.levels
+        for year, months in counts_by_year.items():
+            for month, counts in enumerate(months, 1):
+                for day_num in range(1, calendar.monthrange(year, month)[1] + 1):
+                    count = counts[day_num]
+                    day = date(year, month, day_num)
+                    self.counts[day] = count
+                    level = min(4, 1 + int((count - 1) / step)) if count else 0
+                    if levels.get(day, level) != level:
+                        self.canvas.itemconfig(items[day], fill=self.COLORS[level])
+                        levels[day] = level
+
+    def outline_month(self, year, month):
+        # Marks the month the month view is showing
+        if self.outlined_month == (year, month):
+            return
+        self.outlined_month = (year, month)
+        for item in self.outlined:
+            self.canvas.itemconfig(item, outline='')
+        self.outlined = [self.items[date(year, month, day)]
+                         for day in range(1, calendar.monthrange(year, month)[1] + 1)
+                         if date(year, month, day) in self.items]
+        for item in self.outlined:
+            self.canvas.itemconfig(item, outline='black')
+
+    def day_at(self, x, y):
+        x, y = self.canvas.canvasx(x), self.canvas.canvasy(y)
+        block, y = divmod(int(y), self.block_height())
+        col, row = (int(x) - self.LEFT) // self.STEP, (y - self.HEADER) // self.STEP
+        if not (0 <= block < len(self.years) and x >= self.LEFT and 0 <= row < 7):
+            return None
+        day = self.grid_start(self.years[block]) + timedelta(days=col * 7 + row)
+        return day if day in self.items else None
+
+    def _on_click(self, event):
+        day = self.day_at(event.x, event.y)
+        if day is not None and self.on_click is not None:
+            self.on_click(day)
+
+    def _on_motion(self, event):
+        if self.on_hover is not None:
+            day = self.day_at(event.x, event.y)
+            self.on_hover(day, self.counts.get(day, 0) if day is not None else 0)
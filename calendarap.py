@@ -5,18 +5,86 @@ A simple desktop application for managing appointments and tasks
 with safer GUI initialization
 """
 
+import time
+# Taken before the other imports so --startup-profile can time them too
+STARTED = time.perf_counter()
+
 import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog
+from tkinter import ttk, messagebox, simpledialog, filedialog
 import calendar
 from datetime import datetime, timedelta
-import json
+import argparse
 import os
+import queue
 import sys
+import threading
+
+from calendar_model import Appointment
+from calendar_recurrence import FREQUENCIES
+from calendar_store import DEFAULT_DATA_FILE, CalendarStore, parse_date, parse_time_range, shift_month
+from calendar_widgets import HeatMap, ListView
+
+class StartupProfile:
+    """Phase timings printed by --startup-profile; a no-op when disabled."""
+    
+    def __init__(self, enabled=False, start=None):
+        self.enabled = enabled
+        self.start = time.perf_counter() if start is None else start
+        self.last = self.start
+        self.phases = []
+    
+    def mark(self, phase):
+        # Records the time since the previous mark
+        if self.enabled:
+            now = time.perf_counter()
+            self.phases.append((phase, now - self.last, now - self.start))
+            self.last = now
+    
+    def note(self, phase, seconds):
+        # Records a phase timed elsewhere, e.g. on the loader thread
+        if self.enabled:
+            self.phases.append((phase, seconds, time.perf_counter() - self.start))
+    
+    def report(self):
+        if not self.enabled:
+            return
+        print("Startup profile:            took (ms)   done at (ms)", file=sys.stderr)
+        for phase, seconds, total in self.phases:
+            print(f"  {phase:<28}{seconds * 1000:9.1f}   {total * 1000:12.1f}", file=sys.stderr)
+        total = time.perf_counter() - self.start
+        print(f"  {'ready':<28}{'':9}   {total * 1000:12.1f}", file=sys.stderr)
 
 class CalendarApp:
-    def __init__(self, root):
+    # Entry points timed when a Profiler is passed in
+    PROFILED_HANDLERS = (
+        'setup_ui', 'select_cell', 'select_date', 'update_calendar', 'render_cells',
+        'update_appointments_display', 'add_appointment', 'remove_appointment',
+        'add_recurring_appointment', 'find_free_slot', 'run_search', 'open_search_result',
+        'update_task_lists', 'add_task', 'remove_task', 'mark_done', 'move_to_today',
+        'move_all_to_today', 'clear_completed', 'undo',
+        'prev_month', 'next_month', 'go_to_today', 'open_year_view', 'layout_year_view',
+        'update_year_view', 'year_view_clicked', 'toggle_fullscreen', 'exit_fullscreen',
+        'import_data', 'export_data', 'save_data', 'load_data', 'data_loaded',
+        'search_indexed', 'external_changes', 'poll_api', 'shutdown', 'on_close')
+    
+    def __init__(self, root, backend='json', data_file=DEFAULT_DATA_FILE,
+                 background_load=True, profile=None, profiler=None, archive_after=365,
+                 api_port=None, api_socket=None):
         self.root = root
         self.fullscreen = False
+        self.profile = profile or StartupProfile()
+        
+        # Handler profiling (--profile or CALENDAR_PROFILE); without a
+        # profiler nothing is wrapped. Handlers are wrapped before any
+        # binding or button captures them
+        self.profiler = profiler
+        if profiler is not None:
+            profiler.instrument(self, self.PROFILED_HANDLERS, 'app')
+            profiler.patch(simpledialog, ('askstring',), 'dialog')
+            profiler.patch(messagebox, ('showwarning', 'showinfo', 'showerror',
+                                        'askyesno', 'askyesnocancel'), 'dialog')
+            profiler.patch(filedialog, ('askopenfilename', 'asksaveasfilename'), 'dialog')
+            profiler.count_widgets(tk)
         
         # Set window properties BEFORE any other operations
         try:
@@ -33,26 +101,40 @@ class CalendarApp:
         self.root.bind('<F11>', self.toggle_fullscreen)
         self.root.bind('<Escape>', self.exit_fullscreen)
         
-        # Data storage
-        self.data_file = os.path.expanduser("~/calendar_data.json")
-        self.appointments = {}
-        self.todo_today = []
-        self.todo_later = []
+        # Ctrl+Z takes back the last edit, a whole batch at a time
+        self.root.bind('<Control-z>', self.undo)
+        self.root.protocol('WM_DELETE_WINDOW', self.on_close)
         
-        # Load existing data
-        print("Loading data...")
-        self.load_data()
-        print("Data loaded successfully")
+        # Data storage; edits are written by a worker thread shortly after
+        # they stop arriving
+        self.data_file = data_file
+        self.store = CalendarStore(data_file, backend=backend, archive_after=archive_after,
+                                   undo_depth=50)
+        self.day_appointments = []
+        if profiler is not None:
+            profiler.instrument(self.store.storage, ('flush',), 'storage')
+        
+        # The data is read on a loader thread; until it arrives the window
+        # shows an empty calendar and edits are refused
+        self.loading = True
+        self.loader_done = False
+        self.loader_queue = queue.Queue()
+        
+        self.closed = False
+        self.api_server = None
+        self.api_queue = queue.Queue()
         
         # Current date
-        self.current_date = datetime.now()
+        self.current_date = datetime.now().date().replace(day=1)
         self.selected_date = None
         
+        # Year overview window, created when first opened
+        self.year_window = None
+        self.heat_map = None
+        
         # Setup UI with error handling
-        print("Setting up UI...")
         try:
             self.setup_ui()
-            print("UI setup complete")
         except Exception as e:
             print(f"Error during UI setup: {e}")
             import traceback
@@ -60,14 +142,34 @@ class CalendarApp:
             sys.exit(1)
             
         # Update calendar
-        print("Updating calendar...")
         try:
             self.update_calendar()
-            print("Calendar updated")
         except Exception as e:
             print(f"Error updating calendar: {e}")
             import traceback
             traceback.print_exc()
+        self.profile.mark("window skeleton")
+        self.root.after_idle(self.profile.note, "first frame painted", 0)
+        
+        if background_load:
+            threading.Thread(target=self.load_data, name="calendar-loader", daemon=True).start()
+        else:
+            self.load_data()
+        self.poll_loader()
+        
+        self.poll_save_status()
+        self.poll_external_changes()
+        
+        # Local HTTP API (--api-port / --api-socket). Requests are served on
+        # their own thread, but each one is queued to run here, on the Tk
+        # thread, where the store is edited and the window redrawn
+        if api_port is not None or api_socket is not None:
+            from calendar_server import CalendarServer
+            self.api_server = CalendarServer(self.store, port=api_port or 0, path=api_socket,
+                                             submit=self.api_queue.put,
+                                             on_change=self.external_changes)
+            self.api_server.start()
+            self.poll_api()
         
     def setup_ui(self):
         # Main container with error handling
@@ -84,12 +186,21 @@ class CalendarApp:
         main_frame.columnconfigure(1, weight=1)
         main_frame.rowconfigure(0, weight=1)
         
+        # File menu for importing and exporting other calendar formats
+        menubar = tk.Menu(self.root)
+        file_menu = tk.Menu(menubar, tearoff=0)
+        file_menu.add_command(label="Import...", command=self.import_data)
+        file_menu.add_command(label="Export...", command=self.export_data)
+        menubar.add_cascade(label="File", menu=file_menu)
+        edit_menu = tk.Menu(menubar, tearoff=0)
+        edit_menu.add_command(label="Undo", accelerator="Ctrl+Z", command=self.undo)
+        menubar.add_cascade(label="Edit", menu=edit_menu)
+        self.root.config(menu=menubar)
+        
         # Left panel - Task lists
-        print("  Setting up left panel...")
         self.setup_left_panel(main_frame)
         
         # Right panel - Calendar
-        print("  Setting up right panel...")
         self.setup_right_panel(main_frame)
         
     def setup_left_panel(self, parent):
@@ -110,9 +221,11 @@ class CalendarApp:
         today_scroll = ttk.Scrollbar(today_frame)
         today_scroll.grid(row=0, column=1, sticky=(tk.N, tk.S))
         
-        self.today_listbox = tk.Listbox(today_frame, height=10, yscrollcommand=today_scroll.set)
+        self.today_listbox = tk.Listbox(today_frame, height=10, selectmode=tk.EXTENDED,
+                                        yscrollcommand=today_scroll.set)
         self.today_listbox.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
         today_scroll.config(command=self.today_listbox.yview)
+        self.today_view = ListView(self.today_listbox, today_scroll)
         
         # Today buttons
         today_btn_frame = ttk.Frame(left_frame)
@@ -121,6 +234,7 @@ class CalendarApp:
         ttk.Button(today_btn_frame, text="Add", command=lambda: self.add_task('today')).pack(side=tk.LEFT, padx=2)
         ttk.Button(today_btn_frame, text="Remove", command=lambda: self.remove_task('today')).pack(side=tk.LEFT, padx=2)
         ttk.Button(today_btn_frame, text="Done", command=lambda: self.mark_done('today')).pack(side=tk.LEFT, padx=2)
+        ttk.Button(today_btn_frame, text="Clear Done", command=self.clear_completed).pack(side=tk.LEFT, padx=2)
         
         # Things to Get Around To section
         later_label = ttk.Label(left_frame, text="Things to Get Around To", font=('Arial', 12, 'bold'))
@@ -135,9 +249,11 @@ class CalendarApp:
         later_scroll = ttk.Scrollbar(later_frame)
         later_scroll.grid(row=0, column=1, sticky=(tk.N, tk.S))
         
-        self.later_listbox = tk.Listbox(later_frame, height=10, yscrollcommand=later_scroll.set)
+        self.later_listbox = tk.Listbox(later_frame, height=10, selectmode=tk.EXTENDED,
+                                        yscrollcommand=later_scroll.set)
         self.later_listbox.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
         later_scroll.config(command=self.later_listbox.yview)
+        self.later_view = ListView(self.later_listbox, later_scroll)
         
         # Later buttons
         later_btn_frame = ttk.Frame(left_frame)
@@ -146,6 +262,30 @@ class CalendarApp:
         ttk.Button(later_btn_frame, text="Add", command=lambda: self.add_task('later')).pack(side=tk.LEFT, padx=2)
         ttk.Button(later_btn_frame, text="Remove", command=lambda: self.remove_task('later')).pack(side=tk.LEFT, padx=2)
         ttk.Button(later_btn_frame, text="Move to Today", command=self.move_to_today).pack(side=tk.LEFT, padx=2)
+        ttk.Button(later_btn_frame, text="Move All", command=self.move_all_to_today).pack(side=tk.LEFT, padx=2)
+        
+        # Search across appointments and both task lists, updated as you type
+        search_label = ttk.Label(left_frame, text="Search", font=('Arial', 12, 'bold'))
+        search_label.grid(row=6, column=0, sticky=tk.W, pady=(20, 5))
+        
+        self.search_var = tk.StringVar()
+        search_entry = ttk.Entry(left_frame, textvariable=self.search_var)
+        search_entry.grid(row=7, column=0, sticky=(tk.W, tk.E))
+        self.search_var.trace_add('write', self.schedule_search)
+        self.search_job = None
+        self.search_results = []
+        
+        results_frame = ttk.Frame(left_frame)
+        results_frame.grid(row=8, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(5, 0))
+        results_frame.columnconfigure(0, weight=1)
+        
+        results_scroll = ttk.Scrollbar(results_frame)
+        results_scroll.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        
+        self.results_listbox = tk.Listbox(results_frame, height=6, yscrollcommand=results_scroll.set)
+        self.results_listbox.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        results_scroll.config(command=self.results_listbox.yview)
+        self.results_listbox.bind('<<ListboxSelect>>', self.open_search_result)
         
         # Configure row weights
         left_frame.rowconfigure(1, weight=1)
@@ -171,6 +311,11 @@ class CalendarApp:
         
         ttk.Button(header_frame, text=">", command=self.next_month).grid(row=0, column=2, padx=5)
         ttk.Button(header_frame, text="Today", command=self.go_to_today).grid(row=0, column=3, padx=5)
+        ttk.Button(header_frame, text="Year", command=self.open_year_view).grid(row=0, column=4, padx=5)
+        
+        self.save_status_label = ttk.Label(header_frame, text="", width=16, anchor=tk.E)
+        self.save_status_label.grid(row=0, column=5, padx=5)
+        self.shown_save_status = None
         
         # Calendar grid
         self.calendar_frame = ttk.Frame(right_frame)
@@ -183,6 +328,21 @@ class CalendarApp:
             label.grid(row=0, column=i, padx=2, pady=2, sticky=(tk.W, tk.E))
             self.calendar_frame.columnconfigure(i, weight=1)
         
+        # Day cells are created once and reused for every month
+        self.day_cells = []
+        self.cell_dates = [None] * 42
+        self.cell_states = [None] * 42
+        for i in range(42):
+            btn = tk.Button(self.calendar_frame, text="", width=8, height=3,
+                            command=lambda i=i: self.select_cell(i))
+            btn.grid(row=i // 7 + 1, column=i % 7, padx=2, pady=2, sticky=(tk.W, tk.E, tk.N, tk.S))
+            self.day_cells.append(btn)
+        self.cell_bg = self.day_cells[0].cget('bg')
+        self.cell_font = self.day_cells[0].cget('font')
+        for i in range(7):
+            self.calendar_frame.rowconfigure(i, weight=1)
+        self.month_counts = [0] * 32
+        
         # Appointment display
         appt_frame = ttk.Frame(right_frame)
         appt_frame.grid(row=2, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(10, 0))
@@ -202,25 +362,25 @@ class CalendarApp:
         appt_scroll = ttk.Scrollbar(appt_list_frame)
         appt_scroll.grid(row=0, column=1, sticky=(tk.N, tk.S))
         
-        self.appt_listbox = tk.Listbox(appt_list_frame, height=6, yscrollcommand=appt_scroll.set)
+        self.appt_listbox = tk.Listbox(appt_list_frame, height=6, selectmode=tk.EXTENDED,
+                                       yscrollcommand=appt_scroll.set)
         self.appt_listbox.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
         appt_scroll.config(command=self.appt_listbox.yview)
+        self.appt_view = ListView(self.appt_listbox, appt_scroll)
         
         # Appointment buttons
         appt_btn_frame = ttk.Frame(appt_frame)
         appt_btn_frame.grid(row=2, column=0, sticky=tk.W, pady=(5, 0))
         
         ttk.Button(appt_btn_frame, text="Add Appointment", command=self.add_appointment).pack(side=tk.LEFT, padx=2)
+        ttk.Button(appt_btn_frame, text="Add Repeating",
+                   command=self.add_recurring_appointment).pack(side=tk.LEFT, padx=2)
         ttk.Button(appt_btn_frame, text="Remove", command=self.remove_appointment).pack(side=tk.LEFT, padx=2)
+        ttk.Button(appt_btn_frame, text="Find Free Slot", command=self.find_free_slot).pack(side=tk.LEFT, padx=2)
         
         right_frame.rowconfigure(2, weight=0)
         
     def update_calendar(self):
-        # Clear existing calendar buttons
-        for widget in self.calendar_frame.grid_slaves():
-            if int(widget.grid_info()["row"]) > 0:
-                widget.destroy()
-        
         # Update month/year label
         month_name = self.current_date.strftime("%B %Y")
         self.month_year_label.config(text=month_name)
@@ -230,184 +390,487 @@ class CalendarApp:
         month = self.current_date.month
         cal = calendar.monthcalendar(year, month)
         
-        today = datetime.now().date()
+        # Per-day appointment counts come straight from the occupancy index
+        if self.loading:
+            self.month_counts = [0] * 32
+        else:
+            self.month_counts = self.store.month_counts(year, month)
         
-        # Create calendar buttons
-        for week_num, week in enumerate(cal, start=1):
-            for day_num, day in enumerate(week):
-                if day == 0:
-                    label = ttk.Label(self.calendar_frame, text="")
-                    label.grid(row=week_num, column=day_num, padx=2, pady=2)
-                else:
-                    date = datetime(year, month, day).date()
-                    date_str = date.strftime("%Y-%m-%d")
-                    
-                    has_appt = date_str in self.appointments and len(self.appointments[date_str]) > 0
-                    
-                    btn_text = str(day)
-                    if has_appt:
-                        btn_text += " *"
-                    
-                    btn = tk.Button(self.calendar_frame, text=btn_text, 
-                                   command=lambda d=date: self.select_date(d),
-                                   width=8, height=3)
-                    
-                    if date == today:
-                        btn.config(bg='lightblue', font=('Arial', 10, 'bold'))
-                    elif has_appt:
-                        btn.config(bg='lightyellow')
-                    
-                    if self.selected_date and date == self.selected_date:
-                        btn.config(relief=tk.SUNKEN, bg='lightgreen')
-                    
-                    btn.grid(row=week_num, column=day_num, padx=2, pady=2, sticky=(tk.W, tk.E, tk.N, tk.S))
-                    
-        for i in range(7):
-            self.calendar_frame.rowconfigure(i, weight=1)
+        days = [day for week in cal for day in week]
+        days += [0] * (42 - len(days))
+        self.cell_dates = [datetime(year, month, day).date() if day else None for day in days]
+        self.render_cells()
+        self.update_year_view()
+    
+    def render_cells(self):
+        # Reconfigure only the cells whose text or colors actually changed
+        today = datetime.now().date()
+        for i, date in enumerate(self.cell_dates):
+            if date is None:
+                state = ("", self.cell_bg, self.cell_font, tk.FLAT, tk.DISABLED)
+            else:
+                count = self.month_counts[date.day]
+                has_appt = count > 0
+                
+                btn_text = str(date.day)
+                if count == 1:
+                    btn_text += "\n1 appt"
+                elif count > 1:
+                    btn_text += f"\n{count} appts"
+                
+                bg = self.cell_bg
+                font = self.cell_font
+                relief = tk.RAISED
+                if date == today:
+                    bg = 'lightblue'
+                    font = ('Arial', 10, 'bold')
+                elif has_appt:
+                    bg = 'lightyellow'
+                
+                if self.selected_date and date == self.selected_date:
+                    relief = tk.SUNKEN
+                    bg = 'lightgreen'
+                state = (btn_text, bg, font, relief, tk.NORMAL)
+            
+            old = self.cell_states[i]
+            if state == old:
+                continue
+            changes = {}
+            for key, value, old_value in zip(('text', 'bg', 'font', 'relief', 'state'),
+                                             state, old or (None,) * 5):
+                if value != old_value:
+                    changes[key] = value
+            self.day_cells[i].config(**changes)
+            self.cell_states[i] = state
+    
+    def select_cell(self, i):
+        if self.cell_dates[i] is not None:
+            self.select_date(self.cell_dates[i])
     
     def select_date(self, date):
         self.selected_date = date
-        self.update_calendar()
+        self.render_cells()
         self.update_appointments_display()
         
     def update_appointments_display(self):
         if not self.selected_date:
             return
             
-        date_str = self.selected_date.strftime("%Y-%m-%d")
         display_date = self.selected_date.strftime("%B %d, %Y")
         self.selected_date_label.config(text=f"Appointments for {display_date}")
         
-        self.appt_listbox.delete(0, tk.END)
-        if date_str in self.appointments:
-            for appt in self.appointments[date_str]:
-                self.appt_listbox.insert(tk.END, appt)
+        # Skip the storage lookup for days the index says are empty
+        if (self.selected_date.year == self.current_date.year and
+                self.selected_date.month == self.current_date.month):
+            count = self.month_counts[self.selected_date.day]
+        else:
+            count = None
+        if self.loading or count == 0:
+            self.day_appointments = []
+        else:
+            self.day_appointments = self.store.day_entries(self.selected_date)
+        self.appt_view.set_rows(f"↻ {appt.text}" if rule_id is not None else
+                                f"{appt.time_range()}  {appt.text}" if appt.time is not None else appt.text
+                                for appt, rule_id, index in self.day_appointments)
     
     def add_appointment(self):
+        if self.loading:
+            self.root.bell()
+            return
         if not self.selected_date:
             messagebox.showwarning("No Date Selected", "Please select a date first.")
             return
             
         appt = simpledialog.askstring("New Appointment", "Enter appointment details:")
-        if appt:
-            date_str = self.selected_date.strftime("%Y-%m-%d")
-            if date_str not in self.appointments:
-                self.appointments[date_str] = []
-            self.appointments[date_str].append(appt)
-            self.save_data()
-            self.update_calendar()
-            self.update_appointments_display()
+        if not appt:
+            return
+        when = simpledialog.askstring("Time", "Start and end time, e.g. 09:30-10:15,\n"
+                                              "just a start time, or leave blank:")
+        if when is None:
+            return
+        try:
+            time, duration = parse_time_range(when)
+        except ValueError:
+            messagebox.showwarning("Invalid Time", "Please enter a time like 09:30 or 09:30-10:15.")
+            return
+        self.add_timed_appointment(self.selected_date, appt, time, duration)
+    
+    def add_timed_appointment(self, day, appt, time, duration):
+        # Warns about overlapping appointments before adding
+        if time is not None and not self.loading:
+            clashes = self.store.conflicts(day, time, duration)
+            if clashes:
+                lines = "\n".join(f"{other.time_range()}  {other.text}" if when == day else
+                                  f"{when.strftime('%b %d')} {other.time_range()}  {other.text}"
+                                  for when, other in clashes[:10])
+                if not messagebox.askyesno("Overlapping Appointments",
+                                           f"This overlaps with:\n\n{lines}\n\nAdd it anyway?"):
+                    return
+        self.record(self.store.add_appointment, day, appt, time, duration)
+        self.update_calendar()
+        self.update_appointments_display()
     
     def remove_appointment(self):
         if not self.selected_date:
             return
             
-        selection = self.appt_listbox.curselection()
+        selection = [i for i in self.appt_view.curselection() if i < len(self.day_appointments)]
         if not selection:
             messagebox.showwarning("No Selection", "Please select an appointment to remove.")
             return
-            
-        date_str = self.selected_date.strftime("%Y-%m-%d")
-        idx = selection[0]
-        
-        if date_str in self.appointments and idx < len(self.appointments[date_str]):
-            del self.appointments[date_str][idx]
-            if not self.appointments[date_str]:
-                del self.appointments[date_str]
-            self.save_data()
+        
+        entries = [self.day_appointments[i] for i in selection]
+        repeating = [appt.text for appt, rule_id, index in entries if rule_id is not None]
+        series = False
+        if repeating:
+            if len(repeating) == 1:
+                question = (f"{repeating[0]}\n\nRemove only this occurrence?\n\n"
+                            "Yes: remove this occurrence\nNo: remove the whole series")
+            else:
+                question = ("\n".join(repeating[:10]) + "\n\nRemove only these occurrences?\n\n"
+                            "Yes: remove these occurrences\nNo: remove the whole series of each")
+            answer = messagebox.askyesnocancel("Remove Repeating Appointment", question)
+            if answer is None:
+                return
+            series = not answer
+        # One batch: a single save, then one redraw
+        self.record(self.store.remove_day_entries, self.selected_date, entries, series)
+        self.update_calendar()
+        self.update_appointments_display()
+    
+    def add_recurring_appointment(self):
+        if self.loading:
+            self.root.bell()
+            return
+        if not self.selected_date:
+            messagebox.showwarning("No Date Selected", "Please select a date first.")
+            return
+        
+        appt = simpledialog.askstring("New Repeating Appointment", "Enter appointment details:")
+        if not appt:
+            return
+        freq = simpledialog.askstring("Repeat", "Repeat daily, weekly, monthly or yearly?",
+                                      initialvalue="weekly")
+        if not freq:
+            return
+        freq = freq.strip().lower()
+        if freq not in FREQUENCIES:
+            messagebox.showwarning("Invalid Repeat", "Please enter daily, weekly, monthly or yearly.")
+            return
+        ends = simpledialog.askstring("Ends", "End on a date (YYYY-MM-DD), after a number of times,\n"
+                                              "or leave blank to repeat forever:")
+        if ends is None:
+            return
+        
+        until = count = None
+        ends = ends.strip()
+        try:
+            if ends.isdigit():
+                count = int(ends)
+            elif ends:
+                until = parse_date(ends)
+        except ValueError:
+            messagebox.showwarning("Invalid End", "Please enter a date like 2025-12-31 or a number.")
+            return
+        
+        self.record(self.store.add_recurring, self.selected_date, appt, freq, 1, until, count)
+        self.update_calendar()
+        self.update_appointments_display()
+    
+    def find_free_slot(self):
+        if self.loading:
+            self.root.bell()
+            return
+        
+        minutes = simpledialog.askstring("Find Free Slot", "How many minutes do you need?",
+                                         initialvalue="60")
+        if not minutes:
+            return
+        if not minutes.strip().isdigit() or not 0 < int(minutes) <= 24 * 60:
+            messagebox.showwarning("Invalid Length", "Please enter a number of minutes, e.g. 30.")
+            return
+        minutes = int(minutes)
+        
+        today = datetime.now().date()
+        start = self.selected_date or today
+        until = simpledialog.askstring("Find Free Slot", "Search until (YYYY-MM-DD):",
+                                       initialvalue=(start + timedelta(days=30)).isoformat())
+        if not until:
+            return
+        try:
+            until = parse_date(until.strip())
+        except ValueError:
+            messagebox.showwarning("Invalid Date", "Please enter a date like 2025-12-31.")
+            return
+        
+        # From now on if the search starts today
+        slot = self.store.find_free_slot(datetime.now() if start == today else start, until, minutes)
+        if slot is None:
+            messagebox.showinfo("No Free Slot", f"No {minutes} free minutes between 09:00 and 17:00 "
+                                                f"from {start.isoformat()} to {until.isoformat()}.")
+            return
+        day, time = slot
+        self.current_date = day.replace(day=1)
+        self.update_calendar()
+        self.select_date(day)
+        label = Appointment("", time, minutes).time_range()
+        if messagebox.askyesno("Free Slot", f"{day.strftime('%A, %B %d, %Y')}, {label} is free.\n\n"
+                                            "Add an appointment there?"):
+            appt = simpledialog.askstring("New Appointment", "Enter appointment details:")
+            if appt:
+                self.add_timed_appointment(day, appt, time, minutes)
+    
+    def schedule_search(self, *args):
+        # Wait for a short pause in typing before searching
+        if self.search_job is not None:
+            self.root.after_cancel(self.search_job)
+        self.search_job = self.root.after(80, self.run_search)
+    
+    def run_search(self):
+        self.search_job = None
+        if not self.store.search_ready:
+            # search_indexed() runs the search again once the index is in
+            self.search_results = []
+            self.results_listbox.delete(0, tk.END)
+            self.results_listbox.insert(tk.END, "Indexing, results will appear shortly...")
+            return
+        results, more = self.store.search(self.search_var.get())
+        self.search_results = results
+        self.results_listbox.delete(0, tk.END)
+        for kind, where, text in results:
+            if kind == 'appt':
+                label = f"{where}  {text}"
+            elif kind == 'rule':
+                label = f"↻ {text}"
+            elif kind == 'today':
+                label = f"[Today] {text}"
+            else:
+                label = f"[Later] {text}"
+            self.results_listbox.insert(tk.END, label)
+        if more:
+            self.results_listbox.insert(tk.END, "... more results, keep typing to narrow down")
+    
+    def open_search_result(self, event=None):
+        selection = self.results_listbox.curselection()
+        if not selection or selection[0] >= len(self.search_results):
+            return
+        kind, where, text = self.search_results[selection[0]]
+        
+        if kind in ('appt', 'rule'):
+            if kind == 'appt':
+                day = parse_date(where)
+            else:
+                day = self.store.next_occurrence(where, datetime.now().date())
+                if day is None:
+                    return
+            self.current_date = day.replace(day=1)
             self.update_calendar()
-            self.update_appointments_display()
+            self.select_date(day)
+        else:
+            task_list = self.store.task_list(kind)
+            if text in task_list:
+                self.task_view(kind).select(task_list.index(text))
+    
+    def task_view(self, list_type):
+        return self.today_view if list_type == 'today' else self.later_view
     
     def update_task_lists(self):
-        self.today_listbox.delete(0, tk.END)
-        for task in self.todo_today:
-            self.today_listbox.insert(tk.END, task)
-        
-        self.later_listbox.delete(0, tk.END)
-        for task in self.todo_later:
-            self.later_listbox.insert(tk.END, task)
+        # Full refresh; only rows that differ from what is shown get touched
+        self.today_view.set_rows(self.task_rows('today'))
+        self.later_view.set_rows(self.task_rows('later'))
+    
+    def task_rows(self, list_type):
+        return [f"✓ {task}" if done else task for task, done in
+                zip(self.store.task_list(list_type), self.store.task_done(list_type))]
     
     def add_task(self, list_type):
+        if self.loading:
+            self.root.bell()
+            return
+        
         task = simpledialog.askstring("New Task", "Enter task description:")
         if task:
-            if list_type == 'today':
-                self.todo_today.append(task)
-            else:
-                self.todo_later.append(task)
-            self.save_data()
-            self.update_task_lists()
+            if self.record(self.store.add_task, list_type, task):
+                self.task_view(list_type).append(task)
     
     def remove_task(self, list_type):
-        if list_type == 'today':
-            listbox = self.today_listbox
-            task_list = self.todo_today
-        else:
-            listbox = self.later_listbox
-            task_list = self.todo_later
+        view = self.task_view(list_type)
         
-        selection = listbox.curselection()
+        selection = view.curselection()
         if not selection:
             messagebox.showwarning("No Selection", "Please select a task to remove.")
             return
         
-        idx = selection[0]
-        if idx < len(task_list):
-            del task_list[idx]
-            self.save_data()
-            self.update_task_lists()
+        if len(selection) == 1:
+            if self.record(self.store.remove_task, list_type, selection[0]):
+                view.delete(selection[0])
+        elif self.record(self.store.remove_tasks, list_type, selection):
+            view.set_rows(self.task_rows(list_type))
     
     def mark_done(self, list_type):
-        if list_type == 'today':
-            listbox = self.today_listbox
-            task_list = self.todo_today
-        else:
-            return
+        view = self.task_view(list_type)
         
-        selection = listbox.curselection()
+        selection = view.curselection()
         if not selection:
             messagebox.showwarning("No Selection", "Please select a task to mark as done.")
             return
         
-        idx = selection[0]
-        if idx < len(task_list):
-            task = task_list[idx]
-            result = messagebox.askyesno("Mark Done", f"Mark this task as done?\n\n{task}")
-            if result:
-                del task_list[idx]
-                self.save_data()
-                self.update_task_lists()
+        # Marks the selection done, or not done if all of it already is
+        done = self.store.task_done(list_type)
+        mark = not all(done[i] for i in selection if i < len(done))
+        if self.record(self.store.mark_done, list_type, selection, mark):
+            view.set_rows(self.task_rows(list_type))
+    
+    def clear_completed(self):
+        if self.record(self.store.clear_completed, 'today'):
+            self.today_view.set_rows(self.task_rows('today'))
     
     def move_to_today(self):
-        selection = self.later_listbox.curselection()
+        selection = self.later_view.curselection()
         if not selection:
             messagebox.showwarning("No Selection", "Please select a task to move to today.")
             return
         
-        idx = selection[0]
-        if idx < len(self.todo_later):
-            task = self.todo_later[idx]
-            del self.todo_later[idx]
-            self.todo_today.append(task)
-            self.save_data()
+        if len(selection) == 1:
+            idx = selection[0]
+            if idx < len(self.store.todo_later):
+                task = self.store.todo_later[idx]
+                if self.store.task_done('later')[idx]:
+                    task = f"✓ {task}"
+                if self.record(self.store.move_to_today, idx):
+                    self.later_view.delete(idx)
+                    self.today_view.append(task)
+        elif self.record(self.store.move_tasks_to_today, selection):
             self.update_task_lists()
     
-    def prev_month(self):
-        if self.current_date.month == 1:
-            self.current_date = self.current_date.replace(year=self.current_date.year - 1, month=12)
+    def move_all_to_today(self):
+        if self.record(self.store.move_all_to_today):
+            self.update_task_lists()
+    
+    def import_data(self):
+        if self.loading:
+            self.root.bell()
+            return
+        from calendar_io import import_file
+        path = filedialog.askopenfilename(
+            title="Import Calendar",
+            filetypes=[("Calendar files", "*.ics *.csv"), ("iCalendar", "*.ics"),
+                       ("CSV", "*.csv"), ("All files", "*")])
+        if not path:
+            return
+        try:
+            # Merged as one batch: a single save, then one redraw below
+            added, skipped = import_file(self.store, path)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Import Failed", f"Could not import {path}:\n\n{e}")
         else:
-            self.current_date = self.current_date.replace(month=self.current_date.month - 1)
+            messagebox.showinfo("Import Complete",
+                                f"Imported {added} new entries.\n"
+                                f"Skipped {skipped} already in the calendar.")
+        self.update_calendar()
+        self.update_appointments_display()
+        self.update_save_status()
+    
+    def export_data(self):
+        if self.loading:
+            self.root.bell()
+            return
+        from calendar_io import export_file
+        path = filedialog.asksaveasfilename(
+            title="Export Calendar", defaultextension=".ics",
+            filetypes=[("iCalendar", "*.ics"), ("CSV", "*.csv")])
+        if not path:
+            return
+        try:
+            count = export_file(self.store, path, 'csv' if path.lower().endswith('.csv') else 'ics')
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Export Failed", f"Could not export to {path}:\n\n{e}")
+            return
+        messagebox.showinfo("Export Complete", f"Exported {count} appointments to {path}")
+    
+    def prev_month(self):
+        self.current_date = shift_month(self.current_date, -1)
         self.update_calendar()
     
     def next_month(self):
-        if self.current_date.month == 12:
-            self.current_date = self.current_date.replace(year=self.current_date.year + 1, month=1)
-        else:
-            self.current_date = self.current_date.replace(month=self.current_date.month + 1)
+        self.current_date = shift_month(self.current_date, 1)
         self.update_calendar()
     
     def go_to_today(self):
-        self.current_date = datetime.now()
+        self.current_date = datetime.now().date().replace(day=1)
+        self.update_calendar()
+    
+    def open_year_view(self):
+        if self.year_window is not None:
+            self.year_window.lift()
+            return
+        
+        window = tk.Toplevel(self.root)
+        window.title("Year Overview")
+        window.protocol('WM_DELETE_WINDOW', self.close_year_view)
+        
+        header = ttk.Frame(window, padding="5")
+        header.pack(fill=tk.X)
+        ttk.Button(header, text="<", command=lambda: self.shift_year_view(-1)).pack(side=tk.LEFT, padx=5)
+        self.year_label = ttk.Label(header, text="", font=('Arial', 12, 'bold'))
+        self.year_label.pack(side=tk.LEFT, padx=5)
+        ttk.Button(header, text=">", command=lambda: self.shift_year_view(1)).pack(side=tk.LEFT, padx=5)
+        ttk.Label(header, text="Years shown:").pack(side=tk.LEFT, padx=(20, 2))
+        self.year_span_var = tk.StringVar(value="1")
+        span = ttk.Combobox(header, textvariable=self.year_span_var, values=("1", "3", "5"),
+                            width=3, state='readonly')
+        span.pack(side=tk.LEFT)
+        span.bind('<<ComboboxSelected>>', lambda event: self.layout_year_view())
+        
+        canvas = tk.Canvas(window, background='white', highlightthickness=0)
+        canvas.pack(fill=tk.BOTH, expand=True, padx=10)
+        self.year_status = ttk.Label(window, text="Click a day to show it in the calendar")
+        self.year_status.pack(fill=tk.X, padx=10, pady=5)
+        
+        self.heat_map = HeatMap(canvas, on_click=self.year_view_clicked, on_hover=self.year_view_hover)
+        self.year_window = window
+        self.year_view_last = self.current_date.year
+        self.layout_year_view()
+    
+    def layout_year_view(self):
+        # Squares are created here, once per set of years; edits only recolor them
+        span = int(self.year_span_var.get())
+        years = range(self.year_view_last - span + 1, self.year_view_last + 1)
+        self.year_label.config(text=str(years[0]) if span == 1 else f"{years[0]} - {years[-1]}")
+        self.heat_map.layout(years)
+        self.update_year_view()
+    
+    def update_year_view(self):
+        if self.heat_map is None:
+            return
+        if self.loading:
+            counts = {year: [[0] * 32] * 12 for year in self.heat_map.years}
+        else:
+            counts = {year: self.store.year_counts(year) for year in self.heat_map.years}
+        self.heat_map.set_counts(counts)
+        if self.current_date.year in self.heat_map.years:
+            self.heat_map.outline_month(self.current_date.year, self.current_date.month)
+    
+    def shift_year_view(self, delta):
+        self.year_view_last += delta * int(self.year_span_var.get())
+        self.layout_year_view()
+    
+    def year_view_clicked(self, day):
+        self.current_date = day.replace(day=1)
         self.update_calendar()
+        self.select_date(day)
+    
+    def year_view_hover(self, day, count):
+        if day is None:
+            text = "Click a day to show it in the calendar"
+        else:
+            text = f"{day.strftime('%A, %B %d, %Y')}: {count} appointment{'' if count == 1 else 's'}"
+        self.year_status.config(text=text)
+    
+    def close_year_view(self):
+        self.year_window.destroy()
+        self.year_window = None
+        self.heat_map = None
     
     def toggle_fullscreen(self, event=None):
         self.fullscreen = not self.fullscreen
@@ -420,91 +883,216 @@ class CalendarApp:
             self.root.attributes('-fullscreen', False)
         return "break"
     
+    def undo(self, event=None):
+        # Takes back the last edit or batch, then redraws everything once
+        if not self.record(self.store.undo):
+            self.root.bell()
+            return "break"
+        self.update_calendar()
+        self.update_appointments_display()
+        self.update_task_lists()
+        if self.search_var.get():
+            self.run_search()
+        return "break"
+    
+    def record(self, edit, *args):
+        # Apply an edit through the store; the save worker writes it out once
+        # the edits stop coming, so a burst of clicks costs a single write
+        # Returns False if the edit failed or did not apply
+        if self.loading:
+            self.root.bell()
+            return False
+        try:
+            result = edit(*args)
+        except Exception as e:
+            messagebox.showerror("Change Failed", f"Could not make this change:\n\n{e}")
+            # Redraw from the store so the screen does not show an edit
+            # that was dropped (or a batch that was rolled back)
+            self.update_calendar()
+            self.update_appointments_display()
+            self.update_task_lists()
+            if self.search_var.get():
+                self.run_search()
+            self.update_save_status()
+            return False
+        self.update_save_status()
+        return result is not False
+    
     def save_data(self):
+        self.store.flush()
+        self.update_save_status()
+    
+    def update_save_status(self):
+        status = 'loading' if self.loading else self.store.save_status
+        if status != self.shown_save_status:
+            text = {'saved': "All changes saved", 'unsaved': "Unsaved changes",
+                    'saving': "Saving...", 'error': "Save failed, retrying",
+                    'loading': "Loading..."}[status]
+            self.save_status_label.config(text=text)
+            self.shown_save_status = status
+    
+    def poll_save_status(self):
+        self.update_save_status()
+        self.root.after(250, self.poll_save_status)
+    
+    def poll_external_changes(self):
+        # Another window or the command-line tool may save to the same data;
+        # when nothing changed this costs a couple of stat calls
+        if not self.loading and not self.closed:
+            try:
+                changes = self.store.sync()
+            except Exception as e:
+                print(f"Error reading changes saved elsewhere: {e}")
+                changes = None
+            if changes is not None:
+                self.external_changes(*changes)
+        self.root.after(1000, self.poll_external_changes)
+    
+    def poll_api(self):
+        # Requests wait in the queue until the data has loaded
+        if not self.loading and not self.closed:
+            while True:
+                try:
+                    job = self.api_queue.get_nowait()
+                except queue.Empty:
+                    break
+                job()
+        self.root.after(50, self.poll_api)
+    
+    def external_changes(self, days, lists, rules):
+        # Redraw only what the merged edits touched
+        month = self.current_date.strftime("%Y-%m-")
+        if rules or days is None or any(day.startswith(month) for day in days):
+            self.update_calendar()
+        elif days:
+            self.update_year_view()
+        if self.selected_date and (rules or days is None or self.selected_date.isoformat() in days):
+            self.update_appointments_display()
+        if lists:
+            self.update_task_lists()
+        if self.search_var.get():
+            self.run_search()
+    
+    def shutdown(self):
+        # Flush anything the worker has not written yet; safe to call twice
+        if self.closed:
+            return
+        self.closed = True
+        if self.api_server is not None:
+            self.api_server.stop()
         try:
-            data = {
-                'appointments': self.appointments,
-                'todo_today': self.todo_today,
-                'todo_later': self.todo_later
-            }
-            
-            temp_file = self.data_file + '.tmp'
-            with open(temp_file, 'w') as f:
-                json.dump(data, f, indent=2)
-            
-            if os.path.exists(self.data_file):
-                os.replace(temp_file, self.data_file)
-            else:
-                os.rename(temp_file, self.data_file)
-                
+            self.store.close()
         except Exception as e:
             print(f"Error saving data: {e}")
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
+    
+    def on_close(self):
+        self.shutdown()
+        self.root.destroy()
     
     def load_data(self):
-        if os.path.exists(self.data_file):
+        # Runs on the loader thread: the data first, then the search index;
+        # the Tk thread picks the results up in poll_loader()
+        try:
+            start = time.perf_counter()
+            self.store.load(index=False)
+            self.loader_queue.put(('loaded', time.perf_counter() - start))
+        except Exception as e:
+            self.loader_queue.put(('failed', e))
+            return
+        try:
+            start = time.perf_counter()
+            index = self.store.index_appointments()
+            self.loader_queue.put(('indexed', time.perf_counter() - start, index))
+        except Exception as e:
+            self.loader_queue.put(('index_failed', e))
+    
+    def poll_loader(self):
+        while True:
             try:
-                file_size = os.path.getsize(self.data_file)
-                if file_size > 10 * 1024 * 1024:
-                    print(f"Warning: Data file is very large ({file_size} bytes). Creating backup and resetting.")
-                    os.rename(self.data_file, self.data_file + '.backup')
-                    self.appointments = {}
-                    self.todo_today = []
-                    self.todo_later = []
-                    return
-                
-                with open(self.data_file, 'r') as f:
-                    content = f.read()
-                    
-                if not content.strip():
-                    print("Data file is empty, starting fresh.")
-                    self.appointments = {}
-                    self.todo_today = []
-                    self.todo_later = []
-                    return
-                
-                data = json.loads(content)
-                self.appointments = data.get('appointments', {})
-                self.todo_today = data.get('todo_today', [])
-                self.todo_later = data.get('todo_later', [])
-                print(f"Successfully loaded data from {self.data_file}")
-                
-            except json.JSONDecodeError as e:
-                print(f"JSON parsing error: {e}")
-                print("Creating backup and starting with fresh data.")
-                os.rename(self.data_file, self.data_file + '.corrupted')
-                self.appointments = {}
-                self.todo_today = []
-                self.todo_later = []
-            except Exception as e:
-                print(f"Error loading data: {e}")
-                print("Starting with fresh data.")
-                self.appointments = {}
-                self.todo_today = []
-                self.todo_later = []
-        else:
-            print(f"No existing data file found at {self.data_file}. Starting fresh.")
-            self.appointments = {}
-            self.todo_today = []
-            self.todo_later = []
+                message = self.loader_queue.get_nowait()
+            except queue.Empty:
+                break
+            if message[0] == 'loaded':
+                self.data_loaded(message[1])
+            elif message[0] == 'indexed':
+                self.search_indexed(message[1], message[2])
+            elif message[0] == 'index_failed':
+                print(f"Error building search index: {message[1]}")
+                self.loader_done = True
+            else:
+                print(f"Error loading data: {message[1]}")
+                print("Exiting to avoid overwriting existing data.")
+                # Nothing was loaded, so there is nothing to save on the way out
+                self.closed = True
+                self.root.destroy()
+                sys.exit(1)
+        if not self.loader_done:
+            self.root.after(20, self.poll_loader)
+    
+    def data_loaded(self, seconds):
+        self.loading = False
+        self.profile.note("load data (loader thread)", seconds)
+        
+        # The month on screen first, then everything else
+        start = time.perf_counter()
+        self.update_calendar()
+        self.update_appointments_display()
+        self.root.update_idletasks()
+        self.profile.note("paint current month", time.perf_counter() - start)
+        start = time.perf_counter()
+        self.update_task_lists()
+        self.update_save_status()
+        self.profile.note("fill task lists", time.perf_counter() - start)
+    
+    def search_indexed(self, seconds, index):
+        start = time.perf_counter()
+        self.store.install_search_index(index)
+        self.loader_done = True
+        self.profile.note("search index (loader thread)", seconds)
+        self.profile.note("install search index", time.perf_counter() - start)
+        self.profile.report()
+        if self.search_var.get():
+            self.run_search()
 
 def main():
-    print("Starting Calendar App...")
-    print(f"Python version: {sys.version}")
+    parser = argparse.ArgumentParser(description="Personal Calendar & Task Manager")
+    parser.add_argument('--backend', choices=['json', 'sqlite'], default='json',
+                        help="storage backend (sqlite imports ~/calendar_data.json on first use)")
+    parser.add_argument('--archive-after', metavar='DAYS', type=int, default=365,
+                        help="move appointments from years that ended more than DAYS ago into "
+                             "compressed per-year files read only when needed (0: never)")
+    parser.add_argument('--startup-profile', action='store_true',
+                        help="print how long each startup phase took once the app is ready")
+    parser.add_argument('--profile', metavar='FILE', default=os.environ.get('CALENDAR_PROFILE'),
+                        help="time every UI handler and write a Chrome trace to FILE on exit "
+                             "(also enabled by the CALENDAR_PROFILE environment variable)")
+    parser.add_argument('--api-port', metavar='PORT', type=int,
+                        help="serve the local HTTP/JSON API on 127.0.0.1:PORT")
+    parser.add_argument('--api-socket', metavar='PATH',
+                        help="serve the local HTTP/JSON API on a Unix socket")
+    args = parser.parse_args()
+    
+    profile = StartupProfile(args.startup_profile, STARTED)
+    profile.mark("imports")
+    
+    profiler = None
+    if args.profile:
+        from calendar_profile import Profiler
+        profiler = Profiler(args.profile)
     
     try:
-        print("Creating Tk root...")
         root = tk.Tk()
-        print("Tk root created successfully")
+        profile.mark("Tk root")
         
-        print("Initializing CalendarApp...")
-        app = CalendarApp(root)
-        print("CalendarApp initialized successfully")
+        app = CalendarApp(root, backend=args.backend, profile=profile, profiler=profiler,
+                          archive_after=args.archive_after, api_port=args.api_port,
+                          api_socket=args.api_socket)
         
-        print("Starting mainloop...")
         root.mainloop()
-        print("Mainloop ended normally")
+        app.shutdown()
+        if profiler is not None:
+            profiler.close()
+            profiler.export()
         
     except Exception as e:
         print(f"\nFATAL ERROR: {e}")
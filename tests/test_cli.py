@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+import calendar_cli
+
+
+@pytest.fixture
+def data_file(tmp_path):
+    # An old year, so the store would like to archive it
+    path = tmp_path / 'cal.json'
+    path.write_text(json.dumps({
+        'appointments': {'2015-01-02': ['Long ago'],
+                         '2030-06-01': [{'text': 'Dentist', 'time': '09:00', 'duration': 30}]},
+        'todo_today': ['Buy milk'],
+        'todo_later': [{'text': 'Paint fence', 'done': True}],
+    }, indent=2))
+    return path
+
+
+@pytest.mark.parametrize('command', [
+    ['tasks'], ['list'], ['list', '--from', '2015-01-01', '--to', '2015-12-31'],
+    ['export', 'OUT.json'], ['export', 'OUT.ics'], ['export', 'OUT.csv']])
+def test_read_only_commands_leave_data_alone(tmp_path, data_file, command, capsys):
+    before = data_file.read_bytes()
+    command = [str(tmp_path / arg) if arg.startswith('OUT') else arg for arg in command]
+    assert calendar_cli.main(['--data-file', str(data_file)] + command) == 0
+    assert "Error" not in capsys.readouterr().err
+    assert data_file.read_bytes() == before
+    assert sorted(path.name for path in tmp_path.iterdir()
+                  if path.name.startswith('cal.json')) == ['cal.json', 'cal.json.lock']
+
+
+def test_failed_bulk_add_saves_nothing(tmp_path, data_file, capsys):
+    before = data_file.read_bytes()
+    entries = tmp_path / 'entries.txt'
+    entries.write_text("2024-05-01\tFirst\n2024-05-02\tSecond\nnot a date\tThird\n")
+    assert calendar_cli.main(['--data-file', str(data_file), 'bulk-add', str(entries)]) == 1
+    assert data_file.read_bytes() == before
+    assert not (tmp_path / 'cal.json.journal').exists()
+
+    entries.write_text("2024-05-01\tFirst\n2024-05-02\tSecond\n")
+    assert calendar_cli.main(['--data-file', str(data_file), 'bulk-add', str(entries)]) == 0
+    capsys.readouterr()
+    calendar_cli.main(['--data-file', str(data_file), 'list'])
+    assert capsys.readouterr().out == ("2015-01-02\tLong ago\n"
+                                       "2024-05-01\tFirst\n"
+                                       "2024-05-02\tSecond\n"
+                                       "2030-06-01\tDentist\n")
@@ -0,0 +1,59 @@
+import pytest
+
+from calendar_store import CalendarStore
+
+
+def open_store(path, backend):
+    store = CalendarStore(str(path), backend=backend, autosave=False)
+    store.load()
+    return store
+
+
+@pytest.fixture
+def stores(tmp_path):
+    stores = {}
+    for backend in ('json', 'sqlite'):
+        store = open_store(tmp_path / f'{backend}.json', backend)
+        with store.batch():
+            for day, text in [('2024-03-01', 'Dentist visit'),
+                              ('2024-03-01', 'Dentist visit'),
+                              ('2024-03-02', 'Dinner with Dana'),
+                              ('2024-03-03', 'team_sync review'),
+                              ('2024-03-04', 'Café Dentelle'),
+                              ('2024-03-05', 'Lunch')]:
+                store.add_appointment(day, text)
+            store.add_task('today', 'Call the dentist')
+            store.add_task('later', 'Dig the garden')
+        store.remove_appointment('2024-03-05', 0)
+        stores[backend] = store
+    yield stores
+    for store in stores.values():
+        store.close()
+
+
+@pytest.mark.parametrize('query', ['den', 'DENT vis', 'd', 'team_s', 'sync', 'caf', 'lunch',
+                                   'x', ''])
+def test_sqlite_search_matches_in_memory_search(stores, query):
+    assert stores['sqlite'].search(query) == stores['json'].search(query)
+
+
+def test_sqlite_search_limit(stores):
+    results, more = stores['sqlite'].search('d', 3)
+    assert len(results) == 3
+    assert more
+    assert stores['sqlite'].search('d', 6) == stores['json'].search('d', 6)
+
+
+def test_sqlite_search_keeps_appointments_out_of_memory(tmp_path, stores):
+    store = stores['sqlite']
+    assert all(kind != 'appt' for kind in store.search_index.kinds if kind)
+
+    # Edits saved by another instance are found without a sync
+    store.flush()
+    other = open_store(tmp_path / 'sqlite.json', 'sqlite')
+    other.add_appointment('2024-04-01', 'Dentist again')
+    other.remove_appointment('2024-03-02', 0)
+    other.close()
+    assert [where for kind, where, text in store.search('dent')[0] if kind == 'appt'] == [
+        '2024-03-01', '2024-03-04', '2024-04-01']
+    assert store.search('dana') == ([], False)
@@ -0,0 +1,191 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from calendar_store import CalendarStore
+
+
+def open_store(path, **kwargs):
+    store = CalendarStore(str(path), autosave=False, **kwargs)
+    store.load()
+    return store
+
+
+def contents(store):
+    appointments = {date_str: [(appt.text, appt.time, appt.duration) for appt in appts]
+                    for date_str, appts in store.iter_appointments(entries=True)}
+    tasks = {list_name: list(zip(store.task_list(list_name), store.task_done(list_name)))
+             for list_name in ('today', 'later')}
+    rules = sorted((rule['id'], rule['text'], rule['exceptions'])
+                   for rule in store.recurring_rules())
+    return appointments, tasks, rules
+
+
+def fill(store):
+    store.add_appointment('2024-03-01', 'Dentist', 9 * 60, 45)
+    store.add_appointment('2024-03-01', 'Call Sam')
+    store.add_appointment('2024-03-02', 'Lunch', 12 * 60)
+    store.add_task('today', 'Buy milk')
+    store.add_task('later', 'Paint fence')
+    store.add_task('later', 'Fix bike')
+    store.set_done('today', 0)
+    store.move_to_today(1)
+    rule_id = store.add_recurring('2024-01-01', 'Standup', 'weekly')
+    store.skip_occurrence(rule_id, '2024-01-08')
+    store.remove_appointment('2024-03-02', 0)
+
+
+def test_journal_round_trip(tmp_path):
+    path = tmp_path / 'cal.json'
+    store = open_store(path)
+    fill(store)
+    expected = contents(store)
+    store.close()
+    # A handful of edits only goes to the journal
+    assert not path.exists()
+    assert (tmp_path / 'cal.json.journal').exists()
+
+    store = open_store(path)
+    assert contents(store) == expected
+    store.storage.flush(compact=True)
+    store.close()
+    assert path.exists()
+    assert not (tmp_path / 'cal.json.journal').exists()
+
+    store = open_store(path)
+    assert contents(store) == expected
+    store.close()
+
+
+def test_partial_journal_record_is_dropped(tmp_path):
+    path = tmp_path / 'cal.json'
+    store = open_store(path)
+    fill(store)
+    expected = contents(store)
+    store.close()
+    journal = tmp_path / 'cal.json.journal'
+    size = journal.stat().st_size
+    with open(journal, 'ab') as f:
+        f.write(b'{"op":"add_task","list":"today","te')
+
+    store = open_store(path)
+    assert contents(store) == expected
+    assert journal.stat().st_size == size
+    store.add_task('today', 'After the crash')
+    store.close()
+    store = open_store(path)
+    assert store.todo_today[-1] == 'After the crash'
+    store.close()
+
+
+def test_archived_years_round_trip(tmp_path):
+    path = tmp_path / 'cal.json'
+    store = open_store(path)
+    store.add_appointment('2015-06-01', 'Old', 10 * 60)
+    store.add_appointment('2016-06-01', 'Older still')
+    store.add_appointment(f'{store.storage.archive.last_year() + 1}-06-01', 'Recent')
+    expected = contents(store)
+    store.storage.flush(compact=True)
+    store.close()
+    segments = sorted(os.listdir(tmp_path / 'cal.json.archive'))
+    assert [name[:4] for name in segments] == ['2015', '2016']
+    (tmp_path / 'cal.json.archive' / 'notes.txt').write_text("not ours")
+
+    store = open_store(path)
+    assert store.month_counts(2015, 6)[1] == 1
+    assert contents(store) == expected
+    # Editing an archived year replaces its segment and nothing else
+    store.add_appointment('2015-07-01', 'Edited')
+    store.storage.flush(compact=True)
+    store.close()
+    after = sorted(os.listdir(tmp_path / 'cal.json.archive'))
+    assert segments[0] not in after
+    assert segments[1] in after
+    assert 'notes.txt' in after
+
+    store = open_store(path)
+    assert store.appointments_on('2015-07-01') == ['Edited']
+    store.close()
+
+
+def test_corrupt_snapshot_keeps_archive(tmp_path):
+    path = tmp_path / 'cal.json'
+    store = open_store(path)
+    store.add_appointment('2015-06-01', 'Old')
+    store.add_appointment('2016-06-01', 'Older still')
+    store.storage.flush(compact=True)
+    store.close()
+    listed = [entry['file'] for entry in json.loads(path.read_text())['archive'].values()]
+    path.write_text(path.read_text()[:-20])
+
+    store = open_store(path)
+    assert contents(store)[0] == {}
+    store.add_appointment('2025-01-01', 'Fresh start')
+    store.storage.flush(compact=True)
+    store.close()
+
+    # The set-aside snapshot still has the segments it lists
+    aside = tmp_path / 'cal.json.corrupted.archive'
+    assert (tmp_path / 'cal.json.corrupted').exists()
+    for name in listed:
+        with gzip.open(aside / name, 'rt') as f:
+            assert json.load(f)['appointments']
+    store = open_store(path)
+    assert contents(store)[0] == {'2025-01-01': [('Fresh start', None, None)]}
+    store.close()
+
+
+def test_edits_from_another_instance_are_merged(tmp_path):
+    path = tmp_path / 'cal.json'
+    first = open_store(path)
+    second = open_store(path)
+    first.add_appointment('2024-05-05', 'From the first')
+    first.add_task('later', 'Shared task')
+    first.flush()
+    days, lists, rules = second.sync()
+    assert days == {'2024-05-05'}
+    assert lists == {'later'}
+    assert second.appointments_on('2024-05-05') == ['From the first']
+    assert second.todo_later == ['Shared task']
+
+    # A snapshot written by one makes the other read everything again
+    second.add_task('today', 'From the second')
+    second.flush()
+    second.storage.flush(compact=True)
+    assert first.sync() is not None
+    assert first.todo_today == ['From the second']
+    first.close()
+    second.close()
+
+
+def test_sqlite_migration_leaves_json_untouched(tmp_path):
+    path = tmp_path / 'cal.json'
+    store = open_store(path)
+    fill(store)
+    store.storage.flush(compact=True)
+    store.add_appointment('2024-04-01', 'Only in the journal', 8 * 60)
+    expected = contents(store)
+    store.close()
+    files = {name: (tmp_path / name).read_bytes() for name in ('cal.json', 'cal.json.journal')}
+
+    store = open_store(path, backend='sqlite')
+    assert contents(store) == expected
+    store.close()
+    assert {name: (tmp_path / name).read_bytes() for name in files} == files
+    assert (tmp_path / 'cal.db').exists()
+
+
+@pytest.mark.parametrize('backend', ['json', 'sqlite'])
+def test_close_without_save_drops_edits(tmp_path, backend):
+    path = tmp_path / 'cal.json'
+    store = open_store(path, backend=backend)
+    store.add_task('today', 'Kept')
+    store.close()
+    store = open_store(path, backend=backend)
+    store.add_task('today', 'Dropped')
+    store.close(save=False)
+    store = open_store(path, backend=backend)
+    assert store.todo_today == ['Kept']
+    store.close()
@@ -0,0 +1,82 @@
+import io
+
+import pytest
+
+from calendar_io import merge, read_records
+from calendar_store import CalendarStore
+
+
+def open_store(path, backend):
+    store = CalendarStore(str(path), backend=backend, autosave=False)
+    store.load()
+    return store
+
+
+def contents(store):
+    appointments = {date_str: [(appt.text, appt.time, appt.duration) for appt in appts]
+                    for date_str, appts in store.iter_appointments(entries=True)}
+    tasks = {list_name: list(zip(store.task_list(list_name), store.task_done(list_name)))
+             for list_name in ('today', 'later')}
+    return appointments, tasks, store.recurring_rules()
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def store_path(request, tmp_path):
+    path = tmp_path / 'cal.json'
+    store = open_store(path, request.param)
+    store.add_appointment('2024-03-01', 'Dentist', 9 * 60, 30)
+    store.add_appointment('2024-03-01', 'Call Sam')
+    store.add_task('today', 'Buy milk')
+    store.add_task('later', 'Paint fence')
+    store.close()
+    return path, request.param
+
+
+def test_failed_batch_is_rolled_back(store_path):
+    # The default store keeps no undo history; a failed batch is still undone
+    path, backend = store_path
+    store = open_store(path, backend)
+    assert store.undo_depth == 0
+    before = contents(store)
+    with pytest.raises(ValueError):
+        with store.batch():
+            store.add_appointment('2024-03-01', 'Planning', 8 * 60)
+            store.remove_appointment('2024-03-01', 0)
+            store.add_task('today', 'Half done')
+            store.set_done('today', 0)
+            store.move_to_today(0)
+            store.add_recurring('2024-01-01', 'Standup', 'weekly')
+            raise ValueError("bad row")
+    assert contents(store) == before
+    assert store.undo_stack == []
+    store.close()
+
+    store = open_store(path, backend)
+    assert contents(store) == before
+    store.close()
+
+
+def test_failed_import_keeps_nothing(store_path):
+    path, backend = store_path
+    store = open_store(path, backend)
+    before = contents(store)
+    rows = "date,text,time\n2024-03-02,Lunch,12:00\n2024-03-03,Gym,\n2024-13-45,Broken,\n"
+    with pytest.raises(ValueError):
+        merge(store, read_records(io.StringIO(rows), 'csv'))
+    assert contents(store) == before
+    store.close()
+
+
+def test_undo_reverses_a_batch(store_path):
+    path, backend = store_path
+    store = CalendarStore(str(path), backend=backend, autosave=False, undo_depth=10)
+    store.load()
+    before = contents(store)
+    with store.batch():
+        store.add_appointment('2024-03-01', 'Early', 7 * 60)
+        store.add_appointment('2024-03-01', 'Late', 18 * 60)
+        store.remove_task('today', 0)
+    assert len(store.undo_stack) == 1
+    assert store.undo()
+    assert contents(store) == before
+    store.close()